@@ -1,15 +1,59 @@
 import base64
+import contextvars
+import hashlib
 import json
-from typing import Dict, Optional, List
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, List, Union
+
+import requests
 from botocore.exceptions import ClientError
-from fastapi import HTTPException
+from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwk
+from jose.exceptions import JWKError
 from jose.utils import base64url_decode
 from pydantic import BaseModel
 from starlette.requests import Request
 from starlette.status import HTTP_403_FORBIDDEN
+from auth.revocation import is_revoked_locally
+from auth.upstream import UpstreamUnavailable
 from auth.user_auth import user_info_with_token
+from cache.cache import Cache, InMemoryCache, get_cache
+from observability.log import log_success
+from observability.tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+# How long an unknown key id is remembered, in seconds
+UNKNOWN_KID_TTL = float(os.environ.get("UNKNOWN_KID_TTL", "300"))
+# Maximum number of unknown key ids remembered
+UNKNOWN_KID_CACHE_SIZE = int(os.environ.get("UNKNOWN_KID_CACHE_SIZE", "1024"))
+# Minimum time between two JWKS downloads, in seconds
+JWKS_MIN_REFRESH_INTERVAL = float(os.environ.get("JWKS_MIN_REFRESH_INTERVAL", "60"))
+# What to do with a locally valid token when Cognito can not tell if it was
+# revoked: "deny" answers 503, "allow" accepts the token
+REVOCATION_CHECK_FALLBACK = os.environ.get("REVOCATION_CHECK_FALLBACK", "deny")
+# How tokens are checked against Cognito for revocation: "always" on every
+# request, "cached" once per REVOCATION_CACHE_TTL, "sampled" on a
+# REVOCATION_CHECK_SAMPLE_RATE fraction of requests, or "off"
+REVOCATION_CHECK = os.environ.get("REVOCATION_CHECK", "always")
+REVOCATION_CACHE_TTL = float(os.environ.get("REVOCATION_CACHE_TTL", "60"))
+REVOCATION_CHECK_SAMPLE_RATE = float(
+    os.environ.get("REVOCATION_CHECK_SAMPLE_RATE", "0.1")
+)
+# Clock skew tolerated when checking exp and iat, in seconds
+JWT_LEEWAY = float(os.environ.get("JWT_LEEWAY", "30"))
+# Threads verifying the signatures of a batch of tokens
+TOKEN_VERIFY_WORKERS = int(os.environ.get("TOKEN_VERIFY_WORKERS", os.cpu_count() or 1))
+# Batches up to this size are verified in the calling thread
+TOKEN_VERIFY_CHUNK_SIZE = int(os.environ.get("TOKEN_VERIFY_CHUNK_SIZE", "64"))
 
 # Define the type for JWK
 JWK = Dict[str, str]
@@ -31,10 +75,102 @@ class JWTAuthorizationCredentials(BaseModel):
 
 # Class to handle JWT authentication
 class JWTBearer(HTTPBearer):
-    def __init__(self, jwks: JWKS, auto_error: bool = True):
+    def __init__(
+        self,
+        jwks: JWKS,
+        auto_error: bool = True,
+        jwks_url: Optional[str] = None,
+        issuer: Optional[str] = None,
+        client_ids: Optional[List[str]] = None,
+        token_use: Optional[str] = "access",
+        leeway: float = JWT_LEEWAY,
+    ):
         super().__init__(auto_error=auto_error)
+        # Expected claims, None skips the check
+        self.issuer = issuer
+        self.client_ids = client_ids
+        self.token_use = token_use
+        self.leeway = leeway
         # Map KIDs to their corresponding JWKs
         self.kid_to_jwk = {jwk["kid"]: jwk for jwk in jwks.keys}
+        # Map KIDs to their constructed public keys, built on first use
+        self.kid_to_key = {}
+        # URL used to pick up rotated keys, if any
+        self.jwks_url = jwks_url
+        self.jwks_refreshed_at = time.monotonic()
+        self.jwks_lock = threading.Lock()
+        # KIDs that are not in the JWKS, even after a refresh
+        self.unknown_kids = InMemoryCache(max_entries=UNKNOWN_KID_CACHE_SIZE)
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def refresh_jwks(self) -> bool:
+        """
+        Download the JWKS again, at most once every JWKS_MIN_REFRESH_INTERVAL.
+
+        :return: True if the JWKS was downloaded, otherwise False.
+        """
+        if self.jwks_url is None:
+            return False
+
+        with self.jwks_lock:
+            if time.monotonic() - self.jwks_refreshed_at < JWKS_MIN_REFRESH_INTERVAL:
+                return False
+            self.jwks_refreshed_at = time.monotonic()
+
+            try:
+                response = requests.get(self.jwks_url, timeout=5)
+                jwks = JWKS.model_validate(response.json())
+            except Exception:
+                return False
+
+            self.kid_to_jwk = {jwk["kid"]: jwk for jwk in jwks.keys}
+            self.kid_to_key = {}
+            return True
+
+    def get_public_key(self, kid: Optional[str]) -> JWK:
+        """
+        Get the JWK of a key id.
+
+        Unknown key ids trigger a JWKS refresh, at most one per
+        JWKS_MIN_REFRESH_INTERVAL. A key id still missing from a JWKS that
+        was actually downloaded is remembered for UNKNOWN_KID_TTL, so repeated
+        tokens with a bad key id are rejected without contacting Cognito.
+
+        :param kid: Key id from the JWT header.
+        :return: JWK of the key id.
+
+        :raises HTTPException: If the key id is unknown.
+        """
+        public_key = self.kid_to_jwk.get(kid)
+        if public_key is not None:
+            return public_key
+
+        if kid is not None and not self.unknown_kids.get(kid):
+            # A skipped or failed refresh says nothing about the key id
+            if self.refresh_jwks():
+                public_key = self.kid_to_jwk.get(kid)
+                if public_key is not None:
+                    return public_key
+                self.unknown_kids.set(kid, True, ttl=UNKNOWN_KID_TTL)
+
+        raise HTTPException(
+            status_code=HTTP_403_FORBIDDEN, detail="JWK public key not found"
+        )
+
+    def get_verification_key(self, kid: Optional[str]):
+        """
+        Get the constructed public key of a key id, building it only once.
+
+        :param kid: Key id from the JWT header.
+        :return: Public key.
+
+        :raises HTTPException: If the key id is unknown.
+        """
+        key = self.kid_to_key.get(kid)
+        if key is None:
+            key = jwk.construct(self.get_public_key(kid))
+            self.kid_to_key[kid] = key
+        return key
 
     def decode_jwt(self, token: str):
         """
@@ -62,32 +198,32 @@ class JWTBearer(HTTPBearer):
 
         :param jwt_credentials: JWTAuthorizationCredentials object.
         :return: True if the token is valid, otherwise False.
+
+        :raises HTTPException: If the key id is unknown or the signature is malformed.
         """
+        key = self.get_verification_key(jwt_credentials.header.get("kid"))
         try:
-            public_key = self.kid_to_jwk[jwt_credentials.header["kid"]]
-        except KeyError:
-            raise HTTPException(
-                status_code=HTTP_403_FORBIDDEN, detail="JWK public key not found"
-            )
-
-        # Construct the public key
-        key = jwk.construct(public_key)
-        # Decode the signature
-        decoded_signature = base64url_decode(jwt_credentials.signature.encode())
+            # Decode the signature
+            decoded_signature = base64url_decode(jwt_credentials.signature.encode())
 
-        # Verify the token's signature
-        return key.verify(jwt_credentials.message.encode(), decoded_signature)
+            # Verify the token's signature
+            return key.verify(jwt_credentials.message.encode(), decoded_signature)
+        except (ValueError, JWKError):
+            raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="JWK invalid")
 
     def verify_token_revoed(self, jwt_token: str):
         """
         Verify if the token is revoked.
 
         :param jwt_token: JWT token to verify.
+        :return: True if Cognito was asked, False if it was unavailable and
+            REVOCATION_CHECK_FALLBACK let the token through.
 
         :raises HTTPException: If the token is revoked.
         """
         try:
             user_info_with_token(jwt_token)
+            return True
         except ClientError as e:
             # Verifica se a exceção é 'NotAuthorizedException', ou seja, o token foi revogado
             if e.response["Error"]["Code"] == "NotAuthorizedException":
@@ -97,18 +233,27 @@ class JWTBearer(HTTPBearer):
                 )
             else:
                 raise  # Levanta outras exceções de boto3
-        except Exception as e:
+        except UpstreamUnavailable:
+            # Cognito is unavailable, the token was already verified locally
+            if REVOCATION_CHECK_FALLBACK != "allow":
+                raise  # Answered by the app with a 503
+            return False
+        except Exception:
             # Qualquer outra exceção que precise ser tratada
+            logger.exception("Error checking whether a token was revoked")
             raise HTTPException(
                 status_code=HTTP_403_FORBIDDEN,
                 detail="An error occurred while validating the token",
             )
 
-    async def __call__(self, request: Request) -> Optional[JWTAuthorizationCredentials]:
+    async def __call__(
+        self, request: Request, cache: Cache = Depends(get_cache)
+    ) -> Optional[JWTAuthorizationCredentials]:
         """
         Call method to authenticate the request.
 
         :param request: Incoming request.
+        :param cache: Cache remembering tokens checked with Cognito.
         :return: JWTAuthorizationCredentials object if valid, otherwise raise an HTTPException.
 
         :raises HTTPException: If the JWT is invalid.
@@ -123,13 +268,51 @@ class JWTBearer(HTTPBearer):
 
         jwt_token = credentials.credentials
 
-        # Validate if token is revoked
-        self.verify_token_revoed(jwt_token)
+        try:
+            # In the threadpool: an unknown kid may download the JWKS
+            with start_span("JWTBearer.verify_token") as span:
+                jwt_credentials = await run_in_threadpool(self.verify_token, jwt_token)
+                span.set_attribute("jwt.kid", jwt_credentials.header.get("kid") or "")
+
+            # Validate if token is revoked, only once the local checks passed
+            with start_span(
+                "JWTBearer.check_revocation",
+                attributes={"jwt.revocation_check": REVOCATION_CHECK},
+            ):
+                await run_in_threadpool(
+                    self.check_revocation,
+                    jwt_token,
+                    float(jwt_credentials.claims["exp"]),
+                    cache,
+                )
+        except HTTPException as e:
+            logger.info("Token rejected", extra={"reason": e.detail})
+            raise
+
+        log_success(
+            logger,
+            "Token accepted",
+            username=jwt_credentials.claims.get("username"),
+            kid=jwt_credentials.header.get("kid"),
+        )
+        return jwt_credentials  # Return the JWT credentials if valid
+
+    def verify_token(self, jwt_token: str) -> JWTAuthorizationCredentials:
+        """
+        Verify a JWT token locally: structure, claims, signature and tokens
+        logged out through this service.
+
+        :param jwt_token: JWT token to verify.
+        :return: JWTAuthorizationCredentials object if valid.
 
+        :raises HTTPException: If the JWT is invalid.
+        """
         self.validate_jwt_structure(jwt_token)
 
         try:
             decoded_header, claims = self.decode_jwt(jwt_token)
+            if claims is not None:
+                self.verify_claims(claims)
             jwt_credentials = self.create_jwt_credentials(
                 jwt_token, decoded_header, claims
             )
@@ -142,7 +325,151 @@ class JWTBearer(HTTPBearer):
         if not self.verify_jwk_token(jwt_credentials):
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="JWK invalid")
 
-        return jwt_credentials  # Return the JWT credentials if valid
+        # Tokens logged out through this service are revoked at once
+        if is_revoked_locally(jwt_token):
+            raise HTTPException(
+                status_code=HTTP_403_FORBIDDEN, detail="Access token has been revoked"
+            )
+
+        return jwt_credentials
+
+    def verify_tokens(
+        self, jwt_tokens: List[str]
+    ) -> List[Union[JWTAuthorizationCredentials, HTTPException]]:
+        """
+        Verify a batch of JWT tokens locally.
+
+        Repeated tokens are verified once, tokens are grouped by key id so
+        each key is resolved and constructed once (and an unknown key id
+        fails its whole group at once), and large batches are verified in
+        parallel chunks on a thread pool.
+
+        :param jwt_tokens: JWT tokens to verify.
+        :return: For each token, in order, its credentials or the
+            HTTPException explaining why it is invalid.
+        """
+        with start_span(
+            "JWTBearer.verify_tokens", attributes={"jwt.tokens": len(jwt_tokens)}
+        ):
+            return self._verify_tokens(jwt_tokens)
+
+    def _verify_tokens(
+        self, jwt_tokens: List[str]
+    ) -> List[Union[JWTAuthorizationCredentials, HTTPException]]:
+        results = {}
+        by_kid = defaultdict(list)
+        for jwt_token in dict.fromkeys(jwt_tokens):
+            try:
+                self.validate_jwt_structure(jwt_token)
+            except HTTPException as e:
+                results[jwt_token] = e
+                continue
+            header, _ = self.decode_jwt(jwt_token)
+            kid = header.get("kid") if isinstance(header, dict) else None
+            if not isinstance(kid, str):
+                # Rejected on its own, e.g. a header that is not an object
+                results.update(self._verify_chunk([jwt_token]))
+            else:
+                by_kid[kid].append(jwt_token)
+
+        chunks = []
+        for kid, group in by_kid.items():
+            try:
+                self.get_verification_key(kid)
+            except HTTPException as e:
+                results.update(dict.fromkeys(group, e))
+                continue
+            for start in range(0, len(group), TOKEN_VERIFY_CHUNK_SIZE):
+                chunks.append(group[start : start + TOKEN_VERIFY_CHUNK_SIZE])
+
+        if len(chunks) == 1:
+            results.update(self._verify_chunk(chunks[0]))
+        elif chunks:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=TOKEN_VERIFY_WORKERS)
+            # Each chunk runs in a copy of the request context, for its logs
+            contexts = [contextvars.copy_context() for _ in chunks]
+            for verified in self.executor.map(
+                lambda context, chunk: context.run(self._verify_chunk, chunk),
+                contexts,
+                chunks,
+            ):
+                results.update(verified)
+
+        return [results[jwt_token] for jwt_token in jwt_tokens]
+
+    def _verify_chunk(self, jwt_tokens: List[str]) -> dict:
+        verified = {}
+        for jwt_token in jwt_tokens:
+            try:
+                verified[jwt_token] = self.verify_token(jwt_token)
+            except HTTPException as e:
+                verified[jwt_token] = e
+        return verified
+
+    def verify_claims(self, claims: dict):
+        """
+        Verify the expiry, issuer, audience and use of a token.
+
+        :param claims: Decoded JWT claims.
+
+        :raises HTTPException: If a claim is missing or does not match.
+        """
+        now = time.time()
+        try:
+            expires_at = float(claims["exp"])
+            issued_at = float(claims.get("iat", now))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(
+                status_code=HTTP_403_FORBIDDEN, detail="Invalid token timestamps"
+            )
+
+        if expires_at + self.leeway < now:
+            raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Token expired")
+        if issued_at - self.leeway > now:
+            raise HTTPException(
+                status_code=HTTP_403_FORBIDDEN, detail="Token issued in the future"
+            )
+        if self.issuer is not None and claims.get("iss") != self.issuer:
+            raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Invalid issuer")
+        if self.token_use is not None and claims.get("token_use") != self.token_use:
+            raise HTTPException(
+                status_code=HTTP_403_FORBIDDEN, detail="Invalid token use"
+            )
+        # Access tokens carry the app client in client_id, ID tokens in aud
+        audience = claims.get("client_id") or claims.get("aud")
+        if self.client_ids is not None and audience not in self.client_ids:
+            raise HTTPException(
+                status_code=HTTP_403_FORBIDDEN, detail="Invalid audience"
+            )
+
+    def check_revocation(self, jwt_token: str, expires_at: float, cache: Cache):
+        """
+        Ask Cognito whether a locally valid token was revoked, as configured
+        by REVOCATION_CHECK.
+
+        :param jwt_token: JWT token to check.
+        :param expires_at: Expiry of the token, as a UNIX timestamp.
+        :param cache: Cache remembering tokens checked with Cognito.
+
+        :raises HTTPException: If the token is revoked.
+        """
+        if REVOCATION_CHECK == "off":
+            return
+        if REVOCATION_CHECK == "sampled":
+            if random.random() < REVOCATION_CHECK_SAMPLE_RATE:
+                self.verify_token_revoed(jwt_token)
+            return
+        if REVOCATION_CHECK == "cached":
+            key = f"token-checked:{hashlib.sha256(jwt_token.encode()).hexdigest()}"
+            if cache.get(key):
+                return
+            if self.verify_token_revoed(jwt_token):
+                ttl = min(REVOCATION_CACHE_TTL, expires_at - time.time())
+                if ttl > 0:
+                    cache.set(key, True, ttl=ttl)
+            return
+        self.verify_token_revoed(jwt_token)
 
     def verify_authentication_scheme(self, credentials: HTTPAuthorizationCredentials):
         """
@@ -0,0 +1,46 @@
+import hmac
+import os
+from typing import List
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.security import APIKeyHeader
+from starlette.requests import Request
+from starlette.status import HTTP_403_FORBIDDEN
+
+load_dotenv()
+
+# API keys of the gateways and services allowed to introspect tokens, comma
+# separated. When unset, nobody is
+INTROSPECT_API_KEYS = [
+    key for key in os.environ.get("INTROSPECT_API_KEYS", "").split(",") if key
+]
+
+
+class APIKeyAuth(APIKeyHeader):
+    """FastAPI dependency authenticating internal callers by a shared API key."""
+
+    def __init__(self, keys: List[str], name: str = "X-API-Key"):
+        super().__init__(name=name, auto_error=True)
+        self.keys = keys
+
+    async def __call__(self, request: Request) -> str:
+        """
+        Check the API key of the request.
+
+        :param request: Incoming request.
+        :return: API key of the caller.
+
+        :raises HTTPException: If the API key is missing or unknown.
+        """
+        api_key = await super().__call__(request)
+
+        # Compared in constant time, so a key can not be guessed byte by byte
+        if not any(
+            hmac.compare_digest(api_key.encode(), key.encode()) for key in self.keys
+        ):
+            raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Invalid API key")
+        return api_key
+
+
+introspect_auth = APIKeyAuth(INTROSPECT_API_KEYS)
@@ -10,14 +10,25 @@ load_dotenv()
 AWS_REGION = os.environ.get("AWS_REGION")
 USER_POOL_ID = os.environ.get("USER_POOL_ID")
 
+ISSUER = f"https://cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}"
+JWKS_URL = f"{ISSUER}/.well-known/jwks.json"
+# App clients whose tokens are accepted, comma separated
+CLIENT_IDS = [
+    client_id
+    for client_id in os.environ.get(
+        "COGNITO_ALLOWED_CLIENT_IDS", os.environ.get("COGNITO_USER_CLIENT_ID", "")
+    ).split(",")
+    if client_id
+]
+
 # Get the JWKS from the Cognito User Pool
-response = requests.get(
-    f"https://cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json"
-)
+response = requests.get(JWKS_URL)
 
 jwks = JWKS.model_validate(response.json())
 
-auth = JWTBearer(jwks)
+auth = JWTBearer(
+    jwks, jwks_url=JWKS_URL, issuer=ISSUER, client_ids=CLIENT_IDS or None
+)
 
 
 async def get_current_user(
@@ -33,4 +44,4 @@ async def get_current_user(
     try:
         return credentials.claims["username"]
     except KeyError:
-        HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Username missing")
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Username missing")
@@ -0,0 +1,229 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Callable, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+from starlette.requests import Request
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+
+from cache.cache import Cache, InMemoryCache, get_cache
+
+load_dotenv()
+
+# "memory" keeps buckets per process, "cache" shares them through CACHE_URL
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")
+SIGN_IN_RATE_LIMIT_BURST = int(os.environ.get("SIGN_IN_RATE_LIMIT_BURST", "10"))
+SIGN_IN_RATE_LIMIT_PER_SECOND = float(
+    os.environ.get("SIGN_IN_RATE_LIMIT_PER_SECOND", "1")
+)
+# Every signed in session refreshes its access token about once an hour,
+# which must not use up the sign-in budget
+REFRESH_RATE_LIMIT_BURST = int(os.environ.get("REFRESH_RATE_LIMIT_BURST", "20"))
+REFRESH_RATE_LIMIT_PER_SECOND = float(
+    os.environ.get("REFRESH_RATE_LIMIT_PER_SECOND", "5")
+)
+USER_RATE_LIMIT_BURST = int(os.environ.get("USER_RATE_LIMIT_BURST", "30"))
+USER_RATE_LIMIT_PER_SECOND = float(os.environ.get("USER_RATE_LIMIT_PER_SECOND", "5"))
+# Introspection is charged per token, so the burst must be at least
+# INTROSPECT_MAX_TOKENS for the largest batches to go through
+INTROSPECT_RATE_LIMIT_BURST = int(
+    os.environ.get("INTROSPECT_RATE_LIMIT_BURST", "2000")
+)
+INTROSPECT_RATE_LIMIT_PER_SECOND = float(
+    os.environ.get("INTROSPECT_RATE_LIMIT_PER_SECOND", "1000")
+)
+
+
+def refill_bucket(
+    state: Tuple[float, float], capacity: int, rate: float, now: float, cost: int = 1
+) -> Tuple[Tuple[float, float], float]:
+    """
+    Take tokens from a token bucket.
+
+    :param state: Tokens left and time of the last update.
+    :param capacity: Maximum number of tokens.
+    :param rate: Tokens added per second.
+    :param now: Current time.
+    :param cost: Number of tokens to take.
+    :return: The new state and 0 if the tokens were taken, otherwise the
+        seconds to wait for enough tokens.
+    """
+    tokens, updated_at = state
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / rate
+
+
+class InMemoryRateLimitStore:
+    """Token buckets kept in this process."""
+
+    def __init__(self, max_entries: int = 100000):
+        self.buckets = InMemoryCache(max_entries=max_entries)
+        self.lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, rate: float, cost: int = 1) -> float:
+        """
+        Take tokens from the bucket of a key.
+
+        :return: 0 if the tokens were taken, otherwise the seconds to wait.
+        """
+        with self.lock:
+            now = time.monotonic()
+            state = self.buckets.get(key) or (capacity, now)
+            state, retry_after = refill_bucket(state, capacity, rate, now, cost)
+            self.buckets.set(key, state, ttl=capacity / rate)
+            return retry_after
+
+
+class CacheRateLimitStore:
+    """
+    Token buckets shared through a Cache backend.
+
+    Each update runs under a short lock key taken with Cache.add, so buckets
+    stay consistent across replicas without server-side scripting.
+    """
+
+    def __init__(self, cache: Cache, lock_timeout: float = 0.05):
+        self.cache = cache
+        self.lock_timeout = lock_timeout
+
+    def take(self, key: str, capacity: int, rate: float, cost: int = 1) -> float:
+        bucket_key = f"rate-limit:{key}"
+        lock_key = f"{bucket_key}:lock"
+        deadline = time.monotonic() + self.lock_timeout
+        while not self.cache.add(lock_key, 1, ttl=1):
+            if time.monotonic() >= deadline:
+                # Fail open: a slow shared store must not block requests
+                return 0.0
+            time.sleep(0.001)
+
+        try:
+            now = time.time()
+            state = self.cache.get(bucket_key) or (capacity, now)
+            state, retry_after = refill_bucket(state, capacity, rate, now, cost)
+            self.cache.set(bucket_key, list(state), ttl=capacity / rate)
+            return retry_after
+        finally:
+            self.cache.delete(lock_key)
+
+
+def client_ip_key(request: Request) -> str:
+    """
+    Rate limit key of the client IP.
+
+    Behind the gateway, uvicorn runs with ``--proxy-headers`` and
+    FORWARDED_ALLOW_IPS set to the gateway networks (see prod.dockerfile), so
+    that the client address comes from its X-Forwarded-For header instead of
+    every client sharing the gateway's bucket.
+    """
+    return request.client.host if request.client else "unknown"
+
+
+def access_token_key(request: Request) -> str:
+    """
+    Rate limit key of the user session, i.e. its bearer token.
+
+    The token is not verified yet at this point, so unverified claims are not
+    trusted: hashing the whole token means a forged token can never drain the
+    bucket of another user.
+    """
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return f"ip:{client_ip_key(request)}"
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+def api_key_key(request: Request) -> str:
+    """
+    Rate limit key of an internal caller, i.e. its API key.
+
+    Only used once the API key is authenticated. It is hashed so that keys
+    are not written to a shared store.
+    """
+    return hashlib.sha256(request.headers.get("x-api-key", "").encode()).hexdigest()
+
+
+class RateLimiter:
+    """
+    FastAPI dependency rejecting requests over a token-bucket rate.
+
+    It is a plain function so that FastAPI runs it in the threadpool: a
+    shared store does blocking network I/O and may wait on its lock key.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        rate: float,
+        key_func: Callable[[Request], str] = client_ip_key,
+        store=None,
+    ):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self.key_func = key_func
+        self.store = store
+
+    def get_store(self, cache: Cache):
+        if self.store is not None:
+            return self.store
+        if RATE_LIMIT_STORE == "cache":
+            return CacheRateLimitStore(cache)
+        self.store = InMemoryRateLimitStore()
+        return self.store
+
+    def __call__(self, request: Request, cache: Cache = Depends(get_cache)):
+        """
+        Take a token for the request.
+
+        :param request: Incoming request.
+        :param cache: Cache holding the buckets when RATE_LIMIT_STORE is "cache".
+
+        :raises HTTPException: If the client is over its rate.
+        """
+        self.check(request, cache)
+
+    def check(self, request: Request, cache: Cache, cost: int = 1):
+        """
+        Take tokens for the request, e.g. one per item of a batch.
+
+        Blocking, call it from the threadpool.
+
+        :param request: Incoming request.
+        :param cache: Cache holding the buckets when RATE_LIMIT_STORE is "cache".
+        :param cost: Number of tokens to take.
+
+        :raises HTTPException: If the client is over its rate.
+        """
+        key = f"{self.name}:{self.key_func(request)}"
+        retry_after = self.get_store(cache).take(key, self.capacity, self.rate, cost)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+sign_in_rate_limit = RateLimiter(
+    "sign-in", SIGN_IN_RATE_LIMIT_BURST, SIGN_IN_RATE_LIMIT_PER_SECOND
+)
+refresh_rate_limit = RateLimiter(
+    "refresh", REFRESH_RATE_LIMIT_BURST, REFRESH_RATE_LIMIT_PER_SECOND
+)
+user_rate_limit = RateLimiter(
+    "user", USER_RATE_LIMIT_BURST, USER_RATE_LIMIT_PER_SECOND, key_func=access_token_key
+)
+# Charged per token by the introspection route, see RateLimiter.check
+introspect_rate_limit = RateLimiter(
+    "introspect",
+    INTROSPECT_RATE_LIMIT_BURST,
+    INTROSPECT_RATE_LIMIT_PER_SECOND,
+    key_func=api_key_key,
+)
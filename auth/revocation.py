@@ -0,0 +1,258 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from auth.upstream import UpstreamUnavailable
+from auth.user_auth import logout_with_token
+from db.database import SessionLocal
+from db.routing import use_primary
+from models.revocation import utcnow
+from observability.log import log_success
+from repositories.revocationRepo import (
+    add_revocation,
+    delete_expired_revocations,
+    get_active_revocations,
+    get_pending_revocations,
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Revocations sent to Cognito per outbox transaction
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "50"))
+# Time between two outbox drains, in seconds
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_RETRY_BASE_DELAY = float(os.environ.get("OUTBOX_RETRY_BASE_DELAY", "1"))
+OUTBOX_RETRY_MAX_DELAY = float(os.environ.get("OUTBOX_RETRY_MAX_DELAY", "300"))
+# How long rows of expired tokens are kept, in seconds
+OUTBOX_RETENTION = float(os.environ.get("OUTBOX_RETENTION", "86400"))
+# Time between two loads of the revocations made by other replicas, in seconds
+REVOCATION_SYNC_INTERVAL = float(os.environ.get("REVOCATION_SYNC_INTERVAL", "1"))
+# Revocations created up to this long before the previous load are loaded
+# again, for transactions that committed late and clocks that drift, in seconds
+REVOCATION_SYNC_OVERLAP = float(os.environ.get("REVOCATION_SYNC_OVERLAP", "30"))
+# Revocations are kept this long after their token expires, since expired
+# tokens are accepted for the clock skew tolerated by JWT_LEEWAY, in seconds
+REVOCATION_KEEP_AFTER_EXPIRY = float(os.environ.get("JWT_LEEWAY", "30"))
+
+
+class RevocationSet:
+    """
+    Hashes of the revoked tokens of every replica, until the tokens expire.
+
+    Unlike the cache, entries are never evicted, so a logged out token can
+    not become valid again. It holds one entry per logout within the
+    lifetime of an access token, and is kept up to date by load_revocations.
+    """
+
+    def __init__(self):
+        self.expires_at: Dict[str, float] = {}
+        # Time of the last load from the outbox, None before the first one
+        self.loaded_at: Optional[datetime.datetime] = None
+        self.lock = threading.Lock()
+
+    def add(self, token_hash: str, expires_at: float):
+        with self.lock:
+            self.expires_at[token_hash] = expires_at
+
+    def __contains__(self, token_hash: str) -> bool:
+        return token_hash in self.expires_at
+
+    def __len__(self) -> int:
+        return len(self.expires_at)
+
+    def prune(self, now: float):
+        """Drop the revocations of tokens that are no longer accepted anyway."""
+        with self.lock:
+            self.expires_at = {
+                token_hash: expires_at
+                for token_hash, expires_at in self.expires_at.items()
+                if expires_at + REVOCATION_KEEP_AFTER_EXPIRY > now
+            }
+
+
+revoked_tokens = RevocationSet()
+
+
+def hash_token(jwt_token: str) -> str:
+    return hashlib.sha256(jwt_token.encode()).hexdigest()
+
+
+def revoke_locally(token_hash: str, expires_at: float):
+    """
+    Mark a token as revoked for this replica's auth checks until it expires.
+
+    :param token_hash: SHA-256 of the access token.
+    :param expires_at: Expiry of the token, as a UNIX timestamp.
+    """
+    if expires_at + REVOCATION_KEEP_AFTER_EXPIRY > time.time():
+        revoked_tokens.add(token_hash, expires_at)
+
+
+def is_revoked_locally(jwt_token: str) -> bool:
+    """
+    Whether a token was logged out through this service, on any replica
+    (see load_revocations).
+
+    :param jwt_token: JWT token to check.
+    :return: True if the token is revoked, otherwise False.
+    """
+    return hash_token(jwt_token) in revoked_tokens
+
+
+def revoke_token(
+    jwt_token: str, username: Optional[str], expires_at: float, db: Session
+):
+    """
+    Revoke a token: at once for this service, and through the outbox for
+    Cognito.
+
+    :param jwt_token: Access token to revoke.
+    :param username: Username of the token owner.
+    :param expires_at: Expiry of the token, as a UNIX timestamp.
+    :param db: Database session.
+    """
+    token_hash = hash_token(jwt_token)
+    revoke_locally(token_hash, expires_at)
+    add_revocation(
+        token_hash=token_hash,
+        access_token=jwt_token,
+        username=username,
+        expires_at=datetime.datetime.fromtimestamp(
+            expires_at, datetime.timezone.utc
+        ).replace(tzinfo=None),
+        db=db,
+    )
+
+
+def load_revocations(db: Session) -> int:
+    """
+    Mark the tokens in the outbox as revoked for this replica: every one that
+    has not expired on the first load, then those added since the previous
+    load, including the logouts of other replicas.
+
+    :param db: Database session.
+    :return: Number of tokens marked.
+    """
+    now = utcnow()
+    created_after = None
+    if revoked_tokens.loaded_at is not None:
+        created_after = revoked_tokens.loaded_at - datetime.timedelta(
+            seconds=REVOCATION_SYNC_OVERLAP
+        )
+
+    # A lagging replica could miss the latest logouts
+    use_primary(db)
+    rows = get_active_revocations(
+        now - datetime.timedelta(seconds=REVOCATION_KEEP_AFTER_EXPIRY),
+        db,
+        created_after=created_after,
+    )
+    for token_hash, expires_at in rows:
+        revoke_locally(
+            token_hash, expires_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        )
+    revoked_tokens.prune(time.time())
+    revoked_tokens.loaded_at = now
+    return len(rows)
+
+
+def load_revocations_once() -> int:
+    db = SessionLocal()
+    try:
+        return load_revocations(db)
+    finally:
+        db.close()
+
+
+async def run_revocation_sync():
+    """Load new revocations every REVOCATION_SYNC_INTERVAL, forever."""
+    while True:
+        await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+        try:
+            await run_in_threadpool(load_revocations_once)
+        except Exception:
+            logger.exception("Error loading revocations")
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter after a failed attempt, in seconds."""
+    delay = min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1)
+
+
+def drain_outbox(db: Session, now: Optional[datetime.datetime] = None) -> int:
+    """
+    Send one batch of pending revocations to Cognito.
+
+    Failed revocations are retried later with exponential backoff. When
+    Cognito is unavailable the rest of the batch is left for the next drain.
+
+    :param db: Database session.
+    :param now: Current time.
+    :return: Number of revocations sent.
+    """
+    now = now or utcnow()
+    sent = 0
+
+    # The rows are locked and updated on the primary
+    use_primary(db)
+    for row in get_pending_revocations(OUTBOX_BATCH_SIZE, now, db):
+        unavailable = False
+        try:
+            done = logout_with_token(row.access_token)
+        except ClientError as e:
+            # The token is already revoked or expired, nothing left to do
+            done = e.response["Error"]["Code"] == "NotAuthorizedException"
+        except UpstreamUnavailable:
+            done, unavailable = False, True
+        except Exception:
+            logger.exception("Error sending a revocation", extra={"outbox_id": row.id})
+            done = False
+
+        if done:
+            row.sent_at = now
+            row.access_token = None
+            sent += 1
+            log_success(logger, "Revocation sent", outbox_id=row.id)
+        else:
+            row.attempts += 1
+            row.next_attempt_at = now + datetime.timedelta(
+                seconds=retry_delay(row.attempts)
+            )
+        if unavailable:
+            break
+
+    db.commit()
+    delete_expired_revocations(now - datetime.timedelta(seconds=OUTBOX_RETENTION), db)
+    return sent
+
+
+def drain_outbox_once() -> int:
+    db = SessionLocal()
+    try:
+        return drain_outbox(db)
+    finally:
+        db.close()
+
+
+async def run_outbox_worker():
+    """Drain the revocation outbox every OUTBOX_POLL_INTERVAL, forever."""
+    while True:
+        try:
+            await run_in_threadpool(drain_outbox_once)
+        except Exception:
+            logger.exception("Error draining the revocation outbox")
+        await asyncio.sleep(OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,377 @@
+import functools
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+from opentelemetry import trace
+from opentelemetry.trace import SpanKind
+
+from observability.log import log_success
+from observability.tracing import start_span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Concurrency limits of the calls made to Cognito
+UPSTREAM_INITIAL_CONCURRENCY = int(os.environ.get("UPSTREAM_INITIAL_CONCURRENCY", "20"))
+UPSTREAM_MIN_CONCURRENCY = int(os.environ.get("UPSTREAM_MIN_CONCURRENCY", "2"))
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", "100"))
+# Latency above which Cognito is considered overloaded, in seconds
+UPSTREAM_TARGET_LATENCY = float(os.environ.get("UPSTREAM_TARGET_LATENCY", "0.5"))
+# Failure rate over the last UPSTREAM_BREAKER_WINDOW calls that opens the breaker
+UPSTREAM_BREAKER_FAILURE_RATE = float(
+    os.environ.get("UPSTREAM_BREAKER_FAILURE_RATE", "0.5")
+)
+UPSTREAM_BREAKER_WINDOW = int(os.environ.get("UPSTREAM_BREAKER_WINDOW", "20"))
+UPSTREAM_BREAKER_MIN_CALLS = int(os.environ.get("UPSTREAM_BREAKER_MIN_CALLS", "10"))
+# Time the breaker stays open before letting a trial call through, in seconds
+UPSTREAM_BREAKER_RESET_TIMEOUT = float(
+    os.environ.get("UPSTREAM_BREAKER_RESET_TIMEOUT", "30")
+)
+UPSTREAM_MAX_ATTEMPTS = int(os.environ.get("UPSTREAM_MAX_ATTEMPTS", "3"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get("UPSTREAM_RETRY_BASE_DELAY", "0.1"))
+# Retries allowed per call made, on top of UPSTREAM_RETRY_MIN_PER_SECOND
+UPSTREAM_RETRY_RATIO = float(os.environ.get("UPSTREAM_RETRY_RATIO", "0.1"))
+UPSTREAM_RETRY_MIN_PER_SECOND = float(
+    os.environ.get("UPSTREAM_RETRY_MIN_PER_SECOND", "1")
+)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call to an upstream service is shed or fails fast."""
+
+    def __init__(self, detail: str, retry_after: float = 1.0):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of concurrent calls to an upstream service.
+
+    The limit follows an AIMD scheme: it grows by one slot per "window" of
+    fast, successful calls and shrinks by ``backoff`` whenever a call is slow
+    or fails. Calls above the limit are rejected at once with
+    UpstreamUnavailable instead of waiting in an unbounded queue.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = UPSTREAM_INITIAL_CONCURRENCY,
+        min_limit: int = UPSTREAM_MIN_CONCURRENCY,
+        max_limit: int = UPSTREAM_MAX_CONCURRENCY,
+        target_latency: float = UPSTREAM_TARGET_LATENCY,
+        backoff: float = 0.9,
+        is_failure: Optional[Callable[[Exception], bool]] = None,
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.is_failure = is_failure or (lambda exc: True)
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a slot.
+
+        :raises UpstreamUnavailable: If every slot is taken.
+        """
+        with self.lock:
+            if self.in_flight >= math.floor(self.limit):
+                raise UpstreamUnavailable(
+                    f"Too many concurrent requests to {self.name}",
+                    retry_after=max(1.0, self.target_latency),
+                )
+            self.in_flight += 1
+
+    def release(self, latency: float, failed: bool = False):
+        """
+        Give a slot back and adjust the limit.
+
+        :param latency: Duration of the call, in seconds.
+        :param failed: Whether the call failed.
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if failed or latency > self.target_latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def limited(self, func):
+        """Decorator that runs a function inside a slot."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.acquire()
+            started = time.monotonic()
+            failed = False
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                failed = self.is_failure(e)
+                raise
+            finally:
+                self.release(time.monotonic() - started, failed)
+
+        return wrapper
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream service keeps failing.
+
+    The breaker opens when the failure rate of the last ``window`` calls
+    reaches ``failure_rate``. While open, calls are rejected at once; after
+    ``reset_timeout`` a single trial call is let through, which closes the
+    breaker on success and opens it again on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = UPSTREAM_BREAKER_FAILURE_RATE,
+        window: int = UPSTREAM_BREAKER_WINDOW,
+        min_calls: int = UPSTREAM_BREAKER_MIN_CALLS,
+        reset_timeout: float = UPSTREAM_BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.outcomes = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Check that a call may go through.
+
+        :raises UpstreamUnavailable: If the breaker is open.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                # Let a single trial call through
+                self.state = self.HALF_OPEN
+                return
+            raise UpstreamUnavailable(
+                f"{self.name} is unavailable", retry_after=max(1.0, remaining)
+            )
+
+    def record(self, failed: bool):
+        """
+        Record the outcome of a call.
+
+        :param failed: Whether the call failed.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    self.trip()
+                else:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                return
+
+            self.outcomes.append(failed)
+            if (
+                self.state == self.CLOSED
+                and len(self.outcomes) >= self.min_calls
+                and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate
+            ):
+                self.trip()
+
+    def cancel(self):
+        """Give back a trial call that was not made."""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def trip(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the calls made.
+
+    Every call deposits ``ratio`` tokens and every retry spends one, with
+    ``min_per_second`` tokens added over time so that low-traffic periods can
+    still retry. During an outage retries stop once the budget is spent
+    instead of multiplying the load on the upstream service.
+    """
+
+    def __init__(
+        self,
+        ratio: float = UPSTREAM_RETRY_RATIO,
+        min_per_second: float = UPSTREAM_RETRY_MIN_PER_SECOND,
+        max_tokens: float = 10.0,
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        self.tokens = min(
+            self.max_tokens,
+            self.tokens + amount + (now - self.updated_at) * self.min_per_second,
+        )
+        self.updated_at = now
+
+    def record_call(self):
+        with self.lock:
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """
+        Take a retry from the budget.
+
+        :return: True if the retry is allowed, otherwise False.
+        """
+        with self.lock:
+            self._refill(0)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class UpstreamPolicy:
+    """
+    Resilience policy of an upstream service.
+
+    Every call goes through the circuit breaker and the concurrency limiter,
+    and retryable failures are retried with full-jitter exponential backoff
+    while the retry budget allows it. A call that still fails with an
+    upstream failure is raised as UpstreamUnavailable.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        is_failure: Callable[[Exception], bool],
+        limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        budget: Optional[RetryBudget] = None,
+        max_attempts: int = UPSTREAM_MAX_ATTEMPTS,
+        base_delay: float = UPSTREAM_RETRY_BASE_DELAY,
+    ):
+        self.name = name
+        self.is_failure = is_failure
+        self.limiter = limiter or AdaptiveConcurrencyLimiter(
+            name, is_failure=is_failure
+        )
+        self.breaker = breaker or CircuitBreaker(name)
+        self.budget = budget or RetryBudget()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+
+    def call(self, func, *args, retry_on: Callable[[Exception], bool] = None, **kwargs):
+        """
+        Call an upstream function under this policy.
+
+        :param func: Function that calls the upstream service.
+        :param retry_on: Which failures may be retried, defaults to every
+            upstream failure. Non-idempotent calls should only retry errors
+            raised before the request was sent.
+        :return: Result of the function.
+
+        :raises UpstreamUnavailable: If the call was shed or kept failing.
+        """
+        retry_on = retry_on or self.is_failure
+        self.budget.record_call()
+        fields = {"upstream": self.name, "call": getattr(func, "__name__", "call")}
+        started = time.perf_counter()
+
+        attempt = 1
+        while True:
+            try:
+                self.breaker.before_call()
+            except UpstreamUnavailable:
+                logger.warning("Upstream call rejected, breaker open", extra=fields)
+                trace.get_current_span().add_event("Breaker open", fields)
+                raise
+            try:
+                # One span per attempt, ended with the error if it was shed
+                with start_span(
+                    f"{self.name} {fields['call']}",
+                    SpanKind.CLIENT,
+                    attributes={**fields, "attempt": attempt},
+                ):
+                    result = self.limiter.limited(func)(*args, **kwargs)
+            except UpstreamUnavailable:
+                # Shed by the limiter, the upstream service was not called
+                self.breaker.cancel()
+                logger.warning("Upstream call shed", extra=fields)
+                raise
+            except Exception as e:
+                failed = self.is_failure(e)
+                self.breaker.record(failed)
+                if not failed:
+                    raise
+                if (
+                    attempt >= self.max_attempts
+                    or not retry_on(e)
+                    or not self.budget.try_spend()
+                ):
+                    logger.error(
+                        "Upstream call failed",
+                        extra={**fields, "attempts": attempt, "error": repr(e)},
+                    )
+                    raise UpstreamUnavailable(f"{self.name} is unavailable") from e
+                logger.warning(
+                    "Upstream call failed, retrying",
+                    extra={**fields, "attempts": attempt, "error": repr(e)},
+                )
+            else:
+                self.breaker.record(False)
+                log_success(
+                    logger,
+                    "Upstream call",
+                    **fields,
+                    attempts=attempt,
+                    duration_ms=round((time.perf_counter() - started) * 1000, 3),
+                )
+                return result
+
+            time.sleep(random.uniform(0, self.base_delay * 2 ** (attempt - 1)))
+            attempt += 1
+
+    def guarded(self, func=None, retry_on: Callable[[Exception], bool] = None):
+        """Decorator that runs every call of a function under this policy."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.call(func, *args, retry_on=retry_on, **kwargs)
+
+            return wrapper
+
+        return decorator(func) if func is not None else decorator
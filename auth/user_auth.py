@@ -1,60 +1,159 @@
+import logging
 import os
 
 import boto3
 import requests
 import base64
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from auth.upstream import UpstreamPolicy
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Timeouts of every call to Cognito, in seconds
+COGNITO_CONNECT_TIMEOUT = float(os.getenv("COGNITO_CONNECT_TIMEOUT", "2"))
+COGNITO_READ_TIMEOUT = float(os.getenv("COGNITO_READ_TIMEOUT", "5"))
+# Connections kept open to the token endpoint
+COGNITO_POOL_SIZE = int(os.getenv("COGNITO_POOL_SIZE", "20"))
+
 cognito_client = boto3.client(
-    "cognito-idp", region_name=os.getenv("AWS_REGION", "us-east-1")
+    "cognito-idp",
+    region_name=os.getenv("AWS_REGION", "us-east-1"),
+    # Retries are made by the Cognito upstream policy, within its budget
+    config=Config(
+        connect_timeout=COGNITO_CONNECT_TIMEOUT,
+        read_timeout=COGNITO_READ_TIMEOUT,
+        retries={"max_attempts": 1, "mode": "standard"},
+    ),
 )
 
+# Calls to the token endpoint reuse their connections instead of doing a TCP
+# and TLS handshake each. Retries are made by the Cognito upstream policy
+token_session = requests.Session()
+token_session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=COGNITO_POOL_SIZE, max_retries=0),
+)
+token_session.mount(
+    "http://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=COGNITO_POOL_SIZE, max_retries=0),
+)
 
-def auth_with_code(code: str, redirect_uri: str):
+
+def is_upstream_failure(exception: Exception) -> bool:
     """
-    Authenticate using the authorization code -> returns tokens from Amazon Cognito User Pool.
+    Whether an exception means Cognito is struggling, as opposed to a client
+    error such as a revoked token.
+    """
+    if isinstance(exception, ClientError):
+        return exception.response["Error"]["Code"] in (
+            "TooManyRequestsException",
+            "ThrottlingException",
+            "InternalErrorException",
+        )
+    if isinstance(exception, requests.HTTPError):
+        status_code = exception.response.status_code
+        return status_code >= 500 or status_code == 429
+    return isinstance(exception, (BotoCoreError, requests.RequestException))
+
+
+def is_connection_failure(exception: Exception) -> bool:
+    """
+    Whether an exception was raised while connecting to Cognito, i.e. before
+    a request that can not be repeated safely reached it.
+    """
+    return isinstance(exception, requests.ConnectionError)
 
-    :param code: Authorization code obtained after user login.
-    :param redirect_uri: Redirect URI used during the login process.
-    :return: Access token and expiration time if authentication is successful, otherwise None.
+
+# Every call to Cognito shares the same timeouts, limits, breaker and retry budget
+cognito = UpstreamPolicy("Cognito", is_failure=is_upstream_failure)
+
+
+def post_token_endpoint(payload: dict):
+    """
+    Send a request to the token endpoint of the Cognito User Pool.
+
+    :param payload: Form fields of the request, without the client id.
+    :return: Tokens if the request is successful, otherwise None.
     """
     client_id = os.getenv("COGNITO_USER_CLIENT_ID")
     client_credentials = f"{client_id}:{os.getenv('COGNITO_USER_CLIENT_SECRET')}"
     auth_header = base64.b64encode(client_credentials.encode()).decode()
     token_endpoint = os.getenv("COGNITO_TOKEN_ENDPOINT")
 
-    # Prepare token request payload
-    payload = {
-        "grant_type": "authorization_code",
-        "code": code,
-        "client_id": client_id,
-        "redirect_uri": redirect_uri,
-    }
-
-    # Send request to the token endpoint to exchange the code for tokens
-    response = requests.post(
+    response = token_session.post(
         token_endpoint,
-        data=payload,
+        data={**payload, "client_id": client_id},
         headers={
             "Content-Type": "application/x-www-form-urlencoded",
             "Authorization": f"Basic {auth_header}",
         },
+        timeout=(COGNITO_CONNECT_TIMEOUT, COGNITO_READ_TIMEOUT),
     )
 
+    # Let the upstream policy see server-side failures
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+
     # Check if request was successful
     if response.status_code == 200:
         token_data = response.json()
         return {
             "token": token_data.get("access_token"),
             "expires_in": token_data.get("expires_in"),
-        }  # Returns the access token from the response and the expiration time
+            "refresh_token": token_data.get("refresh_token"),
+        }
     else:
-        print(f"Error: {response.status_code}, {response.text}")
+        logger.error(
+            "Error requesting tokens",
+            extra={
+                "grant_type": payload.get("grant_type"),
+                "status_code": response.status_code,
+                "response": response.text,
+            },
+        )
         return None
 
 
+# Authorization codes are single-use, so only retry failed connections
+@cognito.guarded(retry_on=is_connection_failure)
+def auth_with_code(code: str, redirect_uri: str):
+    """
+    Authenticate using the authorization code -> returns tokens from Amazon Cognito User Pool.
+
+    :param code: Authorization code obtained after user login.
+    :param redirect_uri: Redirect URI used during the login process.
+    :return: Access token, expiration time and refresh token if authentication is successful, otherwise None.
+    """
+    return post_token_endpoint(
+        {
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": redirect_uri,
+        }
+    )
+
+
+@cognito.guarded
+def refresh_with_token(refresh_token: str):
+    """
+    Get a new access token using a refresh token.
+
+    :param refresh_token: Refresh token obtained at sign-in.
+    :return: Access token and expiration time if the refresh token is valid,
+        otherwise None. Includes a new refresh token if Cognito rotates them.
+    """
+    return post_token_endpoint(
+        {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    )
+
+
+@cognito.guarded
 def user_info_with_token(access_token: str):
     """
     Get user information using the access token.
@@ -68,10 +167,14 @@ def user_info_with_token(access_token: str):
     if response.get("ResponseMetadata").get("HTTPStatusCode") == 200:
         return response
     else:
-        print(f"Error: Error getting user info: {response}")
+        logger.error(
+            "Error getting user info",
+            extra={"response_metadata": response.get("ResponseMetadata")},
+        )
         return None
 
 
+@cognito.guarded
 def logout_with_token(access_token: str):
     """
     Logout the user by revoking the access token.
@@ -85,5 +188,8 @@ def logout_with_token(access_token: str):
     if response.get("ResponseMetadata").get("HTTPStatusCode") == 200:
         return True
     else:
-        print(f"Error: Error logging out: {response}")
+        logger.error(
+            "Error logging out",
+            extra={"response_metadata": response.get("ResponseMetadata")},
+        )
         return False
@@ -0,0 +1,96 @@
+"""
+Bytes sent and latency of clients polling /auth/me.
+
+Compares plain polls, which get the full user every time as before, with
+polls revalidating their copy through If-None-Match, which get 304 responses
+answered from the version index. The user lives in a SQLite file database.
+
+Run with ``python -m benchmarks.bench_conditional_get``.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.database import Base, get_db
+from models.user import User
+from tests.services.jwt_factory import JWTFactory
+
+POLLS = 2000
+
+# Offline stand-in for the JWKS fetched when the auth module is imported
+with patch(
+    "requests.get",
+    return_value=MagicMock(json=lambda: JWTFactory().jwks.model_dump()),
+):
+    from auth.auth import auth, get_current_user
+    from routers.auth import router
+
+
+def response_size(response) -> int:
+    headers = sum(
+        len(name) + len(value) + 4 for name, value in response.headers.items()
+    )
+    return headers + len(response.content)
+
+
+def poll(client, headers=None):
+    latencies, sent = [], 0
+    for _ in range(POLLS):
+        started = time.perf_counter()
+        response = client.get("/auth/me", headers=headers)
+        latencies.append(time.perf_counter() - started)
+        sent += response_size(response)
+    return latencies, sent
+
+
+def report(name, latencies, sent):
+    print(
+        f"{name:<14} p50={statistics.median(latencies) * 1000:6.2f}ms "
+        f"bytes/poll={sent / len(latencies):6.0f} total={sent / 1024:8.1f}KiB"
+    )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        db = SessionLocal()
+        db.add(
+            User(
+                id="5f0c1b9e-6a52-4c8f-9a43-1d2e3f4a5b6c",
+                name="A user with a reasonably long display name",
+                username="username1",
+                email="username1@example.com",
+            )
+        )
+        db.commit()
+        db.close()
+
+        def session():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app = FastAPI()
+        app.include_router(router)
+        app.dependency_overrides[auth] = lambda: None
+        app.dependency_overrides[get_current_user] = lambda: "username1"
+        app.dependency_overrides[get_db] = session
+
+        with patch("auth.rate_limit.user_rate_limit.store") as store:
+            store.take.return_value = 0
+            client = TestClient(app)
+            etag = client.get("/auth/me").headers["ETag"]
+            report("full response", *poll(client))
+            report("if-none-match", *poll(client, {"If-None-Match": etag}))
@@ -0,0 +1,59 @@
+"""
+Throughput of batch token verification, in tokens per second.
+
+Compares verifying each token on its own, as one /auth/me call per token
+would (key constructed on every call, no deduplication), with
+JWTBearer.verify_tokens for batches of 1, 100 and 10,000 tokens. Batches are
+made of distinct tokens, so the gains come from key reuse and parallelism
+only; the last line shows a batch where every token appears twice.
+
+Run with ``python -m benchmarks.bench_introspect``.
+"""
+
+import os
+import time
+
+from jose import jwk
+
+from auth.JWTBearer import JWTBearer
+from tests.services.jwt_factory import JWTFactory
+
+BATCH_SIZES = [1, 100, 10000]
+
+factory = JWTFactory()
+
+
+def verify_one_by_one(bearer: JWTBearer, tokens):
+    for token in tokens:
+        # What every call did before keys were cached
+        bearer.kid_to_key.clear()
+        bearer.verify_token(token)
+
+
+def measure(func, tokens, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(tokens)
+        best = min(best, time.perf_counter() - started)
+    return len(tokens) / best
+
+
+if __name__ == "__main__":
+    print(f"{os.cpu_count()} CPUs, jose backend {jwk.RSAKey.__module__}")
+    all_tokens = [factory.token(username=f"user{i}") for i in range(max(BATCH_SIZES))]
+
+    for size in BATCH_SIZES:
+        tokens = all_tokens[:size]
+        bearer = JWTBearer(factory.jwks)
+        single = measure(lambda t: verify_one_by_one(bearer, t), tokens)
+        batch = measure(bearer.verify_tokens, tokens)
+        print(
+            f"batch of {size:>6}: one by one {single:>9.0f} tokens/s, "
+            f"verify_tokens {batch:>9.0f} tokens/s ({batch / single:.1f}x)"
+        )
+
+    tokens = all_tokens[:5000] * 2
+    bearer = JWTBearer(factory.jwks)
+    batch = measure(bearer.verify_tokens, tokens)
+    print(f"batch of {len(tokens):>6} with duplicates: {batch:>9.0f} tokens/s")
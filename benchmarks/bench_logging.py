@@ -0,0 +1,109 @@
+"""
+Request latency at high throughput with each way of logging.
+
+Every request logs what a successful /auth/me logs: the token accepted, the
+upstream call and the request handled. Requests are served by WORKERS
+threads, like the endpoints run in the thread pool, and logs go to a slow
+stream, like stdout piped to a log collector that falls behind
+(WRITE_DELAY per write).
+
+- print: the previous print to stdout, two writes per line.
+- sync: logging through a StreamHandler, writing in the request thread.
+- queued: JSON records through the queue of observability/log.py, with
+  successes sampled at LOG_SUCCESS_SAMPLE_RATE.
+
+Run with ``python -m benchmarks.bench_logging``.
+"""
+
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from observability.log import log_success, request_id, setup_logging, stop_logging
+
+WORKERS = 16
+REQUESTS = 20000
+WRITE_DELAY = 0.0002
+
+
+class SlowStream:
+    """Stream that holds a lock while writing, like a full pipe."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = 0
+
+    def write(self, text: str):
+        with self.lock:
+            time.sleep(WRITE_DELAY)
+            self.lines += text.count("\n")
+
+    def flush(self):
+        pass
+
+
+def handle_print(stream: SlowStream, i: int):
+    print(f"Token accepted for user{i}", file=stream)
+    print("Cognito get_user took 1.2ms", file=stream)
+    print("GET /auth/me 200", file=stream)
+
+
+def handle_logging(logger: logging.Logger, i: int):
+    logger.info("Token accepted", extra={"username": f"user{i}"})
+    logger.info("Upstream call", extra={"upstream": "Cognito", "duration_ms": 1.2})
+    logger.info("Request handled", extra={"path": "/auth/me", "status_code": 200})
+
+
+def handle_sampled(logger: logging.Logger, i: int):
+    token = request_id.set(f"request{i}")
+    log_success(logger, "Token accepted", username=f"user{i}")
+    log_success(logger, "Upstream call", upstream="Cognito", duration_ms=1.2)
+    log_success(logger, "Request handled", path="/auth/me", status_code=200)
+    request_id.reset(token)
+
+
+def run(handle, *args):
+    def timed(i):
+        started = time.perf_counter()
+        handle(*args, i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        latencies = sorted(executor.map(timed, range(REQUESTS)))
+    elapsed = time.perf_counter() - started
+    return (
+        REQUESTS / elapsed,
+        statistics.median(latencies) * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6,
+    )
+
+
+def report(name, result, written):
+    rps, p50, p99 = result
+    print(
+        f"{name:7} {rps:9.0f} req/s  p50={p50:8.1f}µs  p99={p99:9.1f}µs  "
+        f"lines written={written}"
+    )
+
+
+if __name__ == "__main__":
+    root = logging.getLogger()
+
+    stream = SlowStream()
+    report("print", run(handle_print, stream), stream.lines)
+
+    stream = SlowStream()
+    handler = logging.StreamHandler(stream)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    report("sync", run(handle_logging, logging.getLogger("bench")), stream.lines)
+    root.removeHandler(handler)
+
+    stream = SlowStream()
+    setup_logging(stream)
+    result = run(handle_sampled, logging.getLogger("bench"))
+    stop_logging()
+    report("queued", result, stream.lines)
@@ -0,0 +1,76 @@
+"""
+Latency of logout with Cognito answering in COGNITO_LATENCY seconds.
+
+Compares calling GlobalSignOut from the request (the previous logout) with
+recording the revocation in the outbox (SQLite file database) and returning.
+
+Run with ``python -m benchmarks.bench_logout``.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from auth.revocation import drain_outbox, revoke_token
+from auth.user_auth import logout_with_token
+from db.database import Base
+from tests.services.jwt_factory import JWTFactory
+
+COGNITO_LATENCY = 0.15
+LOGOUTS = 50
+
+
+def stub_global_sign_out(AccessToken):
+    time.sleep(COGNITO_LATENCY)
+    return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    print(
+        f"{name:<18} p50={statistics.median(latencies) * 1000:8.2f}ms "
+        f"max={latencies[-1] * 1000:8.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    factory = JWTFactory()
+    tokens = [factory.token(username=f"user{i}") for i in range(LOGOUTS)]
+    expires_at = time.time() + 3600
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+        with patch(
+            "auth.user_auth.cognito_client.global_sign_out", stub_global_sign_out
+        ):
+            synchronous = []
+            for token in tokens:
+                started = time.perf_counter()
+                logout_with_token(token)
+                synchronous.append(time.perf_counter() - started)
+
+            outbox = []
+            for token in tokens:
+                started = time.perf_counter()
+                revoke_token(token, None, expires_at, db)
+                outbox.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            sent = 0
+            while sent < LOGOUTS:
+                sent += drain_outbox(db)
+            drained_in = time.perf_counter() - started
+
+        db.close()
+
+    report("GlobalSignOut", synchronous)
+    report("revocation outbox", outbox)
+    print(f"outbox drained {LOGOUTS} revocations in the background in {drained_in:.2f}s")
@@ -0,0 +1,90 @@
+"""
+Load test of the adaptive concurrency limiter in front of a saturated upstream.
+
+The stub upstream serves UPSTREAM_CAPACITY calls at a time, SERVICE_TIME each,
+and queues the rest in arrival order, like a saturated HTTP server. CLIENTS threads hammer it for DURATION seconds, first
+without a limiter and then through AdaptiveConcurrencyLimiter.
+
+Run with ``python -m benchmarks.bench_overload``.
+"""
+
+import queue
+import statistics
+import threading
+import time
+
+from auth.upstream import AdaptiveConcurrencyLimiter, UpstreamUnavailable
+
+UPSTREAM_CAPACITY = 8
+SERVICE_TIME = 0.02
+CLIENTS = 256
+DURATION = 3.0
+
+upstream_queue = queue.Queue()
+
+
+def upstream_worker():
+    while True:
+        done = upstream_queue.get()
+        time.sleep(SERVICE_TIME)
+        done.set()
+
+
+for _ in range(UPSTREAM_CAPACITY):
+    threading.Thread(target=upstream_worker, daemon=True).start()
+
+
+def stub_upstream():
+    done = threading.Event()
+    upstream_queue.put(done)
+    done.wait()
+
+
+def run(call):
+    served, shed = [], []
+    deadline = time.monotonic() + DURATION
+
+    def client():
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                call()
+                served.append(time.monotonic() - started)
+            except UpstreamUnavailable:
+                shed.append(time.monotonic() - started)
+                time.sleep(SERVICE_TIME)
+
+    threads = [threading.Thread(target=client) for _ in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return served, shed
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100)[p - 1] if len(values) > 1 else values[0]
+
+
+def report(name, served, shed):
+    print(
+        f"{name:<12} served={len(served):>5} ({len(served) / DURATION:7.1f}/s) "
+        f"p50={percentile(served, 50) * 1000:7.1f}ms "
+        f"p99={percentile(served, 99) * 1000:7.1f}ms "
+        f"shed={len(shed):>6} (p99 {percentile(shed, 99) * 1000:.2f}ms)"
+    )
+
+
+if __name__ == "__main__":
+    report("unbounded", *run(stub_upstream))
+
+    limiter = AdaptiveConcurrencyLimiter(
+        "stub",
+        initial_limit=UPSTREAM_CAPACITY,
+        min_limit=2,
+        target_latency=SERVICE_TIME * 2,
+    )
+    report("adaptive", *run(limiter.limited(stub_upstream)))
+    print(f"adaptive limit settled at {limiter.limit:.1f}")
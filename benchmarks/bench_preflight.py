@@ -0,0 +1,125 @@
+"""
+Throughput of CORS preflight requests, and requests saved by caching them.
+
+Preflights are sent straight to the ASGI application, first through the
+previous middleware order (database session middleware outside CORS, default
+max age of 600 seconds) and then through the application as configured now.
+
+The second part replays a typical SPA session: sign in, then /auth/me on
+each page view (every PAGE_VIEW_INTERVAL seconds on average) for a working
+day, then logout, with a browser preflight cache capped like Chromium's.
+
+Run with ``python -m benchmarks.bench_preflight``.
+"""
+
+import asyncio
+import random
+import time
+from unittest.mock import MagicMock, patch
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+
+from tests.services.jwt_factory import JWTFactory
+
+PREFLIGHTS = 20000
+SESSION_LENGTH = 8 * 3600
+PAGE_VIEW_INTERVAL = 240
+CHROMIUM_MAX_AGE = 7200
+
+# Offline stand-in for the JWKS fetched when the auth module is imported
+with patch(
+    "requests.get",
+    return_value=MagicMock(json=lambda: JWTFactory().jwks.model_dump()),
+):
+    import main
+    from routers import auth
+
+
+def previous_app() -> FastAPI:
+    app = FastAPI(root_path="/users/v1")
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.include_router(auth.router)
+
+    @app.middleware("http")
+    async def db_session_middleware(request: Request, call_next):
+        request.state.db = main.SessionLocal()
+        response = await call_next(request)
+        request.state.db.close()
+        return response
+
+    return app
+
+
+async def preflights_per_second(app) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "OPTIONS",
+        "scheme": "https",
+        "path": "/auth/me",
+        "raw_path": b"/auth/me",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"api.clubsync.pt"),
+            (b"origin", b"https://app.clubsync.pt"),
+            (b"access-control-request-method", b"GET"),
+            (b"access-control-request-headers", b"authorization"),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("api.clubsync.pt", 443),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200
+
+    started = time.perf_counter()
+    for _ in range(PREFLIGHTS):
+        await app(dict(scope), receive, send)
+    return PREFLIGHTS / (time.perf_counter() - started)
+
+
+def spa_session_requests(max_age: int) -> int:
+    rng = random.Random(42)
+    calls = [(0.0, "POST", "/auth/sign-in")]
+    now = rng.expovariate(1 / PAGE_VIEW_INTERVAL)
+    while now < SESSION_LENGTH:
+        calls.append((now, "GET", "/auth/me"))
+        now += rng.expovariate(1 / PAGE_VIEW_INTERVAL)
+    calls.append((SESSION_LENGTH, "GET", "/auth/logout"))
+
+    max_age = min(max_age, CHROMIUM_MAX_AGE)
+    cached_until, requests = {}, 0
+    for at, method, path in calls:
+        if cached_until.get((method, path), -1) <= at:
+            requests += 1
+            cached_until[(method, path)] = at + max_age
+        requests += 1
+    return requests
+
+
+if __name__ == "__main__":
+    before = asyncio.run(preflights_per_second(previous_app()))
+    after = asyncio.run(preflights_per_second(main.app))
+    print(
+        f"preflights/s  before={before:8.0f}  after={after:8.0f} ({after / before:.1f}x)"
+    )
+
+    before = spa_session_requests(600)
+    after = spa_session_requests(main.CORS_MAX_AGE)
+    print(
+        f"SPA session requests  before={before}  after={after} "
+        f"({(before - after) / before:.0%} fewer)"
+    )
@@ -0,0 +1,167 @@
+"""
+Latency of renewing an access token: full sign-in vs /auth/refresh.
+
+Both go through the application against a stub Cognito: a local token
+endpoint answering after NETWORK_RTT, which also waits HANDSHAKE_RTTS round
+trips on each new connection (TCP and TLS handshakes), and a get_user call
+answering after NETWORK_RTT. Sign-in runs its existence check against a
+SQLite database of USERS users.
+
+- sign-in: code exchange with a connection per call, get_user and the
+  existence check, as on each expiry before. The browser redirect to the
+  hosted UI is not counted.
+- refresh (new connections): refresh grant with a connection per call.
+- refresh (pooled): refresh grant on the pooled token session.
+
+Run with ``python -m benchmarks.bench_refresh``.
+"""
+
+import os
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+import requests
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from tests.services.jwt_factory import JWTFactory
+
+NETWORK_RTT = 0.01
+HANDSHAKE_RTTS = 2
+USERS = 50000
+CALLS = 200
+
+# Offline stand-in for the JWKS fetched when the auth module is imported
+with patch(
+    "requests.get",
+    return_value=MagicMock(json=lambda: JWTFactory().jwks.model_dump()),
+):
+    from auth import user_auth
+    from auth.rate_limit import refresh_rate_limit, sign_in_rate_limit
+    from db.database import Base, get_db
+    from main import app
+    from models.user import User
+    from routers.auth import REFRESH_COOKIE_NAME
+
+TOKENS = (
+    b'{"access_token": "access_token", "expires_in": 3600,'
+    b' "refresh_token": "refresh_token"}'
+)
+USER_INFO = {
+    "UserAttributes": [
+        {"Name": "email", "Value": "user7@email.com"},
+        {"Name": "email_verified", "Value": "true"},
+        {"Name": "name", "Value": "name7"},
+        {"Name": "sub", "Value": "id0000007"},
+    ],
+    "Username": "user7",
+    "ResponseMetadata": {"HTTPStatusCode": 200},
+}
+
+
+class StubTokenHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        time.sleep(HANDSHAKE_RTTS * NETWORK_RTT)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(NETWORK_RTT)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(TOKENS)))
+        self.end_headers()
+        self.wfile.write(TOKENS)
+
+    def log_message(self, *args):
+        pass
+
+
+def get_user(AccessToken):
+    time.sleep(NETWORK_RTT)
+    return USER_INFO
+
+
+def measure(call) -> list:
+    latencies = []
+    for _ in range(CALLS):
+        started = time.perf_counter()
+        response = call()
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200
+    return sorted(latencies)
+
+
+def report(name, latencies):
+    print(
+        f"{name:26} p50={statistics.median(latencies) * 1000:6.1f}ms  "
+        f"p99={latencies[int(len(latencies) * 0.99)] * 1000:6.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubTokenHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    os.environ["COGNITO_TOKEN_ENDPOINT"] = f"http://{host}:{port}/oauth2/token"
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                insert(User),
+                [
+                    {
+                        "id": f"id{i:07d}",
+                        "name": f"name{i}",
+                        "username": f"user{i}",
+                        "email": f"user{i}@email.com",
+                        "username_key": f"user{i}",
+                        "email_key": f"user{i}@email.com",
+                    }
+                    for i in range(USERS)
+                ],
+            )
+        Session = sessionmaker(bind=engine)
+
+        def db_session():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = db_session
+        app.dependency_overrides[sign_in_rate_limit] = lambda: None
+        app.dependency_overrides[refresh_rate_limit] = lambda: None
+        client = TestClient(app)
+        cookies = {"Cookie": f"{REFRESH_COOKIE_NAME}=refresh_token"}
+
+        with patch.object(user_auth.cognito_client, "get_user", get_user), patch.object(
+            user_auth, "token_session", requests
+        ):
+            report(
+                "sign-in",
+                measure(lambda: client.post("/auth/sign-in?code=code")),
+            )
+        with patch.object(user_auth, "token_session", requests):
+            report(
+                "refresh (new connections)",
+                measure(lambda: client.post("/auth/refresh", headers=cookies)),
+            )
+        report(
+            "refresh (pooled)",
+            measure(lambda: client.post("/auth/refresh", headers=cookies)),
+        )
+        engine.dispose()
+    server.shutdown()
@@ -0,0 +1,147 @@
+"""
+Request overhead of tracing.
+
+Requests are sent straight to an ASGI application shaped like /auth/me:
+JWTBearer verification (revocation check off), a Cognito-like upstream call
+through an UpstreamPolicy and two SELECTs on a SQLite database. The spans of
+JWTBearer and of the upstream policy are in the code, so they are no-ops in
+the first two modes. Each mode
+runs in its own process, since a tracer provider is installed once per
+process:
+
+- baseline: no tracing middleware nor tracer provider.
+- off: tracing middleware, TRACE_EXPORTER=none (the default).
+- sampled out: tracer provider with TRACE_SAMPLE_RATE=0.
+- sampled: tracer provider with TRACE_SAMPLE_RATE=1, spans written to a file.
+
+Run with ``python -m benchmarks.bench_tracing``.
+"""
+
+import asyncio
+import inspect
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, text
+
+from tests.services.jwt_factory import JWTFactory
+
+REQUESTS = 5000
+MODES = ["baseline", "off", "sampled out", "sampled"]
+
+factory = JWTFactory()
+
+# Offline stand-in for the JWKS fetched when the auth module is imported
+with patch(
+    "requests.get", return_value=MagicMock(json=lambda: factory.jwks.model_dump())
+):
+    from auth.JWTBearer import JWTBearer
+    from auth.upstream import UpstreamPolicy
+    from observability.tracing import (
+        TracingMiddleware,
+        make_exporter,
+        setup_tracing,
+        shutdown_tracing,
+    )
+
+
+def make_app(mode: str, directory: str) -> FastAPI:
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE user (id TEXT PRIMARY KEY, name TEXT)"))
+        connection.execute(text("INSERT INTO user VALUES ('id1', 'name1')"))
+    bearer = JWTBearer(factory.jwks)
+    upstream = UpstreamPolicy("Cognito", is_failure=lambda e: True)
+
+    def get_user(AccessToken):
+        return {"Username": "username1"}
+
+    # Newer FastAPI versions trace natively, leave it out to only measure ours
+    options = {}
+    if "telemetry" in inspect.signature(FastAPI).parameters:
+        options["telemetry"] = {"tracing": False, "metrics": False, "logs": False}
+    app = FastAPI(**options)
+
+    @app.get("/auth/me")
+    def me(credentials=Depends(bearer)):
+        upstream.call(get_user, AccessToken=credentials.jwt_token)
+        with engine.connect() as connection:
+            connection.execute(text("SELECT id FROM user WHERE name = 'name1'"))
+            connection.execute(text("SELECT * FROM user WHERE id = 'id1'")).first()
+        return {"username": credentials.claims["username"]}
+
+    if mode == "baseline":
+        return app
+    app.add_middleware(TracingMiddleware)
+    exporter = make_exporter("file", os.path.join(directory, "traces.jsonl"))
+    if mode == "off":
+        setup_tracing(engines=[engine])
+    elif mode == "sampled out":
+        setup_tracing(exporter, sample_rate=0.0, engines=[engine])
+    else:
+        setup_tracing(exporter, sample_rate=1.0, engines=[engine])
+    return app
+
+
+async def seconds_per_request(app) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "https",
+        "path": "/auth/me",
+        "raw_path": b"/auth/me",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"api.clubsync.pt"),
+            (b"authorization", f"Bearer {factory.token()}".encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("api.clubsync.pt", 443),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200
+
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / REQUESTS
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with patch("auth.JWTBearer.REVOCATION_CHECK", "off"):
+            with tempfile.TemporaryDirectory() as directory:
+                app = make_app(sys.argv[1], directory)
+                print(asyncio.run(seconds_per_request(app)))
+                shutdown_tracing()
+    else:
+        results = {}
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_tracing", mode],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results[mode] = float(output.split()[-1])
+        for mode in MODES:
+            overhead = results[mode] / results["baseline"] - 1
+            print(
+                f"{mode:12} {results[mode] * 1e6:8.1f}µs/request  "
+                f"overhead={overhead:+6.1%}"
+            )
@@ -0,0 +1,82 @@
+"""
+Latency of the sign-in existence check on a large user table.
+
+Compares the previous check, two exact lookups run one after the other
+(username, then email), with user_exists, a single query on the normalized
+lookup keys. Runs against a SQLite file database of USERS users, for new
+users (the previous check runs both lookups), users found by email only, and
+emails sent by Cognito with another case, which the previous check missed.
+
+Run with ``python -m benchmarks.bench_user_exists``.
+"""
+
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from db.database import Base
+from models.user import User
+from repositories.userRepo import user_exists
+
+USERS = 200000
+CHECKS = 5000
+
+
+def previous_exists(username, email, db):
+    return bool(
+        db.query(User).filter(User.username == username).first()
+        or db.query(User).filter(User.email == email).first()
+    )
+
+
+def measure(check, db, candidates):
+    found = 0
+    started = time.perf_counter()
+    for username, email in candidates:
+        found += check(username, email, db)
+    elapsed = time.perf_counter() - started
+    db.expunge_all()
+    return elapsed / len(candidates), found
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                insert(User),
+                [
+                    {
+                        "id": f"id{i:07d}",
+                        "name": f"name{i}",
+                        "username": f"user{i}",
+                        "email": f"user{i}@email.com",
+                        "username_key": f"user{i}",
+                        "email_key": f"user{i}@email.com",
+                    }
+                    for i in range(USERS)
+                ],
+            )
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+        step = USERS // CHECKS
+        cases = {
+            "new users": [(f"new{i}", f"new{i}@email.com") for i in range(CHECKS)],
+            "found by email": [
+                (f"renamed{i}", f"user{i * step}@email.com") for i in range(CHECKS)
+            ],
+            "mixed-case email": [
+                (f"renamed{i}", f"User{i * step}@Email.com") for i in range(CHECKS)
+            ],
+        }
+        for name, candidates in cases.items():
+            before, found_before = measure(previous_exists, db, candidates)
+            after, found_after = measure(user_exists, db, candidates)
+            print(
+                f"{name:<17} before={before * 1e6:6.1f}us found {found_before:>5}  "
+                f"after={after * 1e6:6.1f}us found {found_after:>5}"
+            )
@@ -0,0 +1,82 @@
+"""
+CPU time and memory of user lookups by username, over 100,000 lookups.
+
+Compares the ORM query that get_user_by_username used to run with the
+compiled Core select it runs now, against an in-memory SQLite database so
+that the cost measured is the Python side of the lookup. Memory is traced
+over the first LOOKUPS_TRACED lookups: "peak" is the largest live
+allocation during a lookup and "kept" is the size of the returned user.
+
+Run with ``python -m benchmarks.bench_user_lookup``.
+"""
+
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.database import Base
+from models.user import User
+from repositories.userRepo import get_user_by_username
+
+USERS = 1000
+LOOKUPS = 100000
+LOOKUPS_TRACED = 2000
+
+
+def orm_lookup(username, db):
+    return db.query(User).filter(User.username == username).first()
+
+
+def run(lookup, db, usernames):
+    started = time.process_time()
+    for username in usernames:
+        lookup(username, db)
+        # Sessions are per request, the identity map never serves a lookup
+        db.expunge_all()
+    return (time.process_time() - started) / len(usernames)
+
+
+def trace(lookup, db, usernames):
+    peak = kept = 0
+    tracemalloc.start()
+    for username in usernames:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        user = lookup(username, db)
+        current, lookup_peak = tracemalloc.get_traced_memory()
+        db.expunge_all()
+        peak += lookup_peak - before
+        kept += current - before
+        del user
+    tracemalloc.stop()
+    return peak / len(usernames), kept / len(usernames)
+
+
+if __name__ == "__main__":
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    db.add_all(
+        User(id=f"id{i}", name=f"name{i}", username=f"user{i}", email=f"user{i}@e.com")
+        for i in range(USERS)
+    )
+    db.commit()
+    usernames = [f"user{i % USERS}" for i in range(LOOKUPS)]
+
+    for name, lookup in [
+        ("orm query", orm_lookup),
+        ("core select", get_user_by_username),
+    ]:
+        # Warm the statement cache first
+        run(lookup, db, usernames[:100])
+        cpu = run(lookup, db, usernames)
+        peak, kept = trace(lookup, db, usernames[:LOOKUPS_TRACED])
+        print(
+            f"{name:<12} cpu={cpu * 1e6:7.1f}us/lookup "
+            f"peak={peak / 1024:6.1f}KiB kept={kept:6.0f}B"
+        )
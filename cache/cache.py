@@ -0,0 +1,368 @@
+import json
+import os
+from abc import ABC, abstractmethod
+import queue
+import socket
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_URL = os.environ.get("CACHE_URL", "memory://")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+
+
+class CacheError(Exception):
+    """Raised when a cache backend answers with an error."""
+
+
+class Cache(ABC):
+    """
+    Interface shared by every cache backend.
+
+    Values must be JSON serializable so that in-process and shared backends
+    behave the same way. ``None`` is never stored: a ``None`` result always
+    means a miss.
+    """
+
+    # Striped locks used to collapse concurrent loads of the same key
+    _LOCK_STRIPES = 64
+
+    def __init__(self):
+        self._load_locks = [threading.Lock() for _ in range(self._LOCK_STRIPES)]
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        pass
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """
+        Set a key only if it does not exist yet.
+
+        :return: True if the key was set, otherwise False.
+        """
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Get several keys at once.
+
+        :param keys: Keys to get.
+        :return: Dict with the keys that were found.
+        """
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def get_or_set(
+        self,
+        key: str,
+        loader: Callable[[], Any],
+        ttl: Optional[float] = None,
+        lock_timeout: float = 5.0,
+    ) -> Any:
+        """
+        Get a key, loading and storing it on a miss.
+
+        Only one caller loads a missing key at a time: concurrent callers in
+        this process wait on a local lock, callers in other processes wait on
+        a short-lived lock key in the backend, and all of them reuse the
+        loaded value instead of hitting the origin again.
+
+        :param key: Key to get.
+        :param loader: Function that loads the value on a miss.
+        :param ttl: Time to live of the loaded value, in seconds.
+        :param lock_timeout: Maximum time to wait for another loader, in seconds.
+        :return: Cached or freshly loaded value.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._load_locks[hash(key) % self._LOCK_STRIPES]:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            lock_key = f"{key}:lock"
+            deadline = time.monotonic() + lock_timeout
+            locked = self.add(lock_key, 1, ttl=lock_timeout)
+            while not locked and time.monotonic() < deadline:
+                time.sleep(0.01)
+                value = self.get(key)
+                if value is not None:
+                    return value
+                locked = self.add(lock_key, 1, ttl=lock_timeout)
+
+            try:
+                value = loader()
+                if value is not None:
+                    self.set(key, value, ttl)
+                return value
+            finally:
+                if locked:
+                    self.delete(lock_key)
+
+
+class InMemoryCache(Cache):
+    """Process-local cache with per-key TTL and LRU eviction."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_entry(self, key: str, value: Any, ttl: Optional[float], now: float):
+        expires_at = now + ttl if ttl is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._get_entry(key, time.monotonic())
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        if value is None:
+            return
+        with self._lock:
+            self._set_entry(key, value, ttl, time.monotonic())
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self._get_entry(key, now) is not None:
+                return False
+            self._set_entry(key, value, ttl, now)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            found = {}
+            for key in keys:
+                value = self._get_entry(key, now)
+                if value is not None:
+                    found[key] = value
+            return found
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisCache(Cache):
+    """
+    Shared cache speaking the Redis protocol (RESP2) over plain sockets.
+
+    Connection errors are treated as cache misses so that an unavailable
+    cache server degrades to hitting the origin instead of failing requests.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key_prefix: str = "users:",
+        pool_size: int = 10,
+        socket_timeout: float = 0.5,
+    ):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.key_prefix = key_prefix
+        self.socket_timeout = socket_timeout
+        self._pool: "queue.LifoQueue" = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.create_connection(
+            (self.host, self.port), timeout=self.socket_timeout
+        )
+        conn = (sock, sock.makefile("rb"))
+        if self.password:
+            self._send(conn, "AUTH", self.password)
+        if self.db:
+            self._send(conn, "SELECT", self.db)
+        return conn
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by cache server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise CacheError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            return reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise CacheError(f"Unexpected reply from cache server: {line!r}")
+
+    def _send(self, conn, *args):
+        sock, reader = conn
+        sock.sendall(self._encode(*args))
+        return self._read_reply(reader)
+
+    def execute(self, *args):
+        """
+        Run a command on a pooled connection.
+
+        :param args: Command name and arguments.
+        :return: Decoded reply.
+
+        :raises OSError: If the cache server can not be reached.
+        :raises CacheError: If the cache server answers with an error.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            return self._send(conn, *args)
+        except OSError:
+            conn[0].close()
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    conn[0].close()
+
+    def _key(self, key: str) -> str:
+        return f"{self.key_prefix}{key}"
+
+    @staticmethod
+    def _ttl_args(ttl: Optional[float]) -> List:
+        return ["PX", max(1, int(ttl * 1000))] if ttl is not None else []
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self.execute("GET", self._key(key))
+        except (OSError, CacheError):
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        if value is None:
+            return
+        try:
+            self.execute("SET", self._key(key), json.dumps(value), *self._ttl_args(ttl))
+        except (OSError, CacheError):
+            pass
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        try:
+            reply = self.execute(
+                "SET", self._key(key), json.dumps(value), "NX", *self._ttl_args(ttl)
+            )
+        except (OSError, CacheError):
+            # Without a reachable server every caller loads on its own
+            return True
+        return reply == "OK"
+
+    def delete(self, key: str):
+        try:
+            self.execute("DEL", self._key(key))
+        except (OSError, CacheError):
+            pass
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            values = self.execute("MGET", *[self._key(key) for key in keys])
+        except (OSError, CacheError):
+            return {}
+        return {
+            key: json.loads(raw) for key, raw in zip(keys, values) if raw is not None
+        }
+
+
+def create_cache(url: str = CACHE_URL) -> Cache:
+    """
+    Create a cache backend from a URL.
+
+    :param url: ``redis://[:password@]host[:port][/db]`` for a shared cache,
+        anything else for an in-process cache.
+    :return: Cache backend.
+    """
+    if url.startswith("redis://"):
+        return RedisCache(url)
+    return InMemoryCache()
+
+
+@lru_cache(maxsize=None)
+def get_cache() -> Cache:
+    """
+    Get the cache configured through ``CACHE_URL``.
+
+    Routes, repositories and the auth dependencies take it as a FastAPI
+    dependency, ``cache: Cache = Depends(get_cache)``, so that each one opts
+    in and tests can swap it through ``app.dependency_overrides``. Code that
+    FastAPI does not call, such as the read-your-writes routing of database
+    sessions, calls it directly.
+    """
+    return create_cache()
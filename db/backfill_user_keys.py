@@ -0,0 +1,195 @@
+"""
+Backfill of the case-insensitive lookup keys of the user table.
+
+Adds the username_key and email_key columns if they are missing, fills them
+in keyset batches of short transactions, then builds their unique indexes.
+On MySQL each step runs online (ALGORITHM=INSTANT or INPLACE with LOCK=NONE),
+so sign-ins keep working meanwhile. It can be stopped and run again at any
+time.
+
+Run with ``python -m db.backfill_user_keys``.
+"""
+
+import os
+import time
+from typing import List
+
+from dotenv import load_dotenv
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from models.user import User, normalize_key
+
+load_dotenv()
+
+BACKFILL_BATCH_SIZE = int(os.environ.get("BACKFILL_BATCH_SIZE", "1000"))
+# Pause between batches, in seconds, leaving room for traffic and replication
+BACKFILL_PAUSE = float(os.environ.get("BACKFILL_PAUSE", "0.05"))
+
+# Lookup key column and the column it normalizes
+KEY_COLUMNS = {"username_key": "username", "email_key": "email"}
+
+
+class DuplicateKeysError(Exception):
+    """Raised when users only differ by case, so a key cannot be unique."""
+
+    def __init__(self, column: str, duplicates: List[str]):
+        super().__init__(
+            f"{len(duplicates)} duplicate values of {column}: {duplicates[:10]}"
+        )
+        self.column = column
+        self.duplicates = duplicates
+
+
+def _table(engine: Engine) -> str:
+    return engine.dialect.identifier_preparer.quote(User.__tablename__)
+
+
+def add_key_columns(engine: Engine) -> List[str]:
+    """
+    Add the lookup key columns that are missing.
+
+    :param engine: Engine of the primary database.
+    :return: Columns added.
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns("user")}
+    missing = [column for column in KEY_COLUMNS if column not in existing]
+    online = ", ALGORITHM=INSTANT" if engine.dialect.name == "mysql" else ""
+    with engine.begin() as connection:
+        for column in missing:
+            connection.execute(
+                text(
+                    f"ALTER TABLE {_table(engine)} "
+                    f"ADD COLUMN {column} VARCHAR(200) NULL{online}"
+                )
+            )
+    return missing
+
+
+def backfill_keys(
+    engine: Engine,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    pause: float = BACKFILL_PAUSE,
+) -> int:
+    """
+    Fill the lookup keys of the users that have none.
+
+    Users are walked in primary key order, one batch per transaction, so
+    only the rows of the current batch are locked.
+
+    :param engine: Engine of the primary database.
+    :param batch_size: Users per batch.
+    :param pause: Pause between batches, in seconds.
+    :return: Number of users updated.
+    """
+    table = _table(engine)
+    select_batch = text(
+        f"SELECT id, username, email FROM {table} "
+        "WHERE id > :last_id AND (username_key IS NULL OR email_key IS NULL) "
+        "ORDER BY id LIMIT :limit"
+    )
+    update_user = text(
+        f"UPDATE {table} SET username_key = :username_key, email_key = :email_key "
+        "WHERE id = :id"
+    )
+
+    updated, last_id = 0, ""
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select_batch, {"last_id": last_id, "limit": batch_size}
+            ).all()
+            if not rows:
+                return updated
+            connection.execute(
+                update_user,
+                [
+                    {
+                        "id": row.id,
+                        "username_key": normalize_key(row.username),
+                        "email_key": normalize_key(row.email),
+                    }
+                    for row in rows
+                ],
+            )
+        updated += len(rows)
+        last_id = rows[-1].id
+        time.sleep(pause)
+
+
+def find_duplicate_keys(engine: Engine, column: str) -> List[str]:
+    """
+    Find the values of a lookup key shared by several users.
+
+    :param engine: Engine of the database.
+    :param column: Lookup key column.
+    :return: Duplicate values.
+    """
+    with engine.connect() as connection:
+        return list(
+            connection.execute(
+                text(
+                    f"SELECT {column} FROM {_table(engine)} "
+                    f"WHERE {column} IS NOT NULL "
+                    f"GROUP BY {column} HAVING COUNT(*) > 1"
+                )
+            ).scalars()
+        )
+
+
+def add_key_indexes(engine: Engine) -> List[str]:
+    """
+    Build the unique indexes of the lookup keys that are missing.
+
+    :param engine: Engine of the primary database.
+    :return: Indexes added.
+
+    :raises DuplicateKeysError: If users only differ by case. They must be
+        merged before the index can be built.
+    """
+    existing = {index["name"] for index in inspect(engine).get_indexes("user")}
+    added = []
+    for column in KEY_COLUMNS:
+        name = f"ix_user_{column}"
+        if name in existing:
+            continue
+        duplicates = find_duplicate_keys(engine, column)
+        if duplicates:
+            raise DuplicateKeysError(column, duplicates)
+
+        if engine.dialect.name == "mysql":
+            statement = (
+                f"ALTER TABLE {_table(engine)} ADD UNIQUE INDEX {name} ({column}), "
+                "ALGORITHM=INPLACE, LOCK=NONE"
+            )
+        else:
+            statement = f"CREATE UNIQUE INDEX {name} ON {_table(engine)} ({column})"
+        with engine.begin() as connection:
+            connection.execute(text(statement))
+        added.append(name)
+    return added
+
+
+def migrate(
+    engine: Engine,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    pause: float = BACKFILL_PAUSE,
+) -> int:
+    """
+    Add, fill and index the lookup keys of the user table.
+
+    :param engine: Engine of the primary database.
+    :param batch_size: Users per batch.
+    :param pause: Pause between batches, in seconds.
+    :return: Number of users backfilled.
+    """
+    add_key_columns(engine)
+    updated = backfill_keys(engine, batch_size, pause)
+    add_key_indexes(engine)
+    return updated
+
+
+if __name__ == "__main__":
+    from db.database import engine
+
+    print(f"Backfilled the lookup keys of {migrate(engine)} users")
@@ -1,7 +1,10 @@
+from models.revocation import RevocationOutbox  # noqa: F401, registers the table
 from models.user import User
 
-from db.database import engine
+from db.database import engine, shard_engines
 
 
 def create_tables():
     User.metadata.create_all(bind=engine)
+    for shard_engine in shard_engines:
+        User.__table__.create(bind=shard_engine, checkfirst=True)
@@ -5,6 +5,8 @@ from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from db.routing import ReplicaPool, RoutingSession
+
 load_dotenv()
 
 MYSQL_DATABASE = os.environ.get("MYSQL_DATABASE")
@@ -16,8 +18,20 @@ SQLALCHEMY_DATABASE_URL = os.environ.get(
     f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DATABASE}",
 )
 
+# Read replicas of the primary database, comma separated
+MYSQL_REPLICA_URLS = [
+    url for url in os.environ.get("MYSQL_REPLICA_URLS", "").split(",") if url
+]
+
+# Databases the user table is sharded across, comma separated. Shards may be
+# appended (then run db/reshard.py), never reordered or removed
+MYSQL_SHARD_URLS = [
+    url for url in os.environ.get("MYSQL_SHARD_URLS", "").split(",") if url
+]
+
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+replica_engines = [create_engine(url, connect_args={}) for url in MYSQL_REPLICA_URLS]
+shard_engines = [create_engine(url, connect_args={}) for url in MYSQL_SHARD_URLS]
 
 Base = declarative_base()
 
@@ -28,3 +42,23 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+if shard_engines:
+    # Imported here: the sharding layer needs the models, which need Base
+    from db.sharding import ShardedUserSession, make_shards
+
+    SessionLocal = sessionmaker(
+        class_=ShardedUserSession,
+        autocommit=False,
+        autoflush=False,
+        shards=make_shards(engine, shard_engines),
+    )
+else:
+    SessionLocal = sessionmaker(
+        class_=RoutingSession,
+        autocommit=False,
+        autoflush=False,
+        bind=engine,
+        replicas=ReplicaPool(replica_engines),
+    )
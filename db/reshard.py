@@ -0,0 +1,113 @@
+"""
+Online resharding of the user table.
+
+Walks the users of every source database in keyset batches and moves each
+one that is not on its shard (see db/sharding.py): the row is copied to its
+shard, the directory is pointed at the new shard, then the row is deleted
+from the source. Readers follow the directory, so a user is readable at every
+step, and each step can be replayed, so the tool can be stopped and run
+again at any time.
+
+Use it after appending shards to MYSQL_SHARD_URLS, or once sharding is
+enabled to move the users out of the main database. Run it again once every
+instance runs with the new shards, to catch users written meanwhile.
+
+Run with ``python -m db.reshard``.
+"""
+
+import os
+import time
+from typing import Dict
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, insert, inspect, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from db.sharding import MAIN_SHARD, shard_for_user
+from models.user import User, UserDirectory, normalize_key
+
+load_dotenv()
+
+RESHARD_BATCH_SIZE = int(os.environ.get("RESHARD_BATCH_SIZE", "500"))
+# Pause between batches, in seconds, leaving room for traffic and replication
+RESHARD_PAUSE = float(os.environ.get("RESHARD_PAUSE", "0.05"))
+
+_users = User.__table__
+_directory = UserDirectory.__table__
+
+
+def _point_directory(connection: Connection, row, shard: str):
+    values = {
+        "username_key": normalize_key(row.username),
+        "email_key": normalize_key(row.email),
+        "shard": shard,
+    }
+    result = connection.execute(
+        update(_directory).where(_directory.c.user_id == row.id).values(**values)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(_directory).values(user_id=row.id, **values))
+
+
+def reshard(
+    directory: Engine,
+    sources: Dict[str, Engine],
+    shards: Dict[str, Engine],
+    batch_size: int = RESHARD_BATCH_SIZE,
+    pause: float = RESHARD_PAUSE,
+) -> int:
+    """
+    Move every user to its shard.
+
+    :param directory: Engine of the main database, holding the directory.
+    :param sources: Databases to move users from, by shard id.
+    :param shards: User shards, by shard id ("0" to "n - 1").
+    :param batch_size: Users per batch.
+    :param pause: Pause between batches, in seconds.
+    :return: Number of users moved.
+    """
+    moved = 0
+    for source_id, source in sources.items():
+        if not inspect(source).has_table(User.__tablename__):
+            continue
+
+        last_id = ""
+        while True:
+            with source.connect() as connection:
+                rows = connection.execute(
+                    select(_users)
+                    .where(_users.c.id > last_id)
+                    .order_by(_users.c.id)
+                    .limit(batch_size)
+                ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            for row in rows:
+                shard_id = shard_for_user(row.id, len(shards))
+                if shard_id != source_id:
+                    with shards[shard_id].begin() as connection:
+                        copied = connection.execute(
+                            select(_users.c.id).where(_users.c.id == row.id)
+                        ).first()
+                        if copied is None:
+                            connection.execute(insert(_users).values(**row._mapping))
+                with directory.begin() as connection:
+                    _point_directory(connection, row, shard_id)
+                if shard_id != source_id:
+                    with source.begin() as connection:
+                        connection.execute(delete(_users).where(_users.c.id == row.id))
+                    moved += 1
+            time.sleep(pause)
+    return moved
+
+
+if __name__ == "__main__":
+    from db.database import engine, shard_engines
+    from db.sharding import make_shards
+
+    shards = make_shards(engine, shard_engines)
+    sources = dict(shards)
+    shards.pop(MAIN_SHARD)
+    print(f"Moved {reshard(engine, sources, shards)} users")
@@ -0,0 +1,134 @@
+import itertools
+import os
+import threading
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Delete, Insert, Update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from cache.cache import get_cache
+
+load_dotenv()
+
+# How long reads of a key go to the primary after a write of that key, in seconds
+READ_YOUR_WRITES_WINDOW = float(os.environ.get("READ_YOUR_WRITES_WINDOW", "5"))
+# How long a replica that failed is left out of the rotation, in seconds
+REPLICA_DOWN_FOR = float(os.environ.get("REPLICA_DOWN_FOR", "30"))
+
+
+class ReplicaPool:
+    """Round-robin over the replica engines that are not known to be down."""
+
+    def __init__(self, engines: List[Engine], down_for: float = REPLICA_DOWN_FOR):
+        self.engines = engines
+        self.down_for = down_for
+        self.down_until = {}
+        self.cycle = itertools.cycle(engines)
+        self.lock = threading.Lock()
+
+    def pick(self) -> Optional[Engine]:
+        """
+        Pick the next healthy replica.
+
+        :return: Replica engine, or None if there is no healthy replica.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for _ in range(len(self.engines)):
+                engine = next(self.cycle)
+                if self.down_until.get(engine, 0) <= now:
+                    return engine
+        return None
+
+    def mark_down(self, engine: Engine):
+        with self.lock:
+            self.down_until[engine] = time.monotonic() + self.down_for
+
+
+def record_write(key: str):
+    """
+    Send the reads of a key to the primary for READ_YOUR_WRITES_WINDOW, so a
+    user reads its own writes even if the replicas lag behind.
+
+    :param key: Key written, e.g. a username.
+    """
+    get_cache().set(f"wrote:{key}", True, ttl=READ_YOUR_WRITES_WINDOW)
+
+
+def read_your_writes(db: Session, key: str):
+    """
+    Tell a session which key it is about to read.
+
+    :param db: Database session.
+    :param key: Key read, e.g. a username.
+    """
+    db.info["read_key"] = key
+
+
+def use_primary(db: Session):
+    """Send every query of a session to the primary."""
+    db.info["primary"] = True
+
+
+class RoutingSession(Session):
+    """
+    Session sending writes to the primary engine (its bind) and reads to the
+    replicas.
+
+    Locking reads (SELECT ... FOR UPDATE) go to the primary, where the locks
+    coordinate with other writers. Reads go to the primary when the session
+    already wrote or locked, when it reads a key recently written (see
+    record_write) or when no replica is healthy.
+    A read that fails on a replica marks it down and is retried once on the
+    next healthy replica, or the primary.
+    """
+
+    def __init__(self, replicas: Optional[ReplicaPool] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.replicas = replicas
+        self.replica_used: Optional[Engine] = None
+
+    def reads_from_primary(self) -> bool:
+        if self.info.get("primary") or self.info.get("wrote"):
+            return True
+        if self.new or self.dirty or self.deleted:
+            return True
+        read_key = self.info.get("read_key")
+        return read_key is not None and bool(get_cache().get(f"wrote:{read_key}"))
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        self.replica_used = None
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+        if not self.replicas or not self.replicas.engines:
+            return primary
+
+        if (
+            self._flushing
+            or isinstance(clause, (Insert, Update, Delete))
+            or getattr(clause, "_for_update_arg", None) is not None
+        ):
+            self.info["wrote"] = True
+            return primary
+        if self.reads_from_primary():
+            return primary
+
+        replica = self.replicas.pick()
+        if replica is None:
+            return primary
+        self.replica_used = replica
+        return replica
+
+    def execute(self, statement, *args, **kwargs):
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except OperationalError:
+            replica = self.replica_used
+            if replica is None:
+                raise
+            self.replicas.mark_down(replica)
+            self.rollback()
+            return super().execute(statement, *args, **kwargs)
@@ -0,0 +1,246 @@
+import hashlib
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlalchemy.sql.util import find_tables
+
+from models.user import User, UserDirectory, normalize_key
+
+# Shard id of the main database, which holds the directory and every table
+# but the user table
+MAIN_SHARD = "main"
+
+# Lookup fields of the directory and the user columns they index
+_FIELDS = {
+    "id": "id",
+    "username": "username",
+    "username_key": "username",
+    "email": "email",
+    "email_key": "email",
+}
+
+
+class ShardingError(Exception):
+    """Raised when the shard of a user statement cannot be chosen."""
+
+
+def jump_hash(key: str, buckets: int) -> int:
+    """
+    Jump consistent hash of a key.
+
+    Going from n to n + 1 buckets only moves 1 / (n + 1) of the keys, all of
+    them to the new bucket.
+
+    :param key: Key to place.
+    :param buckets: Number of buckets.
+    :return: Bucket of the key, between 0 and buckets - 1.
+    """
+    state = int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        state = (state * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((state >> 33) + 1)))
+    return bucket
+
+
+def shard_for_user(user_id: str, shard_count: int) -> str:
+    """
+    Shard of a new user.
+
+    :param user_id: Id of the user, i.e. its Cognito sub.
+    :param shard_count: Number of user shards.
+    :return: Shard id, "0" to str(shard_count - 1).
+    """
+    return str(jump_hash(user_id, shard_count))
+
+
+def lookup_shards(
+    directory: Engine,
+    ids: Iterable[str] = (),
+    usernames: Iterable[str] = (),
+    emails: Iterable[str] = (),
+) -> Set[str]:
+    """
+    Find the shards of users in the directory.
+
+    :param directory: Engine of the main database.
+    :param ids: User ids.
+    :param usernames: Usernames, normalized or not.
+    :param emails: Emails, normalized or not.
+    :return: Shards of the users found.
+    """
+    criteria = []
+    if ids:
+        criteria.append(UserDirectory.user_id.in_(list(ids)))
+    if usernames:
+        keys = [normalize_key(username) for username in usernames]
+        criteria.append(UserDirectory.username_key.in_(keys))
+    if emails:
+        keys = [normalize_key(email) for email in emails]
+        criteria.append(UserDirectory.email_key.in_(keys))
+    if not criteria:
+        return set()
+    with directory.connect() as connection:
+        return set(
+            connection.execute(
+                select(UserDirectory.shard).where(or_(*criteria)).distinct()
+            ).scalars()
+        )
+
+
+def user_criteria(clause, parameters) -> Optional[Dict[str, Set[str]]]:
+    """
+    Find the users a WHERE clause can match.
+
+    :param clause: WHERE clause of a statement on the user table.
+    :param parameters: Parameters the statement is executed with.
+    :return: Ids, usernames and emails that bound the rows matched, or None
+        if the clause can match any user.
+    """
+    if isinstance(clause, BinaryExpression):
+        column, value = clause.left, clause.right
+        field = _FIELDS.get(getattr(column, "name", None))
+        if (
+            field is None
+            or getattr(getattr(column, "table", None), "name", None) != "user"
+            or not isinstance(value, BindParameter)
+            or clause.operator not in (operators.eq, operators.in_op)
+        ):
+            return None
+        value = value.effective_value
+        if value is None and isinstance(parameters, dict):
+            value = parameters.get(clause.right.key)
+        if value is None:
+            return None
+        values = set(value) if clause.operator is operators.in_op else {value}
+        return {field: values}
+
+    if isinstance(clause, BooleanClauseList):
+        children = [user_criteria(child, parameters) for child in clause.clauses]
+        if clause.operator is operators.and_:
+            # Any bounded condition bounds the whole conjunction
+            children = [child for child in children if child is not None]
+            return children[0] if children else None
+        if clause.operator is operators.or_ and None not in children:
+            merged = {}
+            for child in children:
+                for field, values in child.items():
+                    merged.setdefault(field, set()).update(values)
+            return merged
+    return None
+
+
+def is_user_statement(statement) -> bool:
+    return any(
+        table.name == User.__tablename__
+        for table in find_tables(statement, include_crud=True)
+    )
+
+
+class ShardedUserSession(ShardedSession):
+    """
+    Session spreading the user table across shards by a hash of User.id.
+
+    Every other table, and the user directory, live in the main database
+    (MAIN_SHARD). New users are placed with shard_for_user and recorded in
+    the directory in the same flush. Statements on the user table go to the
+    shards of the ids, usernames or emails their WHERE clause is bound to,
+    found in the directory, and to every shard otherwise (scatter-gather,
+    with results merged).
+    """
+
+    def __init__(self, shards: Dict[str, Engine], **kwargs):
+        super().__init__(
+            shard_chooser=self.choose_shard,
+            identity_chooser=self.choose_identity_shards,
+            execute_chooser=self.choose_execute_shards,
+            shards=shards,
+            **kwargs,
+        )
+        self.directory = shards[MAIN_SHARD]
+        self.user_shards = sorted(
+            (shard for shard in shards if shard != MAIN_SHARD), key=int
+        )
+
+    def shards_of(self, criteria: Optional[Dict[str, Set[str]]]) -> List[str]:
+        if criteria is None:
+            return self.user_shards
+        shards = lookup_shards(
+            self.directory,
+            ids=criteria.get("id", ()),
+            usernames=criteria.get("username", ()),
+            emails=criteria.get("email", ()),
+        )
+        # Users missing from the directory are looked for everywhere, e.g.
+        # while they are being resharded
+        return sorted(shards, key=int) if shards else self.user_shards
+
+    def choose_shard(self, mapper, instance, clause=None, **kwargs) -> str:
+        if instance is not None and isinstance(instance, User):
+            return inspect(instance).identity_token or shard_for_user(
+                instance.id, len(self.user_shards)
+            )
+        if clause is None or not is_user_statement(clause):
+            return MAIN_SHARD
+        shards = self.shards_of(
+            user_criteria(getattr(clause, "whereclause", None), None)
+        )
+        if len(shards) != 1:
+            raise ShardingError("Statement spans several user shards")
+        return shards[0]
+
+    def choose_identity_shards(self, mapper, primary_key, **kwargs) -> List[str]:
+        if mapper.class_ is not User:
+            return [MAIN_SHARD]
+        return self.shards_of({"id": {primary_key[0]}})
+
+    def choose_execute_shards(self, orm_context: ORMExecuteState) -> List[str]:
+        statement = orm_context.statement
+        if not is_user_statement(statement):
+            return [MAIN_SHARD]
+        return self.shards_of(
+            user_criteria(
+                getattr(statement, "whereclause", None), orm_context.parameters
+            )
+        )
+
+
+@event.listens_for(ShardedUserSession, "before_flush")
+def register_new_users(session: ShardedUserSession, flush_context, instances):
+    """
+    Record new users in the directory, in the flush that inserts them.
+
+    The unique keys of the directory keep usernames and emails unique across
+    shards.
+    """
+    for instance in list(session.new):
+        if isinstance(instance, User):
+            session.merge(
+                UserDirectory(
+                    user_id=instance.id,
+                    username_key=normalize_key(instance.username),
+                    email_key=normalize_key(instance.email),
+                    shard=shard_for_user(instance.id, len(session.user_shards)),
+                )
+            )
+
+
+def make_shards(main: Engine, user_shards: List[Engine]) -> Dict[str, Engine]:
+    """
+    Shard ids of the engines.
+
+    :param main: Engine of the main database.
+    :param user_shards: Engines of the user shards, in configuration order.
+        Shards may be appended, never reordered or removed.
+    :return: Engine of each shard id.
+    """
+    return {
+        MAIN_SHARD: main,
+        **{str(index): engine for index, engine in enumerate(user_shards)},
+    }
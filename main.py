@@ -1,18 +1,72 @@
+import asyncio
+import math
+import os
+import re
 from contextlib import asynccontextmanager
+from typing import FrozenSet, Optional, Tuple
+
+from dotenv import load_dotenv
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette import status
+from starlette.responses import JSONResponse
 
+from auth.revocation import load_revocations, run_outbox_worker, run_revocation_sync
+from auth.upstream import UpstreamUnavailable
 from db.create_database import create_tables
-from db.database import SessionLocal
+from db.database import SessionLocal, engine, replica_engines, shard_engines
+from observability.log import RequestIdMiddleware, setup_logging, stop_logging
+from observability.tracing import TracingMiddleware, setup_tracing, shutdown_tracing
 from routers import auth
 
+load_dotenv()
+
+# Origins allowed to call the API, comma separated. An entry may use "*" for
+# one subdomain label, e.g. https://*.clubsync.pt
+CORS_ALLOW_ORIGINS = os.environ.get("CORS_ALLOW_ORIGINS", "*")
+# How long browsers may cache a preflight response, in seconds. Browsers cap
+# it (Chromium at 2 hours, Firefox at 24 hours)
+CORS_MAX_AGE = int(os.environ.get("CORS_MAX_AGE", "86400"))
+
+
+def compile_origins(origins: str) -> Tuple[FrozenSet[str], Optional[str]]:
+    """
+    Compile an origin allowlist for the CORS middleware.
+
+    :param origins: Allowed origins, comma separated.
+    :return: Set of the exact origins, and a single regex matching the
+        wildcard ones (None if there is none).
+    """
+    exact, patterns = set(), []
+    for origin in origins.split(","):
+        origin = origin.strip().rstrip("/")
+        if not origin:
+            continue
+        if origin == "*" or "*" not in origin:
+            exact.add(origin)
+        else:
+            patterns.append(re.escape(origin).replace(r"\*", "[a-z0-9-]+"))
+    return frozenset(exact), "|".join(patterns) or None
+
 
 @asynccontextmanager
 async def lifespan(app):
+    setup_logging()
+    setup_tracing(engines=[engine, *replica_engines, *shard_engines])
     create_tables()
+    db = SessionLocal()
+    try:
+        load_revocations(db)
+    finally:
+        db.close()
+    outbox_worker = asyncio.create_task(run_outbox_worker())
+    revocation_sync = asyncio.create_task(run_revocation_sync())
     yield
+    revocation_sync.cancel()
+    outbox_worker.cancel()
+    shutdown_tracing()
+    stop_logging()
 
 
 app = FastAPI(
@@ -28,14 +82,6 @@ app = FastAPI(
     root_path="/users/v1",
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 
 @app.get(
     "/health",
@@ -51,9 +97,39 @@ def get_health():
 app.include_router(auth.router)
 
 
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
 @app.middleware("http")
 async def db_session_middleware(request: Request, call_next):
     request.state.db = SessionLocal()
     response = await call_next(request)
     request.state.db.close()
     return response
+
+
+# Each request is a span, continuing the trace of its traceparent header
+app.add_middleware(TracingMiddleware)
+
+# Every request, errors included, is logged with its correlation id
+app.add_middleware(RequestIdMiddleware)
+
+# Added last so that it is the outermost middleware: preflight requests are
+# answered before a database session is opened, routing or authentication
+allow_origins, allow_origin_regex = compile_origins(CORS_ALLOW_ORIGINS)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=allow_origins,
+    allow_origin_regex=allow_origin_regex,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
+    max_age=CORS_MAX_AGE,
+)
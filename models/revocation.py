@@ -0,0 +1,33 @@
+import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String, Text
+
+from db.database import Base
+
+
+def utcnow() -> datetime.datetime:
+    """Current time in UTC, without tzinfo as stored by the database."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class RevocationOutbox(Base):
+    """
+    Access tokens whose revocation still has to be, or has been, sent to
+    Cognito.
+
+    Rows are written by logout and drained by the revocation outbox worker.
+    """
+
+    __tablename__ = "revocation_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    # Needed by GlobalSignOut, cleared once the revocation is sent
+    access_token = Column(Text, nullable=True)
+    username = Column(String(200), nullable=True)
+    expires_at = Column(DateTime, index=True, nullable=False)
+    # Scanned every second by the incremental revocation sync
+    created_at = Column(DateTime, default=utcnow, index=True, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=utcnow, index=True, nullable=False)
+    sent_at = Column(DateTime, index=True, nullable=True)
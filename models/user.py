@@ -5,9 +5,15 @@ from sqlalchemy import Column, String, DateTime
 from sqlalchemy.orm import Session
 
 from db.database import Base, get_db
+from db.routing import record_write
 from schemas.user import CreateUser
 
 
+def normalize_key(value: str) -> str:
+    """Lookup key of a username or email: trimmed and lower-cased."""
+    return value.strip().lower()
+
+
 class User(Base):
     __tablename__ = "user"
 
@@ -15,14 +21,32 @@ class User(Base):
     name = Column(String(200), index=True, nullable=False)
     username = Column(String(200), unique=True, index=True, nullable=False)
     email = Column(String(200), unique=True, index=True, nullable=False)
+    # Case-insensitive lookup keys, see normalize_key. Nullable until the rows
+    # written before they existed are backfilled (db/backfill_user_keys.py)
+    username_key = Column(String(200), unique=True, index=True, nullable=True)
+    email_key = Column(String(200), unique=True, index=True, nullable=True)
     updated_at = Column(
         DateTime(timezone=True),
         index=True,
-        default=datetime.datetime.now(),
+        default=datetime.datetime.now,
         nullable=False,
     )
 
 
+class UserDirectory(Base):
+    """
+    Shard of each user, by id and by lookup key, when users are sharded
+    (see db/sharding.py). Lives in the main database.
+    """
+
+    __tablename__ = "user_directory"
+
+    user_id = Column(String(50), primary_key=True)
+    username_key = Column(String(200), unique=True, index=True, nullable=False)
+    email_key = Column(String(200), unique=True, index=True, nullable=False)
+    shard = Column(String(20), nullable=False)
+
+
 def save_user(new_user: CreateUser, db: Session = Depends(get_db)):
     """
     Save a new user in the database.
@@ -36,10 +60,13 @@ def save_user(new_user: CreateUser, db: Session = Depends(get_db)):
         name=new_user.name,
         username=new_user.username,
         email=new_user.email,
+        username_key=normalize_key(new_user.username),
+        email_key=normalize_key(new_user.email),
     )
 
     db.add(db_user)
     db.commit()
+    record_write(db_user.username)
     db.refresh(db_user)
 
     return db_user
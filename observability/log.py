@@ -0,0 +1,238 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Fraction of the high-volume success records kept, see log_success
+LOG_SUCCESS_SAMPLE_RATE = float(os.environ.get("LOG_SUCCESS_SAMPLE_RATE", "0.01"))
+# Records waiting to be written; records over it are dropped, never waited for
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# Correlation id of the request being handled
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributes of every LogRecord, anything else was passed through extra
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+# Sampling has its own generator, independent of the seed of the random module
+_sampler = random.Random()
+_traceback_formatter = logging.Formatter()
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with their extra fields."""
+
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S")
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps records with the request id.
+
+    Runs in the thread that logs, where the request context is known, before
+    the record is queued.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Copy of the record to queue, with its message merged.
+
+        The inherited prepare merges the traceback into the message and drops
+        it, so the traceback is formatted into exc_text instead, kept for the
+        "exception" field of JSONFormatter without keeping the frames alive.
+        """
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def log_success(
+    logger: logging.Logger,
+    message: str,
+    sample_rate: Optional[float] = None,
+    **fields,
+):
+    """
+    Log a high-volume success record, kept with probability sample_rate.
+
+    Records left out are dropped before they are even created.
+
+    :param logger: Logger to log with.
+    :param message: Message of the record.
+    :param sample_rate: Fraction of the records kept, defaults to
+        LOG_SUCCESS_SAMPLE_RATE.
+    :param fields: Fields of the record.
+    """
+    if sample_rate is None:
+        sample_rate = LOG_SUCCESS_SAMPLE_RATE
+    if _sampler.random() < sample_rate and logger.isEnabledFor(logging.INFO):
+        logger.info(message, extra={**fields, "sample_rate": sample_rate})
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(
+    stream=None, level: str = LOG_LEVEL, queue_size: int = LOG_QUEUE_SIZE
+) -> QueueListener:
+    """
+    Send the records of the root logger, as JSON lines, to a stream written
+    by a background thread, so that logging never blocks a request on I/O.
+
+    :param stream: Stream to write to, defaults to stdout.
+    :param level: Level of the root logger.
+    :param queue_size: Records waiting to be written before new ones are
+        dropped.
+    :return: Listener writing the records, already started.
+    """
+    global _listener
+    if _listener is not None:
+        stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter())
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for previous in [h for h in root.handlers if isinstance(h, DroppingQueueHandler)]:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write the records still queued and stop the listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def new_request_id(header: Optional[str]) -> str:
+    """
+    Request id of a request: the X-Request-ID sent by the client or the
+    gateway if it is well formed, otherwise a new one.
+    """
+    if header and _REQUEST_ID.fullmatch(header):
+        return header
+    return uuid.uuid4().hex
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware giving each request a correlation id.
+
+    The id is taken from the X-Request-ID header or generated, set in the
+    request_id context variable for every record logged while handling the
+    request, and sent back in the X-Request-ID response header. Each request
+    is logged once it is answered: errors always, successes sampled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                header = value.decode("latin-1")
+                break
+        token = request_id.set(new_request_id(header))
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = [
+                    (name, value)
+                    for name, value in message.get("headers", [])
+                    if name.lower() != b"x-request-id"
+                ]
+                headers.append((b"x-request-id", request_id.get().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            fields = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status_code": status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            if status_code < 400:
+                log_success(self.logger, "Request handled", **fields)
+            elif status_code < 500:
+                self.logger.info("Request rejected", extra=fields)
+            else:
+                self.logger.error("Request failed", extra=fields)
+            request_id.reset(token)
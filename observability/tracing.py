@@ -0,0 +1,244 @@
+import atexit
+import os
+from contextlib import nullcontext
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import (
+    ParentBased,
+    Sampler,
+    TraceIdRatioBased,
+)
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from opentelemetry.trace.propagation.tracecontext import (
+    TraceContextTextMapPropagator,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from observability.log import request_id
+
+load_dotenv()
+
+# "none" leaves tracing off, "file" writes spans as JSON lines to TRACE_FILE,
+# "memory" keeps them in this process
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+# Fraction of the traces started here that are recorded. Traces started
+# upstream keep the decision of their traceparent header
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+
+# Spans are no-ops until setup_tracing installs a provider
+tracer = trace.get_tracer("clubsync.users")
+
+_propagator = TraceContextTextMapPropagator()
+_provider: Optional[TracerProvider] = None
+
+
+def head_sampler(sample_rate: float) -> Sampler:
+    """
+    Sampler deciding once, when a trace starts, whether it is recorded.
+
+    :param sample_rate: Fraction of the new traces recorded.
+    :return: Sampler following the sampled flag of the parent span if there
+        is one, otherwise keeping sample_rate of the traces.
+    """
+    return ParentBased(TraceIdRatioBased(sample_rate))
+
+
+def make_exporter(name: str, path: str = TRACE_FILE) -> Optional[SpanExporter]:
+    """
+    Span exporter of a TRACE_EXPORTER value.
+
+    :param name: "none", "file" or "memory".
+    :param path: File the "file" exporter appends to.
+    :return: Exporter, or None if tracing is off.
+    """
+    if name == "file":
+        return ConsoleSpanExporter(
+            out=open(path, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    if name == "memory":
+        return InMemorySpanExporter()
+    return None
+
+
+def setup_tracing(
+    exporter: Optional[SpanExporter] = None,
+    sample_rate: float = TRACE_SAMPLE_RATE,
+    engines: Iterable[Engine] = (),
+) -> Optional[TracerProvider]:
+    """
+    Install the tracer provider, once per process.
+
+    Spans of the file exporter are written by a background thread, like log
+    records, while the in-memory exporter gets them as soon as they end.
+    While tracing is off, requests and statements are not instrumented at
+    all.
+
+    :param exporter: Exporter of the spans, defaults to the TRACE_EXPORTER one.
+    :param sample_rate: Fraction of the new traces recorded.
+    :param engines: Engines whose statements are traced.
+    :return: Tracer provider, or None if tracing is off.
+    """
+    global _provider
+    if _provider is not None:
+        return _provider
+    if exporter is None:
+        exporter = make_exporter(TRACE_EXPORTER)
+        if exporter is None:
+            return None
+
+    _provider = TracerProvider(
+        sampler=head_sampler(sample_rate),
+        resource=Resource.create({"service.name": "user-microservice"}),
+    )
+    if isinstance(exporter, InMemorySpanExporter):
+        _provider.add_span_processor(SimpleSpanProcessor(exporter))
+    else:
+        _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+    for engine in engines:
+        instrument_engine(engine)
+    return _provider
+
+
+def start_span(
+    name: str, kind: SpanKind = SpanKind.INTERNAL, attributes: Optional[dict] = None
+):
+    """
+    Start a span as the current span of a with block.
+
+    Spans of a trace that is not sampled, or started while tracing is off,
+    are not even created: the block gets the current span, whose methods do
+    nothing.
+
+    :param name: Name of the span.
+    :param kind: Kind of the span, CLIENT for calls to other services.
+    :param attributes: Attributes of the span.
+    :return: Context manager of the span.
+    """
+    parent = trace.get_current_span()
+    if _provider is None or (
+        parent.get_span_context().is_valid and not parent.is_recording()
+    ):
+        return nullcontext(parent)
+    return tracer.start_as_current_span(name, kind=kind, attributes=attributes)
+
+
+def shutdown_tracing():
+    """Export the spans still buffered."""
+    if _provider is not None:
+        _provider.force_flush()
+
+
+atexit.register(shutdown_tracing)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware starting a server span for each request.
+
+    The span continues the trace of the W3C traceparent header of the
+    request, if any, and is the parent of the spans of the auth, database
+    and Cognito calls made while handling it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _provider is None:
+            return await self.app(scope, receive, send)
+
+        carrier = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"]
+            if name in (b"traceparent", b"tracestate")
+        }
+        context = _propagator.extract(carrier) if carrier else None
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with tracer.start_as_current_span(
+            scope["method"],
+            context=context,
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+            },
+        ) as span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                if span.is_recording():
+                    route = scope.get("route")
+                    if route is not None:
+                        span.update_name(f"{scope['method']} {route.path}")
+                        span.set_attribute("http.route", route.path)
+                    span.set_attribute("http.response.status_code", status_code)
+                    span.set_attribute("request.id", request_id.get() or "")
+                    if status_code >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Statements are only traced as part of a recorded trace, e.g. a request
+    if not trace.get_current_span().is_recording():
+        return
+    context._span = tracer.start_span(
+        statement.split(None, 1)[0].upper() if statement else "SQL",
+        kind=SpanKind.CLIENT,
+        attributes={
+            "db.system": conn.dialect.name,
+            "db.statement": statement,
+            "server.address": conn.engine.url.host or "",
+        },
+    )
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, "_span", None)
+    if span is not None:
+        span.set_attribute("db.response.rows", cursor.rowcount)
+        span.end()
+        context._span = None
+
+
+def _handle_error(exception_context):
+    span = getattr(exception_context.execution_context, "_span", None)
+    if span is not None:
+        span.record_exception(exception_context.original_exception)
+        span.set_status(Status(StatusCode.ERROR))
+        span.end()
+        exception_context.execution_context._span = None
+
+
+def instrument_engine(engine: Engine):
+    """
+    Trace every statement run by an engine.
+
+    :param engine: Engine to trace.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
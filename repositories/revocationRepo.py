@@ -0,0 +1,116 @@
+import datetime
+from typing import List, Optional
+
+from fastapi import Depends
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from db.database import get_db
+from models.revocation import RevocationOutbox, utcnow
+
+
+def add_revocation(
+    token_hash: str,
+    access_token: str,
+    username: Optional[str],
+    expires_at: datetime.datetime,
+    db: Session = Depends(get_db),
+) -> RevocationOutbox:
+    """
+    Add a token to the revocation outbox, unless it is already there.
+
+    :param token_hash: SHA-256 of the access token.
+    :param access_token: Access token to revoke.
+    :param username: Username of the token owner.
+    :param expires_at: Expiry of the token.
+    :param db: Database session.
+    :return: Outbox row of the token.
+    """
+    row = (
+        db.query(RevocationOutbox)
+        .filter(RevocationOutbox.token_hash == token_hash)
+        .first()
+    )
+    if row is None:
+        row = RevocationOutbox(
+            token_hash=token_hash,
+            access_token=access_token,
+            username=username,
+            expires_at=expires_at,
+        )
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Logged out concurrently, the other request added the row
+            db.rollback()
+    return row
+
+
+def get_pending_revocations(
+    batch_size: int, now: datetime.datetime, db: Session = Depends(get_db)
+) -> List[RevocationOutbox]:
+    """
+    Get the revocations due to be sent, locking them for this worker.
+
+    Rows locked by another worker are skipped, so several replicas can drain
+    the outbox at once.
+
+    :param batch_size: Maximum number of rows.
+    :param now: Current time.
+    :param db: Database session.
+    :return: Outbox rows.
+    """
+    return (
+        db.query(RevocationOutbox)
+        .filter(
+            RevocationOutbox.sent_at.is_(None),
+            RevocationOutbox.next_attempt_at <= now,
+            # Expired tokens can not be signed out anymore
+            RevocationOutbox.expires_at > now,
+        )
+        .order_by(RevocationOutbox.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+
+def get_active_revocations(
+    now: datetime.datetime,
+    db: Session = Depends(get_db),
+    created_after: Optional[datetime.datetime] = None,
+):
+    """
+    Get the revocations of tokens that have not expired yet.
+
+    :param now: Current time.
+    :param db: Database session.
+    :param created_after: Only get the revocations created since then, if set.
+    :return: Token hash and expiry of each revocation.
+    """
+    query = db.query(RevocationOutbox.token_hash, RevocationOutbox.expires_at).filter(
+        RevocationOutbox.expires_at > now
+    )
+    if created_after is not None:
+        query = query.filter(RevocationOutbox.created_at >= created_after)
+    return query.all()
+
+
+def delete_expired_revocations(
+    before: datetime.datetime, db: Session = Depends(get_db)
+) -> int:
+    """
+    Delete the revocations of tokens that expired before a given time.
+
+    :param before: Expiry limit.
+    :param db: Database session.
+    :return: Number of rows deleted.
+    """
+    deleted = (
+        db.query(RevocationOutbox)
+        .filter(RevocationOutbox.expires_at < before)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
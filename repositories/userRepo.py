@@ -1,37 +1,212 @@
+import datetime
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
 from fastapi import HTTPException
 
 from fastapi import Depends
+from sqlalchemy import bindparam, or_, select
 from sqlalchemy.orm import Session
 
+from cache.cache import Cache, get_cache
 from db.database import get_db
-from models.user import save_user, User as UserModel
+from db.routing import read_your_writes
+from models.user import normalize_key, save_user, User as UserModel
 from schemas.user import CreateUser
 
+logger = logging.getLogger(__name__)
+
+# How long a username that does not exist is remembered, in seconds
+MISSING_USER_TTL = float(os.environ.get("MISSING_USER_TTL", "30"))
+# How long the version of a user (ETag and Last-Modified) is remembered, in seconds
+USER_VERSION_TTL = float(os.environ.get("USER_VERSION_TTL", "300"))
+
+
+@dataclass(frozen=True, slots=True)
+class UserRow:
+    """Read-only user returned by lookups, without ORM state."""
+
+    id: str
+    name: str
+    username: str
+    email: str
+    updated_at: datetime.datetime
+
+
+_users = UserModel.__table__
+# Core statement built once: each lookup reuses its compiled form from the
+# engine cache and skips the ORM query, identity map and instance loading
+_user_columns = (
+    _users.c.id,
+    _users.c.name,
+    _users.c.username,
+    _users.c.email,
+    _users.c.updated_at,
+)
+_user_by_username = select(*_user_columns).where(
+    _users.c.username == bindparam("username")
+)
+_users_page = (
+    select(*_user_columns)
+    .where(_users.c.id > bindparam("after"))
+    .order_by(_users.c.id)
+    .limit(bindparam("limit"))
+)
+
+
+def _missing_user_key(username: str) -> str:
+    return f"missing-user:{username}"
+
+
+def _user_version_key(username: str) -> str:
+    return f"user-version:{username}"
+
+
+def user_version(user: UserRow) -> Tuple[str, float]:
+    """
+    Version of a user, for conditional requests.
+
+    :param user: User to get the version of.
+    :return: Strong ETag derived from the id and updated_at of the user, and
+        updated_at as a timestamp.
+    """
+    digest = hashlib.sha256(
+        f"{user.id}:{user.updated_at.isoformat()}".encode()
+    ).hexdigest()
+    return f'"{digest[:32]}"', user.updated_at.timestamp()
+
+
+def get_user_version(
+    username: str, cache: Cache = Depends(get_cache)
+) -> Optional[Tuple[str, float]]:
+    """
+    Get the version of a user from the version index, without querying the
+    database.
+
+    :param username: Username of the user.
+    :param cache: Cache holding the version index.
+    :return: ETag and updated_at timestamp if known, otherwise None.
+    """
+    version = cache.get(_user_version_key(username))
+    return tuple(version) if version else None
+
+
+def forget_missing_user(username: str, cache: Cache = Depends(get_cache)):
+    """
+    Drop a username from the negative cache, e.g. right after creating it.
+
+    :param username: Username of the user.
+    :param cache: Cache holding the negative cache.
+    """
+    cache.delete(_missing_user_key(username))
+
 
-def new_user(user: CreateUser, db: Session = Depends(get_db)):
+def new_user(
+    user: CreateUser, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)
+):
     """
     Create a new user in the database.
 
     :param user: User object to create.
     :param db: Database session.
+    :param cache: Cache holding the negative cache.
     :return: User object created.
     """
-    return save_user(new_user=user, db=db)
+    db_user = save_user(new_user=user, db=db)
+    forget_missing_user(user.username, cache)
+    return db_user
+
+
+def get_user_by_username(
+    username: str, db: Session = Depends(get_db)
+) -> Optional[UserRow]:
+    """
+    Get a user by username.
+
+    :param username: Username of the user to get.
+    :param db: Database session.
+    :return: UserRow if found, otherwise None.
+    """
+    read_your_writes(db, username)
+    row = db.execute(_user_by_username, {"username": username}).first()
+    return UserRow(*row) if row is not None else None
+
+
+def list_users(
+    after: str = "", limit: int = 100, db: Session = Depends(get_db)
+) -> List[UserRow]:
+    """
+    Get a page of users, ordered by id.
 
+    When users are sharded every shard returns its own page, and the pages
+    are merged.
 
-def get_user_by_username(username: str, db: Session = Depends(get_db)):
-    return db.query(UserModel).filter(UserModel.username == username).first()
+    :param after: Id of the last user of the previous page.
+    :param limit: Maximum number of users.
+    :param db: Database session.
+    :return: Users of the page.
+    """
+    rows = db.execute(_users_page, {"after": after, "limit": limit}).all()
+    return [UserRow(*row) for row in sorted(rows, key=lambda row: row.id)[:limit]]
 
 
-def get_user(username: str, db: Session = Depends(get_db)):
+def user_exists(username: str, email: str, db: Session = Depends(get_db)) -> bool:
+    """
+    Check whether a user exists with the same username or email, ignoring case
+    and surrounding whitespace.
+
+    Both lookup keys are checked by a single query.
+
+    :param username: Username to look for.
+    :param email: Email to look for.
+    :param db: Database session.
+    :return: True if such a user exists, otherwise False.
+    """
+    read_your_writes(db, username)
+    return (
+        db.query(UserModel.id)
+        .filter(
+            or_(
+                UserModel.username_key == normalize_key(username),
+                UserModel.email_key == normalize_key(email),
+            )
+        )
+        .first()
+        is not None
+    )
+
+
+def get_user(
+    username: str, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)
+):
     """
     Get a user by username.
 
+    Usernames that are not found are remembered for a short time, so repeated
+    lookups of unknown users are rejected without querying the database.
+    The version of users found is kept in the version index (see
+    get_user_version).
+
     :param username: Username of the user to get.
     :param db: Database session.
+    :param cache: Cache holding the negative cache and the version index.
     :return: User object if found, otherwise raise an HTTPException.
     """
+    if cache.get(_missing_user_key(username)):
+        raise HTTPException(status_code=404, detail="User not found")
+
     db_user = get_user_by_username(username, db)
     if db_user is None:
+        logger.info("User not found", extra={"username": username})
+        cache.set(_missing_user_key(username), True, ttl=MISSING_USER_TTL)
         raise HTTPException(status_code=404, detail="User not found")
+
+    cache.set(
+        _user_version_key(username),
+        list(user_version(db_user)),
+        ttl=USER_VERSION_TTL,
+    )
     return db_user
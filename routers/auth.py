@@ -1,46 +1,135 @@
 import os
+from email.utils import formatdate, parsedate_to_datetime
 
 from dotenv import load_dotenv
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from fastapi import APIRouter, Depends, HTTPException
 from db.database import get_db
 
-from auth.JWTBearer import JWTAuthorizationCredentials, JWTBearer
-from auth.auth import jwks, get_current_user
-from auth.user_auth import auth_with_code, user_info_with_token, logout_with_token
-from models.user import User, save_user
-from repositories.userRepo import get_user
+from auth.JWTBearer import JWTAuthorizationCredentials
+from auth.api_key import introspect_auth
+from auth.auth import auth, get_current_user
+from auth.rate_limit import (
+    introspect_rate_limit,
+    refresh_rate_limit,
+    sign_in_rate_limit,
+    user_rate_limit,
+)
+from auth.revocation import revoke_token
+from auth.user_auth import auth_with_code, refresh_with_token, user_info_with_token
+from cache.cache import Cache, get_cache
+from models.user import save_user
+from repositories.userRepo import (
+    forget_missing_user,
+    get_user,
+    get_user_version,
+    user_exists,
+    user_version,
+)
+from schemas.token import IntrospectTokens
 from schemas.user import CreateUser
 
 load_dotenv()
 
 router = APIRouter(tags=["Authentication and Authorization"])
 
-auth = JWTBearer(jwks)
-
 REDIRECT_URI = os.environ.get("REDIRECT_URI")
 
+# Cookie holding the refresh token, sent by browsers only to the auth routes
+REFRESH_COOKIE_NAME = os.environ.get("REFRESH_COOKIE_NAME", "refresh_token")
+REFRESH_COOKIE_PATH = os.environ.get("REFRESH_COOKIE_PATH", "/users/v1/auth")
+# Validity of the refresh tokens of the app client, in seconds
+REFRESH_COOKIE_MAX_AGE = int(os.environ.get("REFRESH_COOKIE_MAX_AGE", "2592000"))
+
+
+def set_refresh_cookie(response: Response, refresh_token: str):
+    """Keep a refresh token in a cookie scripts can not read."""
+    response.set_cookie(
+        REFRESH_COOKIE_NAME,
+        refresh_token,
+        max_age=REFRESH_COOKIE_MAX_AGE,
+        path=REFRESH_COOKIE_PATH,
+        secure=True,
+        httponly=True,
+        samesite="strict",
+    )
+
+
+def version_headers(etag: str, last_modified: float) -> dict:
+    """Validator headers of a response, to be revalidated on each use."""
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
 
-@router.post("/auth/sign-in")
-async def login(code: str, db: Session = Depends(get_db)):
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """
+    Check the conditional headers of a request against a version.
+
+    If-None-Match takes precedence over If-Modified-Since.
+
+    :param request: Incoming request.
+    :param etag: Current ETag.
+    :param last_modified: Current last modification timestamp.
+    :return: True if the client copy is current, otherwise False.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have a resolution of one second
+        return int(last_modified) <= since
+    return False
+
+
+def provision_user(new_user: CreateUser, db: Session, cache: Cache):
+    """Save a signed in user, unless it already exists. Blocking."""
+    if user_exists(new_user.username, new_user.email, db):
+        return
+    try:
+        save_user(new_user, db)
+    except IntegrityError:
+        # Missed by a lagging replica or a row not backfilled yet, the user
+        # already exists
+        db.rollback()
+    else:
+        forget_missing_user(new_user.username, cache)
+
+
+@router.post("/auth/sign-in", dependencies=[Depends(sign_in_rate_limit)])
+async def login(
+    code: str, db: Session = Depends(get_db), cache: Cache = Depends(get_cache)
+):
     """
     Function that logs in a user.
 
     :param code: Authorization code obtained after user login.
     :param db: Database session.
+    :param cache: Cache holding the negative cache of users.
     :return: Access token and expiration time if authentication is successful, otherwise raise an HTTPException.
     """
 
     # Authenticate user with the code
-    token = auth_with_code(code, REDIRECT_URI)
+    token = await run_in_threadpool(auth_with_code, code, REDIRECT_URI)
     if token is None:
         raise HTTPException(status_code=401, detail="Error loging in...")
     else:
         # Get user info from the token
-        user_info = user_info_with_token(token.get("token"))
+        user_info = await run_in_threadpool(user_info_with_token, token.get("token"))
 
         new_user = CreateUser(
             id=user_info["UserAttributes"][3]["Value"],
@@ -49,44 +138,139 @@ async def login(code: str, db: Session = Depends(get_db)):
             email=user_info["UserAttributes"][0]["Value"],
         )
 
-        # If the user does not exist, save it
-        if not (
-            db.query(User).filter(User.username == new_user.username).first()
-            or db.query(User).filter(User.email == new_user.email).first()
-        ):
-            save_user(new_user, db)
+        await run_in_threadpool(provision_user, new_user, db, cache)
 
-        return JSONResponse(status_code=200, content=jsonable_encoder(token))
+        refresh_token = token.pop("refresh_token", None)
+        response = JSONResponse(status_code=200, content=jsonable_encoder(token))
+        if refresh_token:
+            set_refresh_cookie(response, refresh_token)
+        return response
 
 
-@router.get("/auth/me", dependencies=[Depends(auth)])
+@router.post("/auth/refresh", dependencies=[Depends(refresh_rate_limit)])
+async def refresh(request: Request):
+    """
+    Function that renews the access token of a signed in user.
+
+    The refresh token comes from the cookie set at sign-in, and the user is
+    not provisioned again.
+
+    :param request: Incoming request.
+    :return: Access token and expiration time if the refresh token is valid, otherwise raise an HTTPException.
+    """
+    refresh_token = request.cookies.get(REFRESH_COOKIE_NAME)
+    if not refresh_token:
+        raise HTTPException(status_code=401, detail="Missing refresh token")
+
+    token = await run_in_threadpool(refresh_with_token, refresh_token)
+    if token is None:
+        response = JSONResponse(
+            status_code=401, content={"detail": "Invalid refresh token"}
+        )
+        response.delete_cookie(REFRESH_COOKIE_NAME, path=REFRESH_COOKIE_PATH)
+        return response
+
+    # Only set when Cognito rotates refresh tokens
+    new_refresh_token = token.pop("refresh_token", None)
+    response = JSONResponse(status_code=200, content=jsonable_encoder(token))
+    if new_refresh_token:
+        set_refresh_cookie(response, new_refresh_token)
+    return response
+
+
+@router.get("/auth/me", dependencies=[Depends(user_rate_limit), Depends(auth)])
 async def current_user(
-    username: str = Depends(get_current_user), db: Session = Depends(get_db)
+    request: Request,
+    username: str = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    cache: Cache = Depends(get_cache),
 ):
     """
     Function that returns the current user.
 
+    Responses carry an ETag and a Last-Modified date, and conditional requests
+    for an unchanged user get a 304 answered from the version index, without
+    loading the user.
+
+    :param request: Incoming request.
     :param username: Username of the user to get.
     :param db: Database session.
+    :param cache: Cache holding the version index.
     :return: User object if found, otherwise raise an HTTPException
     """
+    # The cache and the database are blocking, keep them off the event loop
+    version = await run_in_threadpool(get_user_version, username, cache)
+    if version is not None and is_not_modified(request, *version):
+        return Response(status_code=304, headers=version_headers(*version))
+
+    user = await run_in_threadpool(get_user, username=username, db=db, cache=cache)
+    version = user_version(user)
+    if is_not_modified(request, *version):
+        return Response(status_code=304, headers=version_headers(*version))
     return JSONResponse(
         status_code=200,
-        content=jsonable_encoder(get_user(username=username, db=db)),
+        content=jsonable_encoder(user),
+        headers=version_headers(*version),
     )
 
 
-@router.get("/auth/logout", dependencies=[Depends(auth)])
-async def logout(credentials: JWTAuthorizationCredentials = Depends(auth)):
+@router.get("/auth/logout", dependencies=[Depends(user_rate_limit), Depends(auth)])
+async def logout(
+    credentials: JWTAuthorizationCredentials = Depends(auth),
+    db: Session = Depends(get_db),
+):
     """
     Function that logs out a user.
 
+    The token is revoked at once for this service, and the revocation is sent
+    to Cognito in the background through the revocation outbox, which also
+    invalidates the refresh tokens of the user. The refresh cookie is cleared.
+
     :param credentials: JWTAuthorizationCredentials object.
-    :return: Message if logout is successful, otherwise raise an HTTPException.
+    :param db: Database session.
+    :return: Message if logout is successful.
     """
 
-    result = logout_with_token(credentials.jwt_token)
-    if result:
-        return JSONResponse(status_code=200, content="Logout successful")
-    else:
-        raise HTTPException(status_code=401, detail="Error loging out...")
+    await run_in_threadpool(
+        revoke_token,
+        credentials.jwt_token,
+        credentials.claims.get("username"),
+        float(credentials.claims["exp"]),
+        db,
+    )
+    response = JSONResponse(status_code=200, content="Logout successful")
+    response.delete_cookie(REFRESH_COOKIE_NAME, path=REFRESH_COOKIE_PATH)
+    return response
+
+
+@router.post("/auth/introspect", dependencies=[Depends(introspect_auth)])
+async def introspect(
+    request: Request, body: IntrospectTokens, cache: Cache = Depends(get_cache)
+):
+    """
+    Function that validates a batch of tokens, for gateways and other services.
+
+    Callers authenticate with an API key (see INTROSPECT_API_KEYS), and are
+    rate limited per distinct token, since each one costs a signature check.
+    Tokens are validated locally (structure, claims and signature); Cognito is
+    not asked whether each one was revoked.
+
+    :param request: Incoming request.
+    :param body: Tokens to validate.
+    :param cache: Cache shared by the rate limits.
+    :return: For each token, in order, whether it is active with its claims or the reason it is not.
+    """
+    await run_in_threadpool(
+        introspect_rate_limit.check, request, cache, len(set(body.tokens))
+    )
+    verified = await run_in_threadpool(auth.verify_tokens, body.tokens)
+
+    results = [
+        (
+            {"active": True, "claims": result.claims}
+            if isinstance(result, JWTAuthorizationCredentials)
+            else {"active": False, "error": result.detail}
+        )
+        for result in verified
+    ]
+    return JSONResponse(status_code=200, content={"results": results})
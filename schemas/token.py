@@ -0,0 +1,11 @@
+import os
+from typing import List
+
+from pydantic import BaseModel, Field
+
+# Maximum number of tokens in one introspection request
+INTROSPECT_MAX_TOKENS = int(os.environ.get("INTROSPECT_MAX_TOKENS", "1000"))
+
+
+class IntrospectTokens(BaseModel):
+    tokens: List[str] = Field(min_length=1, max_length=INTROSPECT_MAX_TOKENS)
@@ -0,0 +1,91 @@
+import socketserver
+import threading
+import time
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Answers the handful of RESP2 commands used by RedisCache."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def write_bulk(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            server.commands.append(command.decode())
+            with server.lock:
+                if command == b"GET":
+                    self.write_bulk(server.lookup(args[1]))
+                elif command == b"MGET":
+                    self.wfile.write(b"*%d\r\n" % (len(args) - 1))
+                    for key in args[1:]:
+                        self.write_bulk(server.lookup(key))
+                elif command == b"SET":
+                    key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+                    if b"NX" in options and server.lookup(key) is not None:
+                        self.write_bulk(None)
+                        continue
+                    expires_at = None
+                    if b"PX" in options:
+                        ttl = int(options[options.index(b"PX") + 1])
+                        expires_at = time.monotonic() + ttl / 1000
+                    server.data[key] = (value, expires_at)
+                    self.wfile.write(b"+OK\r\n")
+                elif command == b"DEL":
+                    removed = sum(server.data.pop(key, None) is not None for key in args[1:])
+                    self.wfile.write(b":%d\r\n" % removed)
+                elif command in (b"PING", b"SELECT", b"AUTH"):
+                    self.wfile.write(b"+OK\r\n")
+                else:
+                    self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.data = {}
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from cache.cache import Cache, InMemoryCache, RedisCache, create_cache
+from tests.cache.fake_redis_server import FakeRedisServer
+
+
+@pytest.fixture(scope="module")
+def redis_server():
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request, redis_server):
+    if request.param == "memory":
+        return InMemoryCache()
+    redis_server.data.clear()
+    return RedisCache(redis_server.url)
+
+
+def test_set_get_delete(cache):
+    assert cache.get("key") is None
+    cache.set("key", {"value": 1})
+    assert cache.get("key") == {"value": 1}
+    cache.delete("key")
+    assert cache.get("key") is None
+
+
+def test_ttl_expires(cache):
+    cache.set("key", "value", ttl=0.05)
+    assert cache.get("key") == "value"
+    time.sleep(0.1)
+    assert cache.get("key") is None
+
+
+def test_add_only_sets_missing_keys(cache):
+    assert cache.add("key", "first") is True
+    assert cache.add("key", "second") is False
+    assert cache.get("key") == "first"
+
+
+def test_get_many(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get_many(["a", "b", "c"]) == {"a": 1, "b": 2}
+
+
+def test_get_or_set_loads_once_under_concurrency(cache):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return "loaded"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_set("key", loader)))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["loaded"] * 10
+    assert len(calls) == 1
+
+
+def test_in_memory_cache_is_bounded():
+    cache = InMemoryCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get_many(["a", "c"]) == {"a": 1, "c": 3}
+
+
+def test_redis_cache_unreachable_is_a_miss():
+    cache = RedisCache("redis://127.0.0.1:1/0")
+
+    cache.set("key", "value")
+    assert cache.get("key") is None
+    assert cache.get_or_set("key", lambda: "loaded") == "loaded"
+
+
+def test_create_cache_from_url(redis_server):
+    assert isinstance(create_cache("memory://"), InMemoryCache)
+    assert isinstance(create_cache(redis_server.url), RedisCache)
+
+
+def test_incomplete_backend_fails_when_created():
+    class GetOnlyCache(Cache):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyCache()
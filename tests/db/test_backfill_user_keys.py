@@ -0,0 +1,90 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from db.backfill_user_keys import DuplicateKeysError, migrate
+from repositories.userRepo import user_exists
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    # The user table as it was before the lookup keys
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE user (id VARCHAR(50) PRIMARY KEY, name VARCHAR(200), "
+                "username VARCHAR(200) UNIQUE, email VARCHAR(200) UNIQUE, "
+                "updated_at DATETIME)"
+            )
+        )
+    return engine
+
+
+def insert_users(engine, users):
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO user (id, name, username, email, updated_at) "
+                "VALUES (:id, :username, :username, :email, '2024-01-01 00:00:00')"
+            ),
+            [
+                {"id": f"id{i}", "username": username, "email": email}
+                for i, (username, email) in enumerate(users)
+            ],
+        )
+
+
+def keys(engine):
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT username_key, email_key FROM user ORDER BY id")
+        ).all()
+
+
+def test_migrate_backfills_in_batches_and_indexes(engine):
+    insert_users(
+        engine,
+        [(f"User{i}", f" User{i}@Email.com ") for i in range(5)],
+    )
+
+    assert migrate(engine, batch_size=2, pause=0) == 5
+
+    assert keys(engine) == [(f"user{i}", f"user{i}@email.com") for i in range(5)]
+    indexes = {index["name"]: index for index in inspect(engine).get_indexes("user")}
+    assert indexes["ix_user_username_key"]["unique"]
+    assert indexes["ix_user_email_key"]["unique"]
+
+    db = sessionmaker(bind=engine)()
+    assert user_exists("USER3", "other@email.com", db)
+    assert user_exists("other", "user4@EMAIL.com", db)
+    assert not user_exists("other", "other@email.com", db)
+    db.close()
+
+
+def test_migrate_can_run_again(engine):
+    insert_users(engine, [("User0", "user0@email.com")])
+    migrate(engine, pause=0)
+    assert migrate(engine, pause=0) == 0
+
+    # Written by an instance still running the previous code
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO user (id, name, username, email, updated_at) "
+                "VALUES ('id9', 'User9', 'User9', 'user9@email.com', '2024-01-01')"
+            )
+        )
+    assert migrate(engine, pause=0) == 1
+
+
+def test_migrate_stops_on_users_only_differing_by_case(engine):
+    insert_users(engine, [("User", "a@email.com"), ("user", "b@email.com")])
+
+    with pytest.raises(DuplicateKeysError) as exception:
+        migrate(engine, pause=0)
+
+    assert exception.value.column == "username_key"
+    assert exception.value.duplicates == ["user"]
+    index_names = [index["name"] for index in inspect(engine).get_indexes("user")]
+    assert "ix_user_username_key" not in index_names
@@ -0,0 +1,155 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cache.cache import get_cache
+from db.database import Base
+from db.routing import ReplicaPool, RoutingSession, read_your_writes, use_primary
+from models.user import User, save_user
+from repositories.userRepo import get_user_by_username
+from schemas.user import CreateUser
+
+
+def sqlite_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def engines(tmp_path):
+    primary = sqlite_engine(tmp_path / "primary.db")
+    replicas = [sqlite_engine(tmp_path / f"replica{i}.db") for i in range(2)]
+    yield primary, replicas
+    get_cache().clear()
+
+
+def make_session(primary, replicas):
+    return sessionmaker(
+        class_=RoutingSession,
+        autocommit=False,
+        autoflush=False,
+        bind=primary,
+        replicas=ReplicaPool(replicas),
+    )()
+
+
+def create_user(username):
+    return CreateUser(
+        id=username, name=username, username=username, email=f"{username}@email.com"
+    )
+
+
+def replica_user(replica, username):
+    db = sessionmaker(bind=replica)()
+    db.add(
+        User(
+            id=username, name=username, username=username, email=f"{username}@email.com"
+        )
+    )
+    db.commit()
+    db.close()
+
+
+def test_reads_go_to_replicas_round_robin(engines):
+    primary, replicas = engines
+    replica_user(replicas[0], "replica0")
+    replica_user(replicas[1], "replica1")
+
+    session_factory = sessionmaker(
+        class_=RoutingSession, bind=primary, replicas=ReplicaPool(replicas)
+    )
+
+    found = []
+    for _ in range(4):
+        db = session_factory()
+        found.append([user.username for user in db.query(User).all()])
+        db.close()
+
+    assert found == [["replica0"], ["replica1"], ["replica0"], ["replica1"]]
+
+
+def test_writes_go_to_primary_and_session_sticks_to_it(engines):
+    primary, replicas = engines
+    db = make_session(primary, replicas)
+
+    save_user(create_user("username1"), db)
+
+    assert db.query(User).count() == 1
+    db.close()
+    assert sessionmaker(bind=primary)().query(User).count() == 1
+    assert sessionmaker(bind=replicas[0])().query(User).count() == 0
+
+
+def test_reads_own_writes_from_primary(engines):
+    primary, replicas = engines
+    db = make_session(primary, replicas)
+    save_user(create_user("username1"), db)
+    db.close()
+
+    db = make_session(primary, replicas)
+    assert get_user_by_username("username1", db).username == "username1"
+    # Other users are still read from the replicas
+    assert get_user_by_username("username2", db) is None
+    assert db.replica_used is not None
+    db.close()
+
+
+def test_reads_from_replicas_after_write_window(engines):
+    primary, replicas = engines
+    db = make_session(primary, replicas)
+    save_user(create_user("username1"), db)
+    db.close()
+    get_cache().delete("wrote:username1")
+
+    db = make_session(primary, replicas)
+    assert get_user_by_username("username1", db) is None
+    db.close()
+
+
+def test_use_primary(engines):
+    primary, replicas = engines
+    replica_user(primary, "username1")
+    db = make_session(primary, replicas)
+
+    use_primary(db)
+
+    assert db.query(User).count() == 1
+    assert db.replica_used is None
+
+
+def test_locking_reads_go_to_primary(engines):
+    primary, replicas = engines
+    replica_user(primary, "username1")
+    db = make_session(primary, replicas)
+
+    assert db.query(User).with_for_update(skip_locked=True).count() == 1
+    assert db.replica_used is None
+    # The rest of the session stays on the primary
+    assert db.query(User).count() == 1
+
+
+def test_down_replica_falls_back_and_is_skipped(engines, tmp_path):
+    primary, replicas = engines
+    down = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    replica_user(replicas[0], "replica0")
+    pool = ReplicaPool([down, replicas[0]], down_for=60)
+    session_factory = sessionmaker(class_=RoutingSession, bind=primary, replicas=pool)
+
+    db = session_factory()
+    read_your_writes(db, "username1")
+    assert [user.username for user in db.query(User).all()] == ["replica0"]
+    db.close()
+
+    assert pool.down_until[down] > 0
+    for _ in range(3):
+        assert pool.pick() is replicas[0]
+
+
+def test_without_replicas_everything_goes_to_primary(engines):
+    primary, _ = engines
+    replica_user(primary, "username1")
+    db = make_session(primary, [])
+
+    assert db.query(User).count() == 1
+    assert db.replica_used is None
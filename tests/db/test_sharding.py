@@ -0,0 +1,220 @@
+import datetime
+from collections import Counter
+
+import pytest
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from db.database import Base
+from db.reshard import reshard
+from db.sharding import MAIN_SHARD, ShardedUserSession, jump_hash, make_shards
+from models.revocation import RevocationOutbox
+from models.user import User, UserDirectory, save_user
+from repositories.revocationRepo import add_revocation
+from repositories.userRepo import get_user_by_username, list_users, user_exists
+from schemas.user import CreateUser
+
+
+@pytest.fixture
+def databases(tmp_path):
+    def sqlite_engine(name):
+        engine = create_engine(f"sqlite:///{tmp_path / name}.db")
+        engine.statements = []
+        event.listen(
+            engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: engine.statements.append(statement),
+        )
+        return engine
+
+    main = sqlite_engine("main")
+    Base.metadata.create_all(main)
+    shards = [sqlite_engine(f"shard{i}") for i in range(4)]
+    for shard in shards:
+        User.__table__.create(shard)
+    return main, shards
+
+
+def session_factory(main, shards):
+    return sessionmaker(
+        class_=ShardedUserSession,
+        autocommit=False,
+        autoflush=False,
+        shards=make_shards(main, shards),
+    )
+
+
+def create_user(i):
+    return CreateUser(
+        id=f"id{i}", name=f"name{i}", username=f"User{i}", email=f"user{i}@email.com"
+    )
+
+
+def user_ids(engine):
+    with engine.connect() as connection:
+        return set(connection.execute(select(User.id)).scalars())
+
+
+def directory(main):
+    with main.connect() as connection:
+        return dict(
+            connection.execute(select(UserDirectory.user_id, UserDirectory.shard)).all()
+        )
+
+
+def user_queries(engines):
+    return sum(
+        1
+        for engine in engines
+        for statement in engine.statements
+        if 'FROM "user"' in statement or "FROM user" in statement
+    )
+
+
+def test_jump_hash_only_moves_keys_to_new_bucket():
+    keys = [f"id{i}" for i in range(2000)]
+    before = {key: jump_hash(key, 3) for key in keys}
+    after = {key: jump_hash(key, 4) for key in keys}
+
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == 3 for key in moved)
+    assert 350 < len(moved) < 650
+    assert set(Counter(before.values())) == {0, 1, 2}
+
+
+def test_users_spread_across_shards_and_directory(databases):
+    main, shards = databases
+    db = session_factory(main, shards[:3])()
+
+    for i in range(30):
+        save_user(create_user(i), db)
+
+    placement = directory(main)
+    assert len(placement) == 30
+    for shard_id, shard in enumerate(shards[:3]):
+        assert user_ids(shard) == {
+            user_id for user_id, placed in placement.items() if placed == str(shard_id)
+        }
+        assert user_ids(shard)
+    assert user_ids(main) == set()
+    db.close()
+
+
+def test_lookups_go_to_a_single_shard(databases):
+    main, shards = databases
+    db = session_factory(main, shards[:3])()
+    for i in range(10):
+        save_user(create_user(i), db)
+    db.close()
+    for engine in shards:
+        engine.statements.clear()
+
+    db = session_factory(main, shards[:3])()
+    assert get_user_by_username("User7", db).id == "id7"
+    assert user_exists("user3", "other@email.com", db)
+    assert user_exists("other", "USER4@email.com", db)
+    assert db.get(User, "id5").username == "User5"
+    assert user_queries(shards) == 4
+    db.close()
+
+
+def test_unknown_users_are_looked_for_on_every_shard(databases):
+    main, shards = databases
+    db = session_factory(main, shards[:3])()
+
+    assert get_user_by_username("nobody", db) is None
+    assert not user_exists("nobody", "nobody@email.com", db)
+    assert user_queries(shards) == 6
+    db.close()
+
+
+def test_list_users_gathers_every_shard(databases):
+    main, shards = databases
+    db = session_factory(main, shards[:3])()
+    for i in range(20):
+        save_user(create_user(i), db)
+
+    first = list_users(limit=7, db=db)
+    second = list_users(after=first[-1].id, limit=100, db=db)
+
+    ids = [user.id for user in first + second]
+    assert ids == sorted(f"id{i}" for i in range(20))
+    assert len(first) == 7
+    db.close()
+
+
+def test_usernames_unique_across_shards(databases):
+    main, shards = databases
+    db = session_factory(main, shards[:3])()
+    save_user(create_user(1), db)
+
+    with pytest.raises(IntegrityError):
+        save_user(
+            CreateUser(id="id2", name="name2", username="USER1", email="a@email.com"),
+            db,
+        )
+    db.rollback()
+    assert user_ids(shards[0]) | user_ids(shards[1]) | user_ids(shards[2]) == {"id1"}
+    db.close()
+
+
+def test_other_tables_stay_in_main(databases):
+    main, shards = databases
+    db = session_factory(main, shards[:3])()
+
+    add_revocation("hash", "token", "User1", datetime.datetime(2030, 1, 1), db)
+
+    assert db.query(RevocationOutbox).count() == 1
+    assert not any(
+        "revocation_outbox" in statement
+        for shard in shards
+        for statement in shard.statements
+    )
+    db.close()
+
+
+def test_reshard_from_main_then_to_more_shards(databases):
+    main, shards = databases
+    with main.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {
+                    "id": f"id{i}",
+                    "name": f"name{i}",
+                    "username": f"User{i}",
+                    "email": f"user{i}@email.com",
+                }
+                for i in range(40)
+            ],
+        )
+    sources = make_shards(main, shards[:3])
+    three_shards = {key: engine for key, engine in sources.items() if key != MAIN_SHARD}
+
+    assert reshard(main, sources, three_shards, batch_size=7, pause=0) == 40
+
+    assert user_ids(main) == set()
+    before = directory(main)
+    assert set(before.values()) == {"0", "1", "2"}
+    db = session_factory(main, shards[:3])()
+    assert get_user_by_username("User13", db).id == "id13"
+    db.close()
+
+    four_shards = make_shards(main, shards)
+    four_shards.pop(MAIN_SHARD)
+    moved = reshard(main, dict(four_shards), four_shards, batch_size=7, pause=0)
+
+    after = directory(main)
+    changed = [user_id for user_id in after if after[user_id] != before[user_id]]
+    assert moved == len(changed) > 0
+    assert {after[user_id] for user_id in changed} == {"3"}
+    assert user_ids(shards[3]) == set(changed)
+    db = session_factory(main, shards)()
+    assert len(list_users(db=db)) == 40
+    for user_id in changed:
+        assert db.get(User, user_id).id == user_id
+    db.close()
+
+    # Running it again has nothing left to move
+    assert reshard(main, dict(four_shards), four_shards, pause=0) == 0
@@ -0,0 +1,164 @@
+import io
+import json
+import logging
+import queue
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse
+
+from observability.log import (
+    DroppingQueueHandler,
+    JSONFormatter,
+    RequestIdFilter,
+    RequestIdMiddleware,
+    log_success,
+    request_id,
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.addFilter(RequestIdFilter())
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def records():
+    handler = ListHandler()
+    logger = logging.getLogger("tests.observability")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    access = logging.getLogger("access")
+    access.addHandler(handler)
+    access.setLevel(logging.INFO)
+    yield handler.records
+    logger.removeHandler(handler)
+    access.removeHandler(handler)
+
+
+def test_json_formatter_includes_request_id_and_extra_fields():
+    record = logging.makeLogRecord(
+        {"name": "auth", "levelno": logging.INFO, "levelname": "INFO"}
+    )
+    record.msg = "Token rejected"
+    record.reason = "Token expired"
+    token = request_id.set("abc-123")
+    RequestIdFilter().filter(record)
+    request_id.reset(token)
+
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry["message"] == "Token rejected"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "auth"
+    assert entry["reason"] == "Token expired"
+    assert entry["request_id"] == "abc-123"
+    assert entry["time"].endswith("Z")
+
+
+def test_log_success_is_sampled(records):
+    logger = logging.getLogger("tests.observability")
+
+    for _ in range(100):
+        log_success(logger, "Dropped", sample_rate=0)
+    log_success(logger, "Kept", sample_rate=1, username="user")
+
+    assert [record.getMessage() for record in records] == ["Kept"]
+    assert records[0].username == "user"
+    assert records[0].sample_rate == 1
+
+
+def test_full_queue_drops_records_without_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("tests.observability.queue")
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    for i in range(5):
+        logger.error("Record %s", i)
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+    logger.removeHandler(handler)
+
+
+def test_queued_records_keep_their_exception():
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JSONFormatter())
+    handler = DroppingQueueHandler(queue.Queue())
+    logger = logging.getLogger("tests.observability.exception")
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    try:
+        raise ValueError("Invalid token")
+    except ValueError:
+        logger.exception("Verification failed for %s", "username1")
+    output.handle(handler.queue.get_nowait())
+
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "Verification failed for username1"
+    assert entry["exception"].startswith("Traceback")
+    assert "ValueError: Invalid token" in entry["exception"]
+    logger.removeHandler(handler)
+
+
+def request_id_app():
+    app = FastAPI()
+
+    @app.get("/ok")
+    def ok():
+        logging.getLogger("tests.observability").warning("Handling")
+        return {"request_id": request_id.get()}
+
+    @app.get("/missing")
+    def missing():
+        return JSONResponse({"detail": "Not found"}, status_code=404)
+
+    app.add_middleware(RequestIdMiddleware)
+    return app
+
+
+def test_request_id_echoed_and_set_in_records(records):
+    client = TestClient(request_id_app())
+
+    response = client.get("/ok", headers={"X-Request-ID": "gateway-42"})
+
+    assert response.headers["X-Request-ID"] == "gateway-42"
+    assert response.json() == {"request_id": "gateway-42"}
+    assert records[0].getMessage() == "Handling"
+    assert records[0].request_id == "gateway-42"
+    assert request_id.get() is None
+
+
+@pytest.mark.parametrize("header", [None, "bad id", "x" * 129])
+def test_request_id_generated_when_missing_or_invalid(header):
+    client = TestClient(request_id_app())
+    headers = {"X-Request-ID": header} if header else {}
+
+    response = client.get("/ok", headers=headers)
+
+    generated = response.headers["X-Request-ID"]
+    assert generated != header
+    assert len(generated) == 32
+    assert response.json() == {"request_id": generated}
+
+
+def test_rejected_requests_always_logged(records):
+    client = TestClient(request_id_app())
+
+    response = client.get("/missing", headers={"X-Request-ID": "req-1"})
+
+    assert response.status_code == 404
+    access = [record for record in records if record.name == "access"]
+    assert access[0].getMessage() == "Request rejected"
+    assert access[0].status_code == 404
+    assert access[0].path == "/missing"
+    assert access[0].request_id == "req-1"
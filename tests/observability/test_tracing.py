@@ -0,0 +1,182 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import StatusCode
+from opentelemetry.trace.propagation.tracecontext import (
+    TraceContextTextMapPropagator,
+)
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from auth.JWTBearer import JWTBearer
+from auth.upstream import UpstreamPolicy
+from observability.tracing import (
+    TracingMiddleware,
+    head_sampler,
+    instrument_engine,
+    make_exporter,
+    setup_tracing,
+    tracer,
+)
+from tests.services.jwt_factory import JWTFactory, authenticate
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+@pytest.fixture(scope="module")
+def exporter():
+    exporter = InMemorySpanExporter()
+    setup_tracing(exporter, sample_rate=1.0)
+    return exporter
+
+
+@pytest.fixture
+def spans(exporter):
+    exporter.clear()
+    yield exporter.get_finished_spans
+    exporter.clear()
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    return engine
+
+
+def traced_app(engine):
+    app = FastAPI()
+    upstream = UpstreamPolicy("stub", is_failure=lambda e: True)
+
+    def lookup(name):
+        return name
+
+    @app.get("/users/{name}")
+    def get_user(name: str):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return {"name": upstream.call(lookup, name)}
+
+    app.add_middleware(TracingMiddleware)
+    return app
+
+
+def ancestors(span, spans):
+    by_id = {other.context.span_id: other for other in spans}
+    found = []
+    while span.parent is not None:
+        found.append(span.parent.span_id)
+        span = by_id.get(span.parent.span_id)
+        if span is None:
+            break
+    return found
+
+
+def test_head_sampler():
+    def is_recorded(sample_rate, traceparent=None):
+        provider = TracerProvider(sampler=head_sampler(sample_rate))
+        context = None
+        if traceparent:
+            context = TraceContextTextMapPropagator().extract(
+                {"traceparent": traceparent}
+            )
+        span = provider.get_tracer("test").start_span("span", context=context)
+        span.end()
+        return span.get_span_context().trace_flags.sampled
+
+    assert not is_recorded(0.0)
+    assert is_recorded(1.0)
+    # The decision of the caller is kept
+    assert is_recorded(0.0, f"00-{TRACE_ID}-{PARENT_ID}-01")
+    assert not is_recorded(1.0, f"00-{TRACE_ID}-{PARENT_ID}-00")
+
+
+def test_request_continues_incoming_trace(spans, engine):
+    client = TestClient(traced_app(engine))
+
+    response = client.get(
+        "/users/user1", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"}
+    )
+
+    assert response.status_code == 200
+    by_name = {
+        span.name: span
+        for span in spans()
+        if span.instrumentation_scope.name == "clubsync.users"
+    }
+    server = by_name["GET /users/{name}"]
+    assert format(server.context.trace_id, "032x") == TRACE_ID
+    assert format(server.parent.span_id, "016x") == PARENT_ID
+    assert server.attributes["http.response.status_code"] == 200
+    assert server.context.span_id in ancestors(by_name["SELECT"], spans())
+    assert by_name["SELECT"].attributes["db.statement"] == "SELECT 1"
+    assert server.context.span_id in ancestors(by_name["stub lookup"], spans())
+    assert by_name["stub lookup"].attributes["attempt"] == 1
+
+
+def test_unsampled_trace_records_nothing(spans, engine):
+    client = TestClient(traced_app(engine))
+
+    response = client.get(
+        "/users/user1", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"}
+    )
+
+    assert response.status_code == 200
+    assert spans() == ()
+
+
+def test_statements_outside_a_trace_are_not_traced(spans, engine):
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+    assert spans() == ()
+
+
+def test_failed_statement_span(spans, engine):
+    with tracer.start_as_current_span("parent"):
+        with engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+
+    statement = next(span for span in spans() if span.name == "SELECT")
+    assert statement.status.status_code == StatusCode.ERROR
+    assert statement.events[0].name == "exception"
+
+
+@patch("auth.JWTBearer.REVOCATION_CHECK", "always")
+@patch("auth.JWTBearer.user_info_with_token")
+def test_jwt_bearer_stages(mock_user_info_with_token, spans):
+    factory = JWTFactory()
+    bearer = JWTBearer(factory.jwks)
+
+    with tracer.start_as_current_span("request") as request:
+        authenticate(bearer, factory.token())
+
+    by_name = {span.name: span for span in spans()}
+    for stage in ("JWTBearer.verify_token", "JWTBearer.check_revocation"):
+        assert by_name[stage].parent.span_id == request.get_span_context().span_id
+    assert by_name["JWTBearer.verify_token"].attributes["jwt.kid"] == "test_kid"
+
+
+def test_file_exporter(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    provider = TracerProvider(sampler=head_sampler(1.0))
+    provider.add_span_processor(SimpleSpanProcessor(make_exporter("file", path)))
+
+    with provider.get_tracer("test").start_as_current_span("outer"):
+        with provider.get_tracer("test").start_as_current_span("inner"):
+            pass
+    provider.shutdown()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["name"] for line in lines] == ["inner", "outer"]
+    assert lines[0]["parent_id"] == lines[1]["context"]["span_id"]
@@ -1,14 +1,23 @@
+import datetime
 import pytest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import logging
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from testcontainers.mysql import MySqlContainer
 from fastapi import HTTPException
+from cache.cache import InMemoryCache
 from db.database import get_db
 from main import app
 from models.user import User, save_user
-from repositories.userRepo import get_user_by_username, get_user, new_user
+from repositories.userRepo import (
+    get_user_by_username,
+    get_user,
+    new_user,
+    forget_missing_user,
+    user_exists,
+    UserRow,
+)
 from schemas.user import CreateUser
 
 logging.basicConfig(level=logging.INFO)
@@ -56,6 +65,11 @@ def create_test_db(session):
     db.close()
 
 
+@pytest.fixture
+def cache():
+    return InMemoryCache()
+
+
 @pytest.fixture(name="test_user", scope="function")
 def create_test_user(test_db):
     test_user = User(
@@ -63,6 +77,8 @@ def create_test_user(test_db):
         name="given_name1",
         username="username1",
         email="email1",
+        username_key="username1",
+        email_key="email1",
     )
     test_db.add(test_user)
     test_db.commit()
@@ -77,6 +93,7 @@ def test_get_user_by_username_found(test_db, test_user):
     found_user = get_user_by_username(test_user.username, test_db)
     assert found_user is not None
     assert found_user.id == "id1"
+    assert isinstance(found_user, UserRow)
 
 
 def test_get_user_by_username_not_found(test_db):
@@ -84,33 +101,39 @@ def test_get_user_by_username_not_found(test_db):
     assert found_user is None
 
 
+def test_user_exists_ignores_case(test_db, test_user):
+    assert user_exists(" UserName1 ", "other", test_db)
+    assert user_exists("other", "EMAIL1", test_db)
+    assert not user_exists("other", "other", test_db)
+
+
 @patch("repositories.userRepo.get_user_by_username", wraps=get_user_by_username)
-def test_get_user_found(get_user_by_username_function, test_db, test_user):
-    found_user = get_user(test_user.username, test_db)
+def test_get_user_found(get_user_by_username_function, test_db, test_user, cache):
+    found_user = get_user(test_user.username, test_db, cache)
     get_user_by_username_function.assert_called_once_with(test_user.username, test_db)
     assert found_user is not None
     assert found_user.id == "id1"
 
 
 @patch("repositories.userRepo.get_user_by_username", wraps=get_user_by_username)
-def test_get_user_not_found(get_user_by_username_function, test_db):
+def test_get_user_not_found(get_user_by_username_function, test_db, cache):
     found_user = None
     with pytest.raises(HTTPException) as exception:
-        found_user = get_user("not_exist", test_db)
+        found_user = get_user("not_exist", test_db, cache)
     get_user_by_username_function.assert_called_once_with("not_exist", test_db)
     assert found_user is None
     assert exception.value.status_code == 404
 
 
 @patch("repositories.userRepo.save_user", wraps=save_user)
-def test_create_user(save_user_function, test_db):
+def test_create_user(save_user_function, test_db, cache):
     user_data = CreateUser(
         id="id2",
         name="given_name2",
         username="username2",
         email="email2",
     )
-    user = new_user(user_data, test_db)
+    user = new_user(user_data, test_db, cache)
     assert user is not None
     assert user == test_db.query(User).filter(User.username == "username2").first()
     assert (
@@ -120,3 +143,30 @@ def test_create_user(save_user_function, test_db):
         and user.email == "email2"
     )
     save_user_function.assert_called_once_with(new_user=user_data, db=test_db)
+
+
+def test_flood_of_unknown_usernames_queries_db_once(cache):
+    db = MagicMock(spec=Session)
+    db.execute.return_value.first.return_value = None
+
+    for _ in range(1000):
+        with pytest.raises(HTTPException) as exception:
+            get_user("flood_user", db, cache)
+        assert exception.value.status_code == 404
+
+    assert db.execute.call_count == 1
+
+
+def test_forget_missing_user_queries_db_again(cache):
+    db = MagicMock(spec=Session)
+    db.execute.return_value.first.return_value = None
+
+    with pytest.raises(HTTPException):
+        get_user("late_user", db, cache)
+
+    row = ("id1", "given_name1", "late_user", "email1", datetime.datetime(2024, 1, 1))
+    db.execute.return_value.first.return_value = row
+    forget_missing_user("late_user", cache)
+
+    assert get_user("late_user", db, cache) == UserRow(*row)
+    assert db.execute.call_count == 2
@@ -1,14 +1,30 @@
+import asyncio
+import datetime
 import os
 import pytest
+from email.utils import formatdate
 from dotenv import load_dotenv
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from auth.JWTBearer import JWTAuthorizationCredentials
+from auth.auth import get_current_user
+from auth.api_key import introspect_auth
+from auth.rate_limit import (
+    InMemoryRateLimitStore,
+    RateLimiter,
+    api_key_key,
+    sign_in_rate_limit,
+)
+from auth.upstream import UpstreamUnavailable
+from cache.cache import InMemoryCache, get_cache
 from db.database import get_db
 from main import app
+from repositories.userRepo import UserRow, user_version
 from schemas.user import CreateUser
-from routers.auth import auth
+from routers.auth import REFRESH_COOKIE_NAME, REFRESH_COOKIE_PATH, auth
 
 load_dotenv()
 REDIRECT_URI = os.environ.get("REDIRECT_URI")
@@ -63,7 +79,7 @@ def test_unsuccessful_login_with_invalid_credentials(
 def test_successful_login_with_valid_credentials_found_username(
     mock_auth_with_code, mock_user_info_with_token, mock_save_user, mock_db
 ):
-    mock_db.query.return_value.filter.return_value.first.side_effect = [True, False]
+    mock_db.query.return_value.filter.return_value.first.return_value = ("id1",)
 
     response = client.post("/auth/sign-in?code=valid_code")
 
@@ -84,7 +100,7 @@ def test_successful_login_with_valid_credentials_found_username(
 def test_successful_login_with_valid_credentials_found_email(
     mock_auth_with_code, mock_user_info_with_token, mock_save_user, mock_db
 ):
-    mock_db.query.return_value.filter.return_value.first.side_effect = [False, True]
+    mock_db.query.return_value.filter.return_value.first.return_value = ("id1",)
 
     response = client.post("/auth/sign-in?code=valid_code")
 
@@ -92,7 +108,7 @@ def test_successful_login_with_valid_credentials_found_email(
     assert response.json() == {"token": "valid_token", "expires_in": 100}
     mock_auth_with_code.assert_called_once_with("valid_code", REDIRECT_URI)
     mock_user_info_with_token.assert_called_once_with("valid_token")
-    assert mock_db.query.call_count == 2
+    assert mock_db.query.call_count == 1
     assert mock_save_user.call_count == 0
 
 
@@ -105,7 +121,7 @@ def test_successful_login_with_valid_credentials_found_email(
 def test_successful_login_with_valid_credentials_new_user(
     mock_auth_with_code, mock_user_info_with_token, mock_save_user, mock_db
 ):
-    mock_db.query.return_value.filter.return_value.first.side_effect = [False, False]
+    mock_db.query.return_value.filter.return_value.first.return_value = None
 
     response = client.post("/auth/sign-in?code=valid_code")
 
@@ -113,7 +129,7 @@ def test_successful_login_with_valid_credentials_new_user(
     assert response.json() == {"token": "valid_token", "expires_in": 100}
     mock_auth_with_code.assert_called_once_with("valid_code", REDIRECT_URI)
     mock_user_info_with_token.assert_called_once_with("valid_token")
-    assert mock_db.query.call_count == 2
+    assert mock_db.query.call_count == 1
     mock_save_user.assert_called_once_with(
         CreateUser(
             id=user_attributes["UserAttributes"][3]["Value"],
@@ -125,12 +141,179 @@ def test_successful_login_with_valid_credentials_new_user(
     )
 
 
-@patch("routers.auth.logout_with_token", return_value=True)
-def test_successful_logout(mock_logout_with_token):
+def off_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return True
+    return False
+
+
+@patch("routers.auth.forget_missing_user")
+@patch("routers.auth.save_user")
+@patch("routers.auth.user_exists")
+@patch("routers.auth.user_info_with_token", return_value=user_attributes)
+@patch(
+    "routers.auth.auth_with_code",
+    return_value={"token": "valid_token", "expires_in": 100},
+)
+def test_login_provisions_user_off_the_event_loop(
+    mock_auth_with_code,
+    mock_user_info_with_token,
+    mock_user_exists,
+    mock_save_user,
+    mock_forget_missing_user,
+    mock_db,
+):
+    calls = []
+    mock_user_exists.side_effect = lambda *args: calls.append(off_event_loop())
+    mock_save_user.side_effect = lambda *args: calls.append(off_event_loop())
+    mock_forget_missing_user.side_effect = lambda *args: calls.append(off_event_loop())
+
+    response = client.post("/auth/sign-in?code=valid_code")
+
+    assert response.status_code == 200
+    assert calls == [True, True, True]
+
+
+@patch("routers.auth.save_user")
+@patch("routers.auth.user_info_with_token", return_value=user_attributes)
+@patch(
+    "routers.auth.auth_with_code",
+    return_value={
+        "token": "valid_token",
+        "expires_in": 100,
+        "refresh_token": "refresh_token",
+    },
+)
+def test_successful_login_sets_refresh_cookie(
+    mock_auth_with_code, mock_user_info_with_token, mock_save_user, mock_db
+):
+    mock_db.query.return_value.filter.return_value.first.return_value = ("id1",)
+
+    response = client.post("/auth/sign-in?code=valid_code")
+
+    assert response.status_code == 200
+    assert response.json() == {"token": "valid_token", "expires_in": 100}
+    cookie = response.headers["set-cookie"]
+    assert cookie.startswith(f"{REFRESH_COOKIE_NAME}=refresh_token;")
+    assert "HttpOnly" in cookie
+    assert "Secure" in cookie
+    assert "SameSite=strict" in cookie
+    assert f"Path={REFRESH_COOKIE_PATH}" in cookie
+
+
+@patch("routers.auth.forget_missing_user")
+@patch("routers.auth.save_user", side_effect=IntegrityError("INSERT", {}, None))
+@patch("routers.auth.user_info_with_token", return_value=user_attributes)
+@patch(
+    "routers.auth.auth_with_code",
+    return_value={"token": "valid_token", "expires_in": 100},
+)
+def test_successful_login_user_created_concurrently(
+    mock_auth_with_code,
+    mock_user_info_with_token,
+    mock_save_user,
+    mock_forget_missing_user,
+    mock_db,
+):
+    mock_db.query.return_value.filter.return_value.first.return_value = None
+
+    response = client.post("/auth/sign-in?code=valid_code")
+
+    assert response.status_code == 200
+    assert response.json() == {"token": "valid_token", "expires_in": 100}
+    mock_db.rollback.assert_called_once()
+    assert mock_forget_missing_user.call_count == 0
+
+
+@patch("routers.auth.auth_with_code")
+def test_login_rate_limited(mock_auth_with_code, mock_db):
+    store = MagicMock()
+    store.take.return_value = 2.5
+
+    with patch.object(sign_in_rate_limit, "store", store):
+        response = client.post("/auth/sign-in?code=valid_code")
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+    assert mock_auth_with_code.call_count == 0
+
+
+@patch(
+    "routers.auth.refresh_with_token",
+    return_value={"token": "new_token", "expires_in": 100, "refresh_token": None},
+)
+def test_refresh_has_its_own_rate_limit(mock_refresh_with_token, mock_db):
+    store = MagicMock()
+    store.take.return_value = 2.5
+
+    # The sign-in budget is used up
+    with patch.object(sign_in_rate_limit, "store", store):
+        response = client.post(
+            "/auth/refresh", headers={"Cookie": f"{REFRESH_COOKIE_NAME}=refresh_token"}
+        )
+
+    assert response.status_code == 200
+    assert store.take.call_count == 0
+
+
+@patch(
+    "routers.auth.auth_with_code",
+    side_effect=UpstreamUnavailable("Too many concurrent requests to Cognito"),
+)
+def test_login_shed_when_cognito_overloaded(mock_auth_with_code, mock_db):
+    response = client.post("/auth/sign-in?code=valid_code")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert mock_db.query.call_count == 0
+
+
+@patch("routers.auth.user_info_with_token")
+@patch(
+    "routers.auth.refresh_with_token",
+    return_value={"token": "new_token", "expires_in": 100, "refresh_token": None},
+)
+def test_successful_refresh(mock_refresh_with_token, mock_user_info_with_token, mock_db):
+    response = client.post(
+        "/auth/refresh", headers={"Cookie": f"{REFRESH_COOKIE_NAME}=refresh_token"}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"token": "new_token", "expires_in": 100}
+    assert "set-cookie" not in response.headers
+    mock_refresh_with_token.assert_called_once_with("refresh_token")
+    # The user is not provisioned again
+    assert mock_user_info_with_token.call_count == 0
+    assert mock_db.query.call_count == 0
+
+
+@patch("routers.auth.refresh_with_token")
+def test_refresh_without_cookie(mock_refresh_with_token, mock_db):
+    response = client.post("/auth/refresh")
+
+    assert response.status_code == 401
+    assert mock_refresh_with_token.call_count == 0
+
+
+@patch("routers.auth.refresh_with_token", return_value=None)
+def test_refresh_with_invalid_token_clears_cookie(mock_refresh_with_token, mock_db):
+    response = client.post(
+        "/auth/refresh", headers={"Cookie": f"{REFRESH_COOKIE_NAME}=revoked"}
+    )
+
+    assert response.status_code == 401
+    assert response.headers["set-cookie"].startswith(f'{REFRESH_COOKIE_NAME}="";')
+
+
+@patch("auth.user_auth.cognito_client.global_sign_out")
+@patch("routers.auth.revoke_token")
+def test_successful_logout(mock_revoke_token, mock_global_sign_out, mock_db):
     app.dependency_overrides[auth] = lambda: JWTAuthorizationCredentials(
         jwt_token="token",
         header={"kid": "some_kid"},
-        claims={"sub": "user_id"},
+        claims={"sub": "user_id", "username": "username1", "exp": "1700000000"},
         signature="signature",
         message="message",
     )
@@ -140,28 +323,191 @@ def test_successful_logout(mock_logout_with_token):
 
     assert response.status_code == 200
     assert response.json() == "Logout successful"
+    assert response.headers["set-cookie"].startswith(f'{REFRESH_COOKIE_NAME}="";')
 
-    mock_logout_with_token.assert_called_once_with("token")
+    mock_revoke_token.assert_called_once_with(
+        "token", "username1", 1700000000.0, mock_db
+    )
+    # Cognito is called later by the revocation outbox worker
+    assert mock_global_sign_out.call_count == 0
 
-    app.dependency_overrides = {}
+    del app.dependency_overrides[auth]
 
 
-@patch("routers.auth.logout_with_token", return_value=False)
-def test_unsuccessful_logout(mock_logout_with_token):
-    app.dependency_overrides[auth] = lambda: JWTAuthorizationCredentials(
-        jwt_token="token",
+@pytest.fixture
+def introspect_key():
+    with patch.object(introspect_auth, "keys", ["service_key"]):
+        yield {"X-API-Key": "service_key"}
+
+
+def test_introspect_tokens(introspect_key):
+    credentials = JWTAuthorizationCredentials(
+        jwt_token="valid_token",
         header={"kid": "some_kid"},
-        claims={"sub": "user_id"},
+        claims={"sub": "user_id", "username": "username1"},
         signature="signature",
         message="message",
     )
+    verified = [credentials, HTTPException(status_code=403, detail="Token expired")]
 
-    headers = {"Authorization": "Bearer token"}
-    response = client.get("/auth/logout", headers=headers)
+    with patch.object(auth, "verify_tokens", return_value=verified) as mock_verify:
+        response = client.post(
+            "/auth/introspect",
+            json={"tokens": ["valid_token", "expired_token"]},
+            headers=introspect_key,
+        )
 
-    assert response.status_code == 401
-    assert response.json() == {"detail": "Error loging out..."}
+    assert response.status_code == 200
+    assert response.json() == {
+        "results": [
+            {"active": True, "claims": {"sub": "user_id", "username": "username1"}},
+            {"active": False, "error": "Token expired"},
+        ]
+    }
+    mock_verify.assert_called_once_with(["valid_token", "expired_token"])
+
+
+def test_introspect_requires_tokens(introspect_key):
+    response = client.post(
+        "/auth/introspect", json={"tokens": []}, headers=introspect_key
+    )
 
-    mock_logout_with_token.assert_called_once_with("token")
+    assert response.status_code == 422
 
-    app.dependency_overrides = {}
+
+@pytest.mark.parametrize("headers", [{}, {"X-API-Key": "wrong_key"}])
+def test_introspect_requires_api_key(introspect_key, headers):
+    with patch.object(auth, "verify_tokens") as mock_verify:
+        response = client.post(
+            "/auth/introspect", json={"tokens": ["valid_token"]}, headers=headers
+        )
+
+    assert response.status_code == 403
+    assert mock_verify.call_count == 0
+
+
+def test_introspect_rate_limited_per_token(introspect_key):
+    limiter = RateLimiter(
+        "introspect",
+        capacity=10,
+        rate=0.01,
+        key_func=api_key_key,
+        store=InMemoryRateLimitStore(),
+    )
+
+    def introspect(tokens):
+        return client.post(
+            "/auth/introspect", json={"tokens": tokens}, headers=introspect_key
+        ).status_code
+
+    with patch("routers.auth.introspect_rate_limit", limiter), patch.object(
+        auth, "verify_tokens", return_value=[]
+    ) as mock_verify:
+        assert introspect([f"token{i}" for i in range(8)]) == 200
+        # Repeated tokens are verified once, so they are charged once
+        assert introspect(["token8"] * 2) == 200
+        assert introspect(["token9", "token10"]) == 429
+
+    assert mock_verify.call_count == 2
+
+
+@pytest.fixture
+def cache():
+    cache = InMemoryCache()
+    app.dependency_overrides[get_cache] = lambda: cache
+    yield cache
+    del app.dependency_overrides[get_cache]
+
+
+@pytest.fixture
+def current_user_row(cache):
+    user = UserRow(
+        id="id1",
+        name="given_name1",
+        username="username1",
+        email="email@email.com",
+        updated_at=datetime.datetime(2024, 5, 1, 12, 30, 15),
+    )
+    app.dependency_overrides[auth] = lambda: None
+    app.dependency_overrides[get_current_user] = lambda: user.username
+    yield user
+    del app.dependency_overrides[auth]
+    del app.dependency_overrides[get_current_user]
+
+
+@patch("repositories.userRepo.get_user_by_username")
+def test_current_user_sends_validators(mock_get_user_by_username, current_user_row):
+    mock_get_user_by_username.return_value = current_user_row
+
+    response = client.get("/auth/me")
+
+    assert response.status_code == 200
+    assert response.json()["username"] == "username1"
+    assert response.headers["ETag"] == user_version(current_user_row)[0]
+    assert response.headers["Last-Modified"] == formatdate(
+        current_user_row.updated_at.timestamp(), usegmt=True
+    )
+
+
+@patch("repositories.userRepo.get_user_by_username")
+def test_current_user_not_modified_from_version_index(
+    mock_get_user_by_username, current_user_row, cache
+):
+    mock_get_user_by_username.return_value = current_user_row
+    etag = client.get("/auth/me").headers["ETag"]
+    # The version index is kept in the cache given by the dependency
+    assert len(cache) == 1
+
+    response = client.get("/auth/me", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    assert mock_get_user_by_username.call_count == 1
+
+
+@patch("repositories.userRepo.get_user_by_username")
+def test_current_user_conditional_headers(
+    mock_get_user_by_username, current_user_row, cache
+):
+    mock_get_user_by_username.return_value = current_user_row
+    last_modified = client.get("/auth/me").headers["Last-Modified"]
+
+    def status(headers):
+        return client.get("/auth/me", headers=headers).status_code
+
+    assert status({"If-Modified-Since": last_modified}) == 304
+    assert status({"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}) == 200
+    assert status({"If-Modified-Since": "not a date"}) == 200
+    assert status({"If-None-Match": '"stale"'}) == 200
+    # If-None-Match takes precedence over If-Modified-Since
+    assert (
+        status({"If-None-Match": '"stale"', "If-Modified-Since": last_modified}) == 200
+    )
+    # Without the version index the user is loaded and still not modified
+    cache.clear()
+    assert status({"If-Modified-Since": last_modified}) == 304
+    assert mock_get_user_by_username.call_count == 6
+
+
+@patch("routers.auth.get_user_version")
+@patch("repositories.userRepo.get_user_by_username")
+def test_current_user_is_loaded_off_the_event_loop(
+    mock_get_user_by_username, mock_get_user_version, current_user_row
+):
+    calls = []
+
+    def get_user_by_username(*args):
+        calls.append(off_event_loop())
+        return current_user_row
+
+    def get_user_version(*args):
+        calls.append(off_event_loop())
+
+    mock_get_user_by_username.side_effect = get_user_by_username
+    mock_get_user_version.side_effect = get_user_version
+
+    response = client.get("/auth/me")
+
+    assert response.status_code == 200
+    assert calls == [True, True]
@@ -0,0 +1,37 @@
+import re
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from main import CORS_MAX_AGE, app, compile_origins
+
+client = TestClient(app)
+
+preflight_headers = {
+    "Origin": "https://app.clubsync.pt",
+    "Access-Control-Request-Method": "GET",
+    "Access-Control-Request-Headers": "authorization",
+}
+
+
+def test_compile_origins():
+    exact, regex = compile_origins(
+        "https://clubsync.pt/, https://*.clubsync.pt,,http://localhost:3000"
+    )
+
+    assert exact == {"https://clubsync.pt", "http://localhost:3000"}
+    assert re.fullmatch(regex, "https://app.clubsync.pt")
+    assert not re.fullmatch(regex, "https://a.b.clubsync.pt")
+    assert not re.fullmatch(regex, "https://app.clubsync.pt.evil.com")
+    assert compile_origins("https://clubsync.pt") == ({"https://clubsync.pt"}, None)
+
+
+@patch("main.SessionLocal")
+def test_preflight_answered_before_db_session(mock_session_local):
+    response = client.options("/auth/me", headers=preflight_headers)
+
+    assert response.status_code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == "https://app.clubsync.pt"
+    assert response.headers["Access-Control-Max-Age"] == str(CORS_MAX_AGE)
+    assert response.headers["Access-Control-Allow-Headers"] == "authorization"
+    assert mock_session_local.call_count == 0
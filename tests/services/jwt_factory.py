@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from starlette.requests import Request
+
+from auth.JWTBearer import JWKS, JWTBearer
+from cache.cache import get_cache
+
+
+class JWTFactory:
+    """Signs Cognito-like access tokens with a throwaway RSA key."""
+
+    def __init__(self, kid: str = "test_kid"):
+        self.kid = kid
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        # Constructed once, building it from PEM on every token is slow
+        self.signing_key = jwk.construct(
+            private_key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            ),
+            "RS256",
+        )
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        self.public_jwk = {
+            "kid": kid,
+            "use": "sig",
+            **jwk.construct(public_pem, "RS256").to_dict(),
+        }
+
+    @property
+    def jwks(self) -> JWKS:
+        return JWKS(keys=[self.public_jwk])
+
+    def token(self, kid: str = None, **claims) -> str:
+        now = int(time.time())
+        payload = {
+            "sub": "id1",
+            "username": "username1",
+            "token_use": "access",
+            "iat": now,
+            "auth_time": now,
+            "exp": now + 3600,
+        }
+        payload.update(claims)
+        return jwt.encode(
+            payload,
+            self.signing_key,
+            algorithm="RS256",
+            headers={"kid": kid or self.kid},
+        )
+
+
+def bearer_request(token: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+    )
+
+
+def authenticate(bearer: JWTBearer, token: str):
+    return asyncio.run(bearer(bearer_request(token), get_cache()))
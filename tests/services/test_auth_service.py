@@ -4,7 +4,14 @@ import pytest
 import logging
 from unittest.mock import patch
 
-from auth.user_auth import auth_with_code, user_info_with_token, logout_with_token
+from auth.user_auth import (
+    COGNITO_CONNECT_TIMEOUT,
+    COGNITO_READ_TIMEOUT,
+    auth_with_code,
+    refresh_with_token,
+    user_info_with_token,
+    logout_with_token,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,7 +44,7 @@ def setup_environ():
 
 
 # 400 it's just a random error status code to test the error handling
-@patch("auth.user_auth.requests.post", return_value=RequestsMockResponse({}, 400))
+@patch("auth.user_auth.token_session.post", return_value=RequestsMockResponse({}, 400))
 def test_unsuccessful_auth_with_code(requests_post_mock):
     payload = {
         "grant_type": "authorization_code",
@@ -49,15 +56,23 @@ def test_unsuccessful_auth_with_code(requests_post_mock):
     result = auth_with_code("code", "redirect_uri")
 
     requests_post_mock.assert_called_once_with(
-        cognito_token_endpoint, data=payload, headers=headers
+        cognito_token_endpoint,
+        data=payload,
+        headers=headers,
+        timeout=(COGNITO_CONNECT_TIMEOUT, COGNITO_READ_TIMEOUT),
     )
     assert result is None
 
 
 @patch(
-    "auth.user_auth.requests.post",
+    "auth.user_auth.token_session.post",
     return_value=RequestsMockResponse(
-        {"access_token": "client_access_token", "expires_in": 200}, 200
+        {
+            "access_token": "client_access_token",
+            "expires_in": 200,
+            "refresh_token": "client_refresh_token",
+        },
+        200,
     ),
 )
 def test_successful_auth_with_code(requests_post_mock):
@@ -71,9 +86,50 @@ def test_successful_auth_with_code(requests_post_mock):
     result = auth_with_code("code", "redirect_uri")
 
     requests_post_mock.assert_called_once_with(
-        cognito_token_endpoint, data=payload, headers=headers
+        cognito_token_endpoint,
+        data=payload,
+        headers=headers,
+        timeout=(COGNITO_CONNECT_TIMEOUT, COGNITO_READ_TIMEOUT),
+    )
+    assert result == {
+        "token": "client_access_token",
+        "expires_in": 200,
+        "refresh_token": "client_refresh_token",
+    }
+
+
+@patch(
+    "auth.user_auth.token_session.post",
+    return_value=RequestsMockResponse(
+        {"access_token": "client_access_token", "expires_in": 200}, 200
+    ),
+)
+def test_successful_refresh_with_token(requests_post_mock):
+    payload = {
+        "grant_type": "refresh_token",
+        "refresh_token": "client_refresh_token",
+        "client_id": cognito_user_client_id,
+    }
+
+    result = refresh_with_token("client_refresh_token")
+
+    requests_post_mock.assert_called_once_with(
+        cognito_token_endpoint,
+        data=payload,
+        headers=headers,
+        timeout=(COGNITO_CONNECT_TIMEOUT, COGNITO_READ_TIMEOUT),
     )
-    assert result == {"token": "client_access_token", "expires_in": 200}
+    assert result == {
+        "token": "client_access_token",
+        "expires_in": 200,
+        "refresh_token": None,
+    }
+
+
+# Cognito answers 400 invalid_grant to expired or revoked refresh tokens
+@patch("auth.user_auth.token_session.post", return_value=RequestsMockResponse({}, 400))
+def test_unsuccessful_refresh_with_token(requests_post_mock):
+    assert refresh_with_token("revoked_refresh_token") is None
 
 
 @patch(
@@ -0,0 +1,263 @@
+import base64
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from fastapi import HTTPException
+from jose import jwk
+
+from auth.JWTBearer import JWTBearer
+from auth.upstream import UpstreamUnavailable
+from tests.services.jwt_factory import JWTFactory, authenticate
+
+factory = JWTFactory()
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+def test_valid_token(mock_user_info_with_token):
+    bearer = JWTBearer(factory.jwks)
+    token = factory.token()
+
+    credentials = authenticate(bearer, token)
+
+    assert credentials.claims["username"] == "username1"
+    mock_user_info_with_token.assert_called_once_with(token)
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+@patch("auth.JWTBearer.requests.get")
+def test_flood_of_unknown_kids_is_rejected_locally(
+    mock_requests_get, mock_user_info_with_token
+):
+    mock_requests_get.return_value.json.return_value = {"keys": [factory.public_jwk]}
+    bearer = JWTBearer(factory.jwks, jwks_url="http://jwks")
+    # Allow the first unknown kid to trigger a refresh
+    bearer.jwks_refreshed_at = 0
+    token = factory.token(kid="unknown_kid")
+
+    for _ in range(100):
+        with pytest.raises(HTTPException) as exception:
+            authenticate(bearer, token)
+        assert exception.value.status_code == 403
+        assert exception.value.detail == "JWK public key not found"
+
+    mock_requests_get.assert_called_once_with("http://jwks", timeout=5)
+    assert mock_user_info_with_token.call_count == 0
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+@patch("auth.JWTBearer.requests.get")
+def test_rotated_kid_is_picked_up_on_refresh(
+    mock_requests_get, mock_user_info_with_token
+):
+    rotated = JWTFactory(kid="rotated_kid")
+    mock_requests_get.return_value.json.return_value = {"keys": [rotated.public_jwk]}
+    bearer = JWTBearer(factory.jwks, jwks_url="http://jwks")
+    bearer.jwks_refreshed_at = 0
+
+    credentials = authenticate(bearer, rotated.token())
+
+    assert credentials.header["kid"] == "rotated_kid"
+    mock_requests_get.assert_called_once()
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+@patch("auth.JWTBearer.requests.get")
+def test_rotated_kid_is_not_remembered_as_unknown_before_a_refresh(
+    mock_requests_get, mock_user_info_with_token
+):
+    rotated = JWTFactory(kid="rotated_kid")
+    mock_requests_get.return_value.json.return_value = {"keys": [rotated.public_jwk]}
+    # Just started, so the JWKS may not be downloaded again yet
+    bearer = JWTBearer(factory.jwks, jwks_url="http://jwks")
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exception:
+            authenticate(bearer, rotated.token())
+        assert exception.value.detail == "JWK public key not found"
+    assert mock_requests_get.call_count == 0
+
+    # Once the refresh interval has passed, the rotated kid is picked up
+    bearer.jwks_refreshed_at = 0
+    credentials = authenticate(bearer, rotated.token())
+
+    assert credentials.header["kid"] == "rotated_kid"
+    mock_requests_get.assert_called_once()
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+@patch("auth.JWTBearer.requests.get")
+def test_jwks_refresh_does_not_block_the_event_loop(
+    mock_requests_get, mock_user_info_with_token
+):
+    rotated = JWTFactory(kid="rotated_kid")
+    threads = []
+
+    def download_jwks(*args, **kwargs):
+        threads.append(threading.current_thread())
+        response = MagicMock()
+        response.json.return_value = {"keys": [rotated.public_jwk]}
+        return response
+
+    mock_requests_get.side_effect = download_jwks
+    bearer = JWTBearer(factory.jwks, jwks_url="http://jwks")
+    bearer.jwks_refreshed_at = 0
+
+    authenticate(bearer, rotated.token())
+
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
+
+
+@patch(
+    "auth.JWTBearer.user_info_with_token",
+    side_effect=UpstreamUnavailable("Cognito is unavailable"),
+)
+def test_revocation_check_unavailable_denies_by_default(mock_user_info_with_token):
+    bearer = JWTBearer(factory.jwks)
+
+    with pytest.raises(UpstreamUnavailable):
+        authenticate(bearer, factory.token())
+
+
+@patch("auth.JWTBearer.REVOCATION_CHECK_FALLBACK", "allow")
+@patch(
+    "auth.JWTBearer.user_info_with_token",
+    side_effect=UpstreamUnavailable("Cognito is unavailable"),
+)
+def test_revocation_check_unavailable_can_fall_back_to_local_checks(
+    mock_user_info_with_token,
+):
+    bearer = JWTBearer(factory.jwks)
+
+    credentials = authenticate(bearer, factory.token())
+
+    assert credentials.claims["username"] == "username1"
+
+
+issuer = "https://cognito-idp.eu-west-3.amazonaws.com/pool_id"
+
+
+def strict_bearer() -> JWTBearer:
+    return JWTBearer(factory.jwks, issuer=issuer, client_ids=["client_id"], leeway=30)
+
+
+@pytest.mark.parametrize(
+    "claims, detail",
+    [
+        ({"exp": 1}, "Token expired"),
+        ({"exp": None}, "Invalid token timestamps"),
+        ({"iat": 2**40}, "Token issued in the future"),
+        ({"iss": "https://evil.example.com"}, "Invalid issuer"),
+        ({"client_id": "other_client"}, "Invalid audience"),
+        ({"token_use": "id"}, "Invalid token use"),
+    ],
+)
+@patch("auth.JWTBearer.user_info_with_token")
+def test_invalid_claims_are_rejected_locally(mock_user_info_with_token, claims, detail):
+    token = factory.token(**{"iss": issuer, "client_id": "client_id", **claims})
+
+    with pytest.raises(HTTPException) as exception:
+        authenticate(strict_bearer(), token)
+
+    assert exception.value.status_code == 403
+    assert exception.value.detail == detail
+    assert mock_user_info_with_token.call_count == 0
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+def test_expiry_tolerates_clock_skew(mock_user_info_with_token):
+    expired_recently = int(time.time()) - 10
+    token = factory.token(iss=issuer, client_id="client_id", exp=expired_recently)
+
+    assert authenticate(strict_bearer(), token) is not None
+
+
+@patch("auth.JWTBearer.REVOCATION_CHECK", "off")
+@patch("auth.JWTBearer.user_info_with_token")
+def test_revocation_check_off(mock_user_info_with_token):
+    authenticate(JWTBearer(factory.jwks), factory.token())
+
+    assert mock_user_info_with_token.call_count == 0
+
+
+@patch("auth.JWTBearer.REVOCATION_CHECK", "cached")
+@patch("auth.JWTBearer.user_info_with_token")
+def test_revocation_check_cached(mock_user_info_with_token):
+    bearer = JWTBearer(factory.jwks)
+    token = factory.token(username="cached_user")
+
+    for _ in range(5):
+        authenticate(bearer, token)
+
+    mock_user_info_with_token.assert_called_once_with(token)
+
+
+@patch("auth.JWTBearer.REVOCATION_CHECK", "sampled")
+@patch("auth.JWTBearer.random.random", side_effect=[0.05, 0.5, 0.9, 0.01])
+@patch("auth.JWTBearer.user_info_with_token")
+def test_revocation_check_sampled(mock_user_info_with_token, mock_random):
+    bearer = JWTBearer(factory.jwks)
+
+    for _ in range(4):
+        authenticate(bearer, factory.token())
+
+    assert mock_user_info_with_token.call_count == 2
+
+
+def test_verify_tokens_batch():
+    bearer = JWTBearer(factory.jwks)
+    valid = factory.token()
+    expired = factory.token(exp=1)
+    unknown_kid = factory.token(kid="unknown_kid")
+
+    with patch("auth.JWTBearer.jwk.construct", wraps=jwk.construct) as mock_construct:
+        results = bearer.verify_tokens(
+            [valid, expired, "malformed", unknown_kid, valid]
+        )
+
+    assert results[0].claims["username"] == "username1"
+    assert results[1].detail == "Token expired"
+    assert results[2].detail == "Invalid JWT structure"
+    assert results[3].detail == "JWK public key not found"
+    assert results[4] is results[0]
+    mock_construct.assert_called_once_with(factory.public_jwk)
+
+
+@pytest.mark.parametrize("header", ['"x"', "[1]", '{"kid": [1]}', "{}"])
+def test_verify_tokens_batch_rejects_invalid_headers(header):
+    bearer = JWTBearer(factory.jwks)
+    valid = factory.token()
+    encoded = base64.urlsafe_b64encode(header.encode()).decode().rstrip("=")
+    invalid = ".".join([encoded, *valid.split(".")[1:]])
+
+    results = bearer.verify_tokens([invalid, valid])
+
+    assert results[0].status_code == 403
+    assert results[1].claims["username"] == "username1"
+
+
+@pytest.mark.parametrize("signature", ["a", "!!!!", ""])
+def test_verify_tokens_batch_rejects_malformed_signatures(signature):
+    bearer = JWTBearer(factory.jwks)
+    valid = factory.token()
+    invalid = ".".join([*valid.split(".")[:2], signature])
+
+    results = bearer.verify_tokens([valid, invalid])
+
+    assert results[0].claims["username"] == "username1"
+    assert results[1].status_code == 403
+    assert results[1].detail == "JWK invalid"
+
+
+@patch("auth.JWTBearer.TOKEN_VERIFY_CHUNK_SIZE", 4)
+def test_verify_tokens_large_batch_uses_thread_pool():
+    bearer = JWTBearer(factory.jwks)
+    tokens = [factory.token(username=f"user{i}") for i in range(10)]
+
+    results = bearer.verify_tokens(tokens)
+
+    assert [result.claims["username"] for result in results] == [
+        f"user{i}" for i in range(10)
+    ]
+    assert bearer.executor is not None
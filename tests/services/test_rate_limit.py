@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from auth.rate_limit import (
+    CacheRateLimitStore,
+    InMemoryRateLimitStore,
+    RateLimiter,
+    access_token_key,
+    client_ip_key,
+)
+from auth.upstream import AdaptiveConcurrencyLimiter, UpstreamUnavailable
+from cache.cache import RedisCache
+from tests.cache.fake_redis_server import FakeRedisServer
+
+
+def make_request(headers=None, client=("10.0.0.1", 1234)) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [(k.encode(), v.encode()) for k, v in (headers or {}).items()],
+            "client": client,
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def redis_server():
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(params=["memory", "cache"])
+def store(request, redis_server):
+    if request.param == "memory":
+        return InMemoryRateLimitStore()
+    return CacheRateLimitStore(RedisCache(redis_server.url))
+
+
+def test_token_bucket_allows_burst_then_rejects(store):
+    results = [store.take("client", capacity=3, rate=1) for _ in range(4)]
+
+    assert results[:3] == [0.0, 0.0, 0.0]
+    assert 0 < results[3] <= 1
+
+
+def test_token_bucket_refills(store):
+    for _ in range(2):
+        store.take("client", capacity=2, rate=20)
+    assert store.take("client", capacity=2, rate=20) > 0
+
+    time.sleep(0.1)
+    assert store.take("client", capacity=2, rate=20) == 0.0
+
+
+def test_rate_limiter_rejects_with_retry_after():
+    limiter = RateLimiter("test", capacity=1, rate=0.5, store=InMemoryRateLimitStore())
+
+    limiter(make_request())
+    with pytest.raises(HTTPException) as exception:
+        limiter(make_request())
+
+    assert exception.value.status_code == 429
+    assert exception.value.headers == {"Retry-After": "2"}
+    # Other clients have their own bucket
+    limiter(make_request(client=("10.0.0.2", 1234)))
+
+
+def test_token_bucket_charges_cost(store):
+    assert store.take("batch_client", capacity=10, rate=1, cost=8) == 0.0
+    assert store.take("batch_client", capacity=10, rate=1, cost=3) > 0
+    assert store.take("batch_client", capacity=10, rate=1, cost=2) == 0.0
+
+
+def test_rate_limiter_does_not_run_on_the_event_loop():
+    loops = []
+
+    class RecordingStore(InMemoryRateLimitStore):
+        def take(self, key, capacity, rate, cost=1):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return super().take(key, capacity, rate, cost)
+
+    app = FastAPI()
+    limiter = RateLimiter("test", capacity=5, rate=1, store=RecordingStore())
+    app.get("/", dependencies=[Depends(limiter)])(lambda: "ok")
+
+    assert TestClient(app).get("/").status_code == 200
+    assert loops == [None]
+
+
+def test_client_ip_key_behind_trusted_gateway():
+    keys = []
+
+    async def app(scope, receive, send):
+        keys.append(client_ip_key(Request(scope)))
+
+    gateway = ProxyHeadersMiddleware(app, trusted_hosts="10.0.0.0/8")
+
+    def call(client, forwarded_for):
+        scope = {
+            "type": "http",
+            "scheme": "http",
+            "client": client,
+            "headers": [(b"x-forwarded-for", forwarded_for.encode())],
+        }
+        asyncio.run(gateway(scope, None, None))
+
+    call(("10.1.2.3", 1234), "203.0.113.7")
+    call(("10.1.2.3", 1234), "198.51.100.9")
+    # Clients can not spoof the header without going through the gateway
+    call(("203.0.113.50", 1234), "198.51.100.9")
+
+    assert keys == ["203.0.113.7", "198.51.100.9", "203.0.113.50"]
+
+
+def test_access_token_key_does_not_trust_claims():
+    first = make_request({"authorization": "Bearer a.b.c"})
+    second = make_request({"authorization": "Bearer a.b.d"})
+
+    assert access_token_key(first) != access_token_key(second)
+    assert access_token_key(make_request()) == "ip:10.0.0.1"
+
+
+def test_concurrency_limiter_sheds_excess_calls():
+    limiter = AdaptiveConcurrencyLimiter("stub", initial_limit=2, min_limit=1)
+    release = threading.Event()
+
+    @limiter.limited
+    def slow_call():
+        release.wait()
+
+    threads = [threading.Thread(target=slow_call) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while limiter.in_flight < 2:
+        time.sleep(0.001)
+
+    with pytest.raises(UpstreamUnavailable):
+        slow_call()
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert limiter.in_flight == 0
+
+
+def test_concurrency_limiter_adapts_to_latency_and_errors():
+    limiter = AdaptiveConcurrencyLimiter(
+        "stub", initial_limit=10, min_limit=2, max_limit=20, target_latency=0.01
+    )
+
+    limiter.acquire()
+    limiter.release(latency=1.0)
+    assert limiter.limit == pytest.approx(9)
+
+    limiter.acquire()
+    limiter.release(latency=0.001, failed=True)
+    assert limiter.limit == pytest.approx(8.1)
+
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(latency=0.001)
+    assert 8.1 < limiter.limit <= 20
@@ -0,0 +1,188 @@
+import datetime
+import time
+import pytest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from fastapi import HTTPException
+
+from auth.JWTBearer import JWTBearer
+from auth.revocation import (
+    RevocationSet,
+    drain_outbox,
+    hash_token,
+    is_revoked_locally,
+    load_revocations,
+    revoke_locally,
+    revoke_token,
+)
+from auth.upstream import UpstreamUnavailable
+from cache.cache import get_cache
+from db.database import Base
+from models.revocation import RevocationOutbox, utcnow
+from repositories.revocationRepo import add_revocation
+from tests.services.jwt_factory import JWTFactory, authenticate
+
+factory = JWTFactory()
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+
+
+class StubCognito:
+    """Stub of logout_with_token that is down until told otherwise."""
+
+    def __init__(self):
+        self.down = True
+        self.signed_out = []
+
+    def __call__(self, access_token):
+        if self.down:
+            raise UpstreamUnavailable("Cognito is unavailable")
+        self.signed_out.append(access_token)
+        return True
+
+
+def outbox_row(db, token):
+    return (
+        db.query(RevocationOutbox)
+        .filter(RevocationOutbox.token_hash == hash_token(token))
+        .one()
+    )
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+def test_logout_while_cognito_is_down_then_recovers(mock_user_info_with_token, db):
+    cognito = StubCognito()
+    bearer = JWTBearer(factory.jwks)
+    token = factory.token(username="logout_user")
+    expires_at = time.time() + 3600
+
+    with patch("auth.revocation.logout_with_token", cognito):
+        revoke_token(token, "logout_user", expires_at, db)
+
+        # Revoked for this service right away, while Cognito is down
+        with pytest.raises(HTTPException) as exception:
+            authenticate(bearer, token)
+        assert exception.value.detail == "Access token has been revoked"
+
+        assert drain_outbox(db) == 0
+        row = outbox_row(db, token)
+        assert row.attempts == 1
+        assert row.sent_at is None
+        assert row.next_attempt_at > utcnow()
+
+        # Not due yet
+        cognito.down = False
+        assert drain_outbox(db) == 0
+
+        later = utcnow() + datetime.timedelta(seconds=10)
+        assert drain_outbox(db, now=later) == 1
+
+    row = outbox_row(db, token)
+    assert cognito.signed_out == [token]
+    assert row.sent_at == later
+    assert row.access_token is None
+
+
+def test_logout_twice_adds_one_row(db):
+    token = factory.token(username="twice_user")
+
+    for _ in range(2):
+        revoke_token(token, "twice_user", time.time() + 3600, db)
+
+    assert db.query(RevocationOutbox).count() == 1
+
+
+def test_already_revoked_tokens_are_done(db):
+    token = factory.token(username="revoked_user")
+    revoke_token(token, "revoked_user", time.time() + 3600, db)
+    error = ClientError({"Error": {"Code": "NotAuthorizedException"}}, "GlobalSignOut")
+
+    with patch("auth.revocation.logout_with_token", side_effect=error):
+        assert drain_outbox(db) == 1
+
+
+def test_outbox_is_drained_in_batches(db):
+    cognito = StubCognito()
+    cognito.down = False
+    tokens = [factory.token(username=f"batch_user{i}") for i in range(5)]
+    for token in tokens:
+        revoke_token(token, None, time.time() + 3600, db)
+
+    with patch("auth.revocation.OUTBOX_BATCH_SIZE", 2), patch(
+        "auth.revocation.logout_with_token", cognito
+    ):
+        assert [drain_outbox(db) for _ in range(4)] == [2, 2, 1, 0]
+
+    assert sorted(cognito.signed_out) == sorted(tokens)
+
+
+@pytest.fixture
+def revoked_tokens():
+    revoked_tokens = RevocationSet()
+    with patch("auth.revocation.revoked_tokens", revoked_tokens):
+        yield revoked_tokens
+
+
+def test_load_revocations_restores_local_revocations(db, revoked_tokens):
+    token = factory.token(username="restored_user")
+    revoke_token(token, None, time.time() + 3600, db)
+
+    # Restarted
+    with patch("auth.revocation.revoked_tokens", RevocationSet()):
+        assert not is_revoked_locally(token)
+        assert load_revocations(db) == 1
+        assert is_revoked_locally(token)
+
+
+def test_load_revocations_picks_up_other_replicas(db, revoked_tokens):
+    assert load_revocations(db) == 0
+    token = factory.token(username="other_replica_user")
+    # Logged out through another replica
+    add_revocation(
+        hash_token(token),
+        token,
+        None,
+        utcnow() + datetime.timedelta(hours=1),
+        db,
+    )
+    assert not is_revoked_locally(token)
+
+    assert load_revocations(db) == 1
+    assert is_revoked_locally(token)
+
+
+@patch("auth.JWTBearer.user_info_with_token")
+def test_revocations_are_not_evicted_from_the_cache(
+    mock_user_info_with_token, db, revoked_tokens
+):
+    bearer = JWTBearer(factory.jwks)
+    token = factory.token(username="evicted_user")
+    revoke_token(token, None, time.time() + 3600, db)
+
+    get_cache().clear()
+
+    with pytest.raises(HTTPException) as exception:
+        authenticate(bearer, token)
+    assert exception.value.detail == "Access token has been revoked"
+
+
+def test_revocations_are_kept_until_expired_tokens_are_rejected(revoked_tokens):
+    now = time.time()
+    revoke_locally("recently_expired", now - 10)
+    revoke_locally("long_expired", now - 3600)
+    revoked_tokens.prune(now)
+
+    assert "recently_expired" in revoked_tokens
+    assert "long_expired" not in revoked_tokens
@@ -0,0 +1,201 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from unittest.mock import patch
+
+from auth import user_auth
+from auth.upstream import (
+    AdaptiveConcurrencyLimiter,
+    CircuitBreaker,
+    RetryBudget,
+    UpstreamPolicy,
+    UpstreamUnavailable,
+)
+from auth.user_auth import auth_with_code, is_upstream_failure
+
+
+class StubTokenEndpoint(ThreadingHTTPServer):
+    """Token endpoint that answers with a configurable delay and status."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubTokenHandler)
+        self.delay = 0.0
+        self.status = 200
+        self.hits = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}/oauth2/token"
+
+
+class StubTokenHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.hits += 1
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.delay)
+        body = b'{"access_token": "access_token", "expires_in": 3600}'
+        try:
+            self.send_response(self.server.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # The client gave up
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def token_endpoint(monkeypatch):
+    server = StubTokenEndpoint()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("COGNITO_TOKEN_ENDPOINT", server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_cognito_policy():
+    with patch.object(user_auth.cognito, "breaker", CircuitBreaker("Cognito")), patch.object(
+        user_auth.cognito, "budget", RetryBudget()
+    ), patch.object(user_auth.cognito, "base_delay", 0.001):
+        yield
+
+
+def flaky(failures: int, exception: Exception = None):
+    """Stub upstream call failing ``failures`` times before answering."""
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise exception or requests.ConnectionError("connection refused")
+        return "ok"
+
+    return call, calls
+
+
+def make_policy(**kwargs):
+    options = {
+        "breaker": CircuitBreaker("stub", window=4, min_calls=4, reset_timeout=0.05),
+        "budget": RetryBudget(),
+        "max_attempts": 3,
+        "base_delay": 0.001,
+    }
+    options.update(kwargs)
+    return UpstreamPolicy("stub", is_failure=is_upstream_failure, **options)
+
+
+def test_slow_token_endpoint_times_out(token_endpoint):
+    token_endpoint.delay = 1.0
+
+    started = time.monotonic()
+    with patch("auth.user_auth.COGNITO_READ_TIMEOUT", 0.1):
+        with pytest.raises(UpstreamUnavailable):
+            auth_with_code("code", "redirect_uri")
+
+    assert time.monotonic() - started < 0.8
+    # The authorization code is single-use, so read timeouts are not retried
+    assert token_endpoint.hits == 1
+
+
+def test_failing_token_endpoint_is_unavailable(token_endpoint):
+    token_endpoint.status = 503
+
+    with pytest.raises(UpstreamUnavailable):
+        auth_with_code("code", "redirect_uri")
+
+
+def test_healthy_token_endpoint(token_endpoint):
+    result = auth_with_code("code", "redirect_uri")
+
+    assert result == {
+        "token": "access_token",
+        "expires_in": 3600,
+        "refresh_token": None,
+    }
+
+
+def test_transient_failures_are_retried():
+    call, calls = flaky(failures=2)
+
+    assert make_policy().call(call) == "ok"
+    assert len(calls) == 3
+
+
+def test_client_errors_are_not_retried():
+    call, calls = flaky(failures=1, exception=KeyError("bug"))
+
+    with pytest.raises(KeyError):
+        make_policy().call(call)
+    assert len(calls) == 1
+
+
+def test_retries_stop_when_budget_is_spent():
+    policy = make_policy(
+        budget=RetryBudget(ratio=0, min_per_second=0, max_tokens=2),
+        breaker=CircuitBreaker("stub", min_calls=100),
+    )
+    call, calls = flaky(failures=100)
+
+    for _ in range(5):
+        with pytest.raises(UpstreamUnavailable):
+            policy.call(call)
+
+    # 5 calls and only the 2 retries the budget allowed
+    assert len(calls) == 7
+
+
+def test_breaker_opens_fails_fast_and_recovers():
+    policy = make_policy(max_attempts=1)
+    call, calls = flaky(failures=4)
+
+    for _ in range(4):
+        with pytest.raises(UpstreamUnavailable):
+            policy.call(call)
+    assert policy.breaker.state == CircuitBreaker.OPEN
+
+    # Open: rejected without calling the upstream service
+    with pytest.raises(UpstreamUnavailable):
+        policy.call(call)
+    assert len(calls) == 4
+
+    time.sleep(0.06)
+    assert policy.call(call) == "ok"
+    assert policy.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_reopens_when_trial_call_fails():
+    policy = make_policy(max_attempts=1)
+    call, calls = flaky(failures=5)
+
+    for _ in range(4):
+        with pytest.raises(UpstreamUnavailable):
+            policy.call(call)
+    time.sleep(0.06)
+
+    with pytest.raises(UpstreamUnavailable):
+        policy.call(call)
+    assert policy.breaker.state == CircuitBreaker.OPEN
+    assert len(calls) == 5
+
+
+def test_shed_calls_do_not_count_as_failures():
+    limiter = AdaptiveConcurrencyLimiter("stub", initial_limit=1, min_limit=1)
+    policy = make_policy(limiter=limiter)
+    limiter.acquire()
+
+    for _ in range(10):
+        with pytest.raises(UpstreamUnavailable):
+            policy.call(lambda: "ok")
+
+    assert policy.breaker.state == CircuitBreaker.CLOSED